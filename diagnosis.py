@@ -1,27 +1,29 @@
 from . import normal
-from .util import configs, functional, experimentor
-import copy
+from .util import functional, experimentor
 import warnings
 
 class Triplet_bias():
-    def __init__(self):
-        self.contextual = Contextual_bias()
-        self.domain = Domain_bias()
-        self.post = Post_bias()
+    def __init__(self, lazy_load = False):
+        self.contextual = Contextual_bias(lazy_load = lazy_load)
+        self.domain = Domain_bias(lazy_load = lazy_load)
+        self.post = Post_bias(lazy_load = lazy_load)
     
     def __call__(
         self, 
         list_of_forward_inference: list[callable], # for each dataset, you should give a forward_inference function. If you just give one, we will expand it to the length of the benchmark.
         return_divided_results = True,
-        batched_inference = False
+        batched_inference = False,
+        chunk_size = None,
+        checkpoint_directory = None
     ):
-        return self.auto_run(list_of_forward_inference, return_divided_results, batched_inference)
+        return self.auto_run(list_of_forward_inference, return_divided_results, batched_inference, chunk_size, checkpoint_directory = checkpoint_directory)
     
-    def auto_run(self, list_of_forward_inference, return_divided_results, batched_inference):
+    def auto_run(self, list_of_forward_inference, return_divided_results, batched_inference, chunk_size = None, checkpoint_directory = None):
+        # checkpoint_directory: one directory for all the 3 sub-benchmarks; see Normal.auto_run.
         return {
-            "contextual": self.contextual.auto_run(list_of_forward_inference, return_divided_results, batched_inference),
-            "domain": self.domain.auto_run(list_of_forward_inference, return_divided_results, batched_inference),
-            "post": self.post.auto_run(list_of_forward_inference, return_divided_results, batched_inference)
+            "contextual": self.contextual.auto_run(list_of_forward_inference, return_divided_results, batched_inference, chunk_size, checkpoint_directory = checkpoint_directory),
+            "domain": self.domain.auto_run(list_of_forward_inference, return_divided_results, batched_inference, chunk_size, checkpoint_directory = checkpoint_directory),
+            "post": self.post.auto_run(list_of_forward_inference, return_divided_results, batched_inference, chunk_size, checkpoint_directory = checkpoint_directory)
         }
 
 class Contextual_bias(normal.Normal):
@@ -33,57 +35,28 @@ class Contextual_bias(normal.Normal):
             "entropy": functional.bias_mean_entropy_metric,
             "distribution": functional.bias_mean_metric,
         },
-        datasets = normal.ORIGINAL_DATA_LOADER_NORMAL
+        datasets = normal.ORIGINAL_DATA_LOADER_NORMAL,
+        lazy_load = False
     ):
         self.experimentor = []
         self._original_data = []
         self._default_data = datasets
+        self._lazy_load = lazy_load
         self._load_data()
         self.metrics = metrics
         self.noisy_channel = noisy_channel
 
         self.re_initialize(k = k, noisy_channel = self.noisy_channel)
 
-    def re_initialize(self, k: int = 4, noisy_channel = False, keep_prompter = False): 
-        print("Initializing experimentor on k = {}...\n".format(k))
-        self.experimentor = []
-        if keep_prompter:
-            old_prompter = []
-            for exp in self.experimentor:
-                old_prompter.append(copy.deepcopy(exp.prompt_former))
-        for data in self._original_data:
-            if data.get_dataset_name() == "financial_phrasebank":
-                self.experimentor.append(
-                    experimentor.prior_bias_experimentor(
-                        original_dataset = data, 
-                        k=k, 
-                        metrics=self.metrics, 
-                        dividing=[configs.STANDARD_SETTINGS["split_for_FP"]["calibration_number"], configs.STANDARD_SETTINGS["split_for_FP"]["demonstration_number"], configs.STANDARD_SETTINGS["split_for_FP"]["test_number"]],
-                        noisy_channel = noisy_channel,
-                        bias_type = "contextual"
-                        )
-                    )
-            elif data.get_dataset_name() == "tweet_eval_emotion":
-                self.experimentor.append(
-                    experimentor.prior_bias_experimentor(
-                        original_dataset = data, 
-                        k=k, 
-                        metrics=self.metrics, 
-                        dividing=[configs.STANDARD_SETTINGS["split_for_TEE"]["calibration_number"], configs.STANDARD_SETTINGS["split_for_TEE"]["demonstration_number"], configs.STANDARD_SETTINGS["split_for_TEE"]["test_number"]],
-                        noisy_channel = noisy_channel,
-                        bias_type = "contextual"
-                        )
-                    )
-            else:
-                self.experimentor.append(
-                    experimentor.prior_bias_experimentor(original_dataset = data, k=k, metrics=self.metrics, noisy_channel=noisy_channel, bias_type = "contextual")
-                )
-        if keep_prompter:
-            count = 0
-            for exp in self.experimentor:
-                exp.prompt_former = old_prompter[count]
-                count += 1
-        print("Ready.\n")
+    def _build_experimentor(self, data):
+        return experimentor.prior_bias_experimentor(
+            original_dataset = data, 
+            k = self._k, 
+            metrics = self.metrics, 
+            dividing = self._get_dividing(data.get_dataset_name()),
+            noisy_channel = self._experimentor_noisy_channel,
+            bias_type = "contextual"
+        )
 
 
 class Domain_bias(normal.Normal):
@@ -96,11 +69,13 @@ class Domain_bias(normal.Normal):
             "distribution": functional.bias_mean_metric,
         },
         datasets = normal.ORIGINAL_DATA_LOADER_NORMAL,
-        domain_query_length = 128
+        domain_query_length = 128,
+        lazy_load = False
     ):
         self.experimentor = []
         self._original_data = []
         self._default_data = datasets
+        self._lazy_load = lazy_load
         self._load_data()
         self.metrics = metrics
         self.noisy_channel = noisy_channel
@@ -108,48 +83,16 @@ class Domain_bias(normal.Normal):
 
         self.re_initialize(k = k, noisy_channel = self.noisy_channel)
 
-    def re_initialize(self, k: int = 4, noisy_channel = False, keep_prompter = False): 
-        print("Initializing experimentor on k = {}...\n".format(k))
-        self.experimentor = []
-        if keep_prompter:
-            old_prompter = []
-            for exp in self.experimentor:
-                old_prompter.append(copy.deepcopy(exp.prompt_former))
-        for data in self._original_data:
-            if data.get_dataset_name() == "financial_phrasebank":
-                self.experimentor.append(
-                    experimentor.prior_bias_experimentor(
-                        original_dataset = data, 
-                        k=k, 
-                        metrics=self.metrics, 
-                        dividing=[configs.STANDARD_SETTINGS["split_for_FP"]["calibration_number"], configs.STANDARD_SETTINGS["split_for_FP"]["demonstration_number"], configs.STANDARD_SETTINGS["split_for_FP"]["test_number"]],
-                        noisy_channel = noisy_channel,
-                        bias_type = "domain",
-                        domain_query_length = self.domain_query_length
-                        )
-                    )
-            elif data.get_dataset_name() == "tweet_eval_emotion":
-                self.experimentor.append(
-                    experimentor.prior_bias_experimentor(
-                        original_dataset = data, 
-                        k=k, 
-                        metrics=self.metrics, 
-                        dividing=[configs.STANDARD_SETTINGS["split_for_TEE"]["calibration_number"], configs.STANDARD_SETTINGS["split_for_TEE"]["demonstration_number"], configs.STANDARD_SETTINGS["split_for_TEE"]["test_number"]],
-                        noisy_channel = noisy_channel,
-                        bias_type = "domain",
-                        domain_query_length = self.domain_query_length
-                        )
-                    )
-            else:
-                self.experimentor.append(
-                    experimentor.prior_bias_experimentor(original_dataset = data, k=k, metrics=self.metrics, noisy_channel=noisy_channel, bias_type = "domain", domain_query_length = self.domain_query_length)
-                )
-        if keep_prompter:
-            count = 0
-            for exp in self.experimentor:
-                exp.prompt_former = old_prompter[count]
-                count += 1
-        print("Ready.\n")
+    def _build_experimentor(self, data):
+        return experimentor.prior_bias_experimentor(
+            original_dataset = data, 
+            k = self._k, 
+            metrics = self.metrics, 
+            dividing = self._get_dividing(data.get_dataset_name()),
+            noisy_channel = self._experimentor_noisy_channel,
+            bias_type = "domain",
+            domain_query_length = self.domain_query_length
+        )
 
 
 class Post_bias(normal.Normal):
@@ -162,11 +105,13 @@ class Post_bias(normal.Normal):
             "distribution": functional.post_bias_dis_metric,
         },
         datasets = normal.ORIGINAL_DATA_LOADER_NORMAL,
-        domain_query_length = 128
+        domain_query_length = 128,
+        lazy_load = False
     ):
         self.experimentor = []
         self._original_data = []
         self._default_data = datasets
+        self._lazy_load = lazy_load
         self._load_data()
         self.metrics = metrics
         self.noisy_channel = noisy_channel
@@ -174,44 +119,14 @@ class Post_bias(normal.Normal):
 
         self.re_initialize(k = k, noisy_channel = self.noisy_channel)
 
-    def re_initialize(self, k: int = 4, noisy_channel = False, keep_prompter = False): 
-        print("Initializing experimentor on k = {}...\n".format(k))
-        self.experimentor = []
-        if keep_prompter:
-            old_prompter = []
-            for exp in self.experimentor:
-                old_prompter.append(copy.deepcopy(exp.prompt_former))
-        for data in self._original_data:
-            if data.get_dataset_name() == "financial_phrasebank":
-                self.experimentor.append(
-                    experimentor.post_bias_experimentor(
-                        original_dataset = data, 
-                        k=k, 
-                        metrics=self.metrics, 
-                        dividing=[configs.STANDARD_SETTINGS["split_for_FP"]["calibration_number"], configs.STANDARD_SETTINGS["split_for_FP"]["demonstration_number"], configs.STANDARD_SETTINGS["split_for_FP"]["test_number"]],
-                        noisy_channel = noisy_channel,
-                        )
-                    )
-            elif data.get_dataset_name() == "tweet_eval_emotion":
-                self.experimentor.append(
-                    experimentor.post_bias_experimentor(
-                        original_dataset = data, 
-                        k=k, 
-                        metrics=self.metrics, 
-                        dividing=[configs.STANDARD_SETTINGS["split_for_TEE"]["calibration_number"], configs.STANDARD_SETTINGS["split_for_TEE"]["demonstration_number"], configs.STANDARD_SETTINGS["split_for_TEE"]["test_number"]],
-                        noisy_channel = noisy_channel,
-                        )
-                    )
-            else:
-                self.experimentor.append(
-                    experimentor.post_bias_experimentor(original_dataset = data, k=k, metrics=self.metrics, noisy_channel=noisy_channel)
-                )
-        if keep_prompter:
-            count = 0
-            for exp in self.experimentor:
-                exp.prompt_former = old_prompter[count]
-                count += 1
-        print("Ready.\n")
+    def _build_experimentor(self, data):
+        return experimentor.post_bias_experimentor(
+            original_dataset = data, 
+            k = self._k, 
+            metrics = self.metrics, 
+            dividing = self._get_dividing(data.get_dataset_name()),
+            noisy_channel = self._experimentor_noisy_channel,
+        )
 
 
 class GLER(normal.Normal):
@@ -225,11 +140,13 @@ class GLER(normal.Normal):
             "expected_calibration_error_1": functional.expected_calibration_error_1
         },
         datasets = normal.ORIGINAL_DATA_LOADER_NORMAL,
-        interpolations = 5
+        interpolations = 5,
+        lazy_load = False
     ):
         self.experimentor = []
         self._original_data = []
         self._default_data = datasets
+        self._lazy_load = lazy_load
         self._load_data()
         self.metrics = metrics
         self.noisy_channel = False
@@ -237,52 +154,26 @@ class GLER(normal.Normal):
 
         self.re_initialize(k = k, noisy_channel = self.noisy_channel)
     
-    def re_initialize(self, k: int = 4, noisy_channel = False, keep_prompter = False):
-        print("Initializing experimentor on k = {}...\n".format(k))
-        self.experimentor = []
-        if keep_prompter:
-            old_prompter = []
-            for exp in self.experimentor:
-                old_prompter.append(copy.deepcopy(exp.prompt_former))
-        for data in self._original_data:
-            if data.get_dataset_name() == "financial_phrasebank":
-                self.experimentor.append(
-                    experimentor.GLER_experimentor(
-                        original_dataset = data, 
-                        k=k, 
-                        sensitivity_test = self.interpolations,
-                        metrics=self.metrics, 
-                        dividing=[configs.STANDARD_SETTINGS["split_for_FP"]["calibration_number"], configs.STANDARD_SETTINGS["split_for_FP"]["demonstration_number"], configs.STANDARD_SETTINGS["split_for_FP"]["test_number"]],
-                        noisy_channel = noisy_channel,
-                        )
-                    )
-            elif data.get_dataset_name() == "tweet_eval_emotion":
-                self.experimentor.append(
-                    experimentor.GLER_experimentor(
-                        original_dataset = data, 
-                        k=k, 
-                        sensitivity_test = self.interpolations,
-                        metrics=self.metrics, 
-                        dividing=[configs.STANDARD_SETTINGS["split_for_TEE"]["calibration_number"], configs.STANDARD_SETTINGS["split_for_TEE"]["demonstration_number"], configs.STANDARD_SETTINGS["split_for_TEE"]["test_number"]],
-                        noisy_channel = noisy_channel,
-                        )
-                    )
-            else:
-                self.experimentor.append(
-                    experimentor.GLER_experimentor(original_dataset = data, k=k, metrics=self.metrics, noisy_channel=noisy_channel, sensitivity_test = self.interpolations)
-                )
-        if keep_prompter:
-            count = 0
-            for exp in self.experimentor:
-                exp.prompt_former = old_prompter[count]
-                count += 1
-        print("Ready.\n")
+    def _build_experimentor(self, data):
+        return experimentor.GLER_experimentor(
+            original_dataset = data, 
+            k = self._k, 
+            sensitivity_test = self.interpolations,
+            metrics = self.metrics, 
+            dividing = self._get_dividing(data.get_dataset_name()),
+            noisy_channel = self._experimentor_noisy_channel,
+        )
+    
+    def __call__(self, forward_inference: callable, return_divided_results = True, batched_inference = False, chunk_size = None, checkpoint_directory = None):
+        return self.auto_run(forward_inference, return_divided_results, batched_inference, chunk_size, checkpoint_directory = checkpoint_directory)
     
     def auto_run(
         self, 
         list_of_forward_inference: list[callable], # for each dataset, you should give a forward_inference function. If you just give one, we will expand it to the length of the benchmark.
         return_divided_results = True,
-        batched_inference = False
+        batched_inference = False,
+        chunk_size = None, # Only for batched_inference. See single_experimentor.auto_run.
+        checkpoint_directory = None # A directory to record the predictions of each pass durably. A restarted run skips the recorded ones. See Normal.auto_run.
     ):
         count = 0
         if type(list_of_forward_inference) != list:
@@ -297,10 +188,11 @@ class GLER(normal.Normal):
         ret_sum = {}
         for name, metric in self.metrics.items():
             ret_sum[name] = 0
-        for i, single_experimentor in enumerate(self.experimentor):
+        for i in range(len(self.experimentor)):
+            single_experimentor = self._get_experimentor(i)
             count += 1
             print("\n\nExperiment {} in {}".format(count, len(self.experimentor)))
-            temp_res, success = single_experimentor(forward_inference = list_of_forward_inference[i], batched_inference = batched_inference)
+            temp_res, success = single_experimentor.auto_run(forward_inference = list_of_forward_inference[i], batched_inference = batched_inference, chunk_size = chunk_size, checkpoint_directory = checkpoint_directory)
             ret_divided[single_experimentor.triplet_dataset.dataset_name] = temp_res
             if not success:
                 warnings.warn("The experimentor on the dataset " + single_experimentor.triplet_dataset.get_dataset_name() + " failed.")
@@ -326,57 +218,38 @@ class Template_sens(normal.Normal):
             "consistency": functional.consistency,
         },
         datasets = normal.ORIGINAL_DATA_LOADER_NORMAL,
+        lazy_load = False
     ):
         self.experimentor = []
         self._original_data = []
         self._default_data = datasets
+        self._lazy_load = lazy_load
         self._load_data()
         self.metrics = metrics
 
         self.re_initialize(k = k)
     
     def re_initialize(self, k: int = 4, keep_prompter = False):
-        print("Initializing experimentor on k = {}...\n".format(k))
-        self.experimentor = []
-        if keep_prompter:
-            old_prompter = []
-            for exp in self.experimentor:
-                old_prompter.append(copy.deepcopy(exp.prompt_former))
-        for data in self._original_data:
-            if data.get_dataset_name() == "financial_phrasebank":
-                self.experimentor.append(
-                    experimentor.template_sensitivity_experimentor(
-                        original_dataset = data, 
-                        k=k, 
-                        metrics=self.metrics, 
-                        dividing=[configs.STANDARD_SETTINGS["split_for_FP"]["calibration_number"], configs.STANDARD_SETTINGS["split_for_FP"]["demonstration_number"], 100],
-                        )
-                    )
-            elif data.get_dataset_name() == "tweet_eval_emotion":
-                self.experimentor.append(
-                    experimentor.template_sensitivity_experimentor(
-                        original_dataset = data, 
-                        k=k, 
-                        metrics=self.metrics, 
-                        dividing=[configs.STANDARD_SETTINGS["split_for_TEE"]["calibration_number"], configs.STANDARD_SETTINGS["split_for_TEE"]["demonstration_number"], 100],
-                        )
-                    )
-            else:
-                self.experimentor.append(
-                    experimentor.template_sensitivity_experimentor(original_dataset = data, k=k, metrics=self.metrics)
-                )
-        if keep_prompter:
-            count = 0
-            for exp in self.experimentor:
-                exp.prompt_former = old_prompter[count]
-                count += 1
-        print("Ready.\n")
+        super().re_initialize(k = k, keep_prompter = keep_prompter)
+
+    def _build_experimentor(self, data):
+        return experimentor.template_sensitivity_experimentor(
+            original_dataset = data, 
+            k = self._k, 
+            metrics = self.metrics, 
+            dividing = self._get_dividing(data.get_dataset_name(), test_number = 100),
+        )
+    
+    def __call__(self, forward_inference: callable, return_divided_results = True, batched_inference = False, chunk_size = None, checkpoint_directory = None):
+        return self.auto_run(forward_inference, return_divided_results, batched_inference, chunk_size, checkpoint_directory = checkpoint_directory)
     
     def auto_run(
         self, 
         list_of_forward_inference: list[callable], # for each dataset, you should give a forward_inference function. If you just give one, we will expand it to the length of the benchmark.
         return_divided_results = True,
-        batched_inference = False
+        batched_inference = False,
+        chunk_size = None, # Only for batched_inference. See single_experimentor.auto_run.
+        checkpoint_directory = None # A directory to record the predictions of each pass durably. A restarted run skips the recorded ones. See Normal.auto_run.
     ):
         count = 0
         if type(list_of_forward_inference) != list:
@@ -391,10 +264,11 @@ class Template_sens(normal.Normal):
         ret_sum = {}
         for name, metric in self.metrics.items():
             ret_sum[name] = 0
-        for i, single_experimentor in enumerate(self.experimentor):
+        for i in range(len(self.experimentor)):
+            single_experimentor = self._get_experimentor(i)
             count += 1
             print("\n\nExperiment {} in {}".format(count, len(self.experimentor)))
-            temp_res, success = single_experimentor(forward_inference = list_of_forward_inference[i], batched_inference = batched_inference)
+            temp_res, success = single_experimentor.auto_run(forward_inference = list_of_forward_inference[i], batched_inference = batched_inference, chunk_size = chunk_size, checkpoint_directory = checkpoint_directory)
             ret_divided[single_experimentor.triplet_dataset.dataset_name] = temp_res
             if not success:
                 warnings.warn("The experimentor on the dataset " + single_experimentor.triplet_dataset.get_dataset_name() + " failed.")
@@ -417,54 +291,36 @@ class Demo_sens(normal.Normal):
         self, 
         k=4,  
         datasets = normal.ORIGINAL_DATA_LOADER_NORMAL,
+        lazy_load = False
     ):
         self.experimentor = []
         self._original_data = []
         self._default_data = datasets
+        self._lazy_load = lazy_load
         self._load_data()
 
         self.re_initialize(k = k)
     
     def re_initialize(self, k: int = 4, keep_prompter = False):
-        print("Initializing experimentor on k = {}...\n".format(k))
-        self.experimentor = []
-        if keep_prompter:
-            old_prompter = []
-            for exp in self.experimentor:
-                old_prompter.append(copy.deepcopy(exp.prompt_former))
-        for data in self._original_data:
-            if data.get_dataset_name() == "financial_phrasebank":
-                self.experimentor.append(
-                    experimentor.demonstration_sensitivity_experimentor(
-                        original_dataset = data, 
-                        k=k, 
-                        dividing=[configs.STANDARD_SETTINGS["split_for_FP"]["calibration_number"], configs.STANDARD_SETTINGS["split_for_FP"]["demonstration_number"], configs.STANDARD_SETTINGS["split_for_TEE"]["test_number"]],
-                        )
-                    )
-            elif data.get_dataset_name() == "tweet_eval_emotion":
-                self.experimentor.append(
-                    experimentor.demonstration_sensitivity_experimentor(
-                        original_dataset = data, 
-                        k=k, 
-                        dividing=[configs.STANDARD_SETTINGS["split_for_TEE"]["calibration_number"], configs.STANDARD_SETTINGS["split_for_TEE"]["demonstration_number"], configs.STANDARD_SETTINGS["split_for_TEE"]["test_number"]],
-                        )
-                    )
-            else:
-                self.experimentor.append(
-                    experimentor.demonstration_sensitivity_experimentor(original_dataset = data, k=k)
-                )
-        if keep_prompter:
-            count = 0
-            for exp in self.experimentor:
-                exp.prompt_former = old_prompter[count]
-                count += 1
-        print("Ready.\n")
+        super().re_initialize(k = k, keep_prompter = keep_prompter)
+
+    def _build_experimentor(self, data):
+        return experimentor.demonstration_sensitivity_experimentor(
+            original_dataset = data, 
+            k = self._k, 
+            dividing = self._get_dividing(data.get_dataset_name()),
+        )
+    
+    def __call__(self, forward_inference: callable, return_divided_results = True, batched_inference = False, chunk_size = None, checkpoint_directory = None):
+        return self.auto_run(forward_inference, return_divided_results, batched_inference, chunk_size, checkpoint_directory = checkpoint_directory)
     
     def auto_run(
         self, 
         list_of_forward_inference: list[callable], # for each dataset, you should give a forward_inference function. If you just give one, we will expand it to the length of the benchmark.
         return_divided_results = True,
-        batched_inference = False
+        batched_inference = False,
+        chunk_size = None, # Only for batched_inference. See single_experimentor.auto_run.
+        checkpoint_directory = None # A directory to record the predictions of each pass durably. A restarted run skips the recorded ones. See Normal.auto_run.
     ):
         count = 0
         if type(list_of_forward_inference) != list:
@@ -479,10 +335,11 @@ class Demo_sens(normal.Normal):
         ret_sum = {}
         for name, metric in self[0].metrics.items():
             ret_sum[name] = 0
-        for i, single_experimentor in enumerate(self.experimentor):
+        for i in range(len(self.experimentor)):
+            single_experimentor = self._get_experimentor(i)
             count += 1
             print("\n\nExperiment {} in {}".format(count, len(self.experimentor)))
-            temp_res, success = single_experimentor(forward_inference = list_of_forward_inference[i], batched_inference = batched_inference)
+            temp_res, success = single_experimentor.auto_run(forward_inference = list_of_forward_inference[i], batched_inference = batched_inference, chunk_size = chunk_size, checkpoint_directory = checkpoint_directory)
             ret_divided[single_experimentor.triplet_dataset.dataset_name] = temp_res
             if not success:
                 warnings.warn("The experimentor on the dataset " + single_experimentor.triplet_dataset.get_dataset_name() + " failed.")
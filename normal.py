@@ -29,11 +29,13 @@ class Normal():
             "macro_F1": functional.macro_F1,
             "expected_calibration_error_1": functional.expected_calibration_error_1
         },
-        datasets = ORIGINAL_DATA_LOADER_NORMAL
+        datasets = ORIGINAL_DATA_LOADER_NORMAL,
+        lazy_load = False # If True, each dataset is loaded and its experimentor is built only when it is first accessed.
     ):
         self.experimentor = []
         self._original_data = []
         self._default_data = datasets
+        self._lazy_load = lazy_load
         self._load_data()
         self.metrics = metrics
         self.noisy_channel = noisy_channel
@@ -41,88 +43,132 @@ class Normal():
         self.re_initialize(k = k, noisy_channel = self.noisy_channel)
     
     def _load_data(self):
+        self._original_data = [None] * len(self._default_data)
+        if self._lazy_load:
+            return
         print("Loading data...\n")
-        count = 0
-        for data_loader in self._default_data:
-            self._original_data.append(data_loader())
-            count += 1
-            print("{} in {}".format(count, len(self._default_data)), "Data loaded: ", self._original_data[-1].get_dataset_name(), "\n")
+        for i in range(len(self._default_data)):
+            self._get_original_data(i)
 
         print("Data loaded successfully.\n")
 
-    def __call__(self, forward_inference: callable, return_divided_results = True, batched_inference = False):
-        return self.auto_run(forward_inference, return_divided_results, batched_inference)
+    def _get_original_data(self, index):
+        # Load the `index`-th dataset on the first access.
+        if self._original_data[index] is None:
+            self._original_data[index] = hgf_dataset_loader.load_shared_dataset(self._default_data[index])
+            print("{} in {}".format(index + 1, len(self._default_data)), "Data loaded: ", self._original_data[index].get_dataset_name(), "\n")
+        return self._original_data[index]
+
+    def _get_dividing(self, dataset_name, test_number = None):
+        # The standard [calibration, demonstration, test] split sizes of the dataset.
+        if dataset_name == "financial_phrasebank":
+            split = configs.STANDARD_SETTINGS["split_for_FP"]
+        elif dataset_name == "tweet_eval_emotion":
+            split = configs.STANDARD_SETTINGS["split_for_TEE"]
+        else:
+            split = configs.STANDARD_SETTINGS
+        if test_number is None:
+            test_number = split["test_number"]
+        return [split["calibration_number"], split["demonstration_number"], test_number]
+
+    def _build_experimentor(self, data):
+        # Build the experimentor of one dataset. Overloaded by the sub-benchmarks.
+        return experimentor.single_experimentor(
+            original_dataset = data, 
+            k = self._k, 
+            metrics = self.metrics, 
+            dividing = self._get_dividing(data.get_dataset_name()),
+            noisy_channel = self._experimentor_noisy_channel
+        )
+
+    def _get_experimentor(self, index):
+        # Build the `index`-th experimentor on the first access.
+        if self.experimentor[index] is None:
+            self.experimentor[index] = self._build_experimentor(self._get_original_data(index))
+            if self._kept_prompter is not None:
+                self.experimentor[index].prompt_former = self._kept_prompter[index]
+        return self.experimentor[index]
+
+    def __call__(
+        self, 
+        forward_inference: callable, 
+        return_divided_results = True, 
+        batched_inference = False, 
+        chunk_size = None, 
+        max_concurrency = None, 
+        executor = None, 
+        checkpoint_directory = None, 
+        return_outputs = False
+    ):
+        # See auto_run.
+        return self.auto_run(
+            forward_inference, 
+            return_divided_results, 
+            batched_inference, 
+            chunk_size, 
+            max_concurrency = max_concurrency, 
+            executor = executor, 
+            checkpoint_directory = checkpoint_directory, 
+            return_outputs = return_outputs
+        )
     
     def __repr__(self) -> str:
         return self.__str__()
     
     def __str__(self) -> str:
         ret = "--- Benchmark: StaICC Normal ---\n"
-        for exp in self.experimentor:
-            ret += str(exp) + "\n"
+        for i, exp in enumerate(self.experimentor):
+            if exp is None:
+                ret += "--- single experimentor (not loaded) ---\n" + str(self._default_data[i]) + "\n"
+            else:
+                ret += str(exp) + "\n"
         return ret
     
     def __len__(self):
         return len(self.experimentor)
     
     def __getitem__(self, index):
-        return self.experimentor[index]
+        if isinstance(index, slice):
+            return [self._get_experimentor(i) for i in range(len(self.experimentor))[index]]
+        return self._get_experimentor(range(len(self.experimentor))[index])
 
     def re_initialize(self, k: int = 4, noisy_channel = False, keep_prompter = False): # keep_prompter: UNTESTED
         print("Initializing experimentor on k = {}...\n".format(k))
-        self.experimentor = []
+        self._kept_prompter = None
         if keep_prompter:
-            old_prompter = []
-            for exp in self.experimentor:
-                old_prompter.append(copy.deepcopy(exp.prompt_former))
-        for data in self._original_data:
-            if data.get_dataset_name() == "financial_phrasebank":
-                self.experimentor.append(
-                    experimentor.single_experimentor(
-                        original_dataset = data, 
-                        k=k, 
-                        metrics=self.metrics, 
-                        dividing=[configs.STANDARD_SETTINGS["split_for_FP"]["calibration_number"], configs.STANDARD_SETTINGS["split_for_FP"]["demonstration_number"], configs.STANDARD_SETTINGS["split_for_FP"]["test_number"]],
-                        noisy_channel = noisy_channel
-                        )
-                    )
-            elif data.get_dataset_name() == "tweet_eval_emotion":
-                self.experimentor.append(
-                    experimentor.single_experimentor(
-                        original_dataset = data, 
-                        k=k, 
-                        metrics=self.metrics, 
-                        dividing=[configs.STANDARD_SETTINGS["split_for_TEE"]["calibration_number"], configs.STANDARD_SETTINGS["split_for_TEE"]["demonstration_number"], configs.STANDARD_SETTINGS["split_for_TEE"]["test_number"]],
-                        noisy_channel = noisy_channel
-                        )
-                    )
-            else:
-                self.experimentor.append(
-                    experimentor.single_experimentor(original_dataset = data, k=k, metrics=self.metrics, noisy_channel=noisy_channel)
-                )
-        if keep_prompter:
-            count = 0
-            for exp in self.experimentor:
-                exp.prompt_former = old_prompter[count]
-                count += 1
+            self._kept_prompter = [copy.deepcopy(exp.prompt_former) if exp is not None else None for exp in self.experimentor]
+        self._k = k
+        self._experimentor_noisy_channel = noisy_channel
+        self.experimentor = [None] * len(self._default_data)
+        if not self._lazy_load:
+            for i in range(len(self.experimentor)):
+                self._get_experimentor(i)
         print("Ready.\n")
     
     def get_experiment_data(self):
-        return [exp.triplet_dataset for exp in self.experimentor]
+        return [self._get_experimentor(i).triplet_dataset for i in range(len(self.experimentor))]
 
     def get_experimentors(self):
-        return self.experimentor
+        return [self._get_experimentor(i) for i in range(len(self.experimentor))]
 
     def get_label_spaces_for_experimentors(self):
-        return [exp.triplet_dataset.get_label_space() for exp in self.experimentor]
+        return [exp.triplet_dataset.get_label_space() for exp in self.get_experimentors()]
 
     def auto_run(
         self, 
-        list_of_forward_inference: list[callable], # for each dataset, you should give a forward_inference function. If you just give one, we will expand it to the length of the benchmark.
+        list_of_forward_inference: list[callable] = None, # for each dataset, you should give a forward_inference function. If you just give one, we will expand it to the length of the benchmark.
         return_divided_results = True,
-        batched_inference = False
+        batched_inference = False,
+        chunk_size = None, # Only for batched_inference. If given, the prompts are inputted into the forward_inference chunk by chunk. See single_experimentor.auto_run.
+        max_concurrency = None, # Only for asynchronous forward_inference or the executor. The max number of the calls in flight. See single_experimentor.auto_run.
+        executor = None, # An int for the number of threads, or a concurrent.futures.Executor, to run the forward_inference calls concurrently. See single_experimentor.auto_run.
+        checkpoint_directory = None, # A directory to record the predictions durably as they complete. A restarted run skips the recorded prompts. See single_experimentor.auto_run.
+        list_of_preentered_prediction: list = None, # For each dataset, the prediction aligned with its prompt_set (see single_experimentor.auto_run). If given, list_of_forward_inference is ignored.
+        return_outputs = False # If True, the result also has "Outputs": for each dataset, the predictions with the fingerprint of the experimentor configuration. Can be stored (JSON) and evaluated again by evaluate_from_outputs.
     ):
         count = 0
+        if list_of_preentered_prediction is not None and len(list_of_preentered_prediction) != len(self.experimentor):
+            raise ValueError("The length of list_of_preentered_prediction must be the same as the number of datasets in the benchmark.")
         if type(list_of_forward_inference) != list:
             list_of_forward_inference = [list_of_forward_inference] * len(self.experimentor)
         else:
@@ -135,10 +181,31 @@ class Normal():
         ret_sum = {}
         for name, metric in self.metrics.items():
             ret_sum[name] = 0
-        for i, single_experimentor in enumerate(self.experimentor):
+        outputs = []
+        for i in range(len(self.experimentor)):
+            single_experimentor = self._get_experimentor(i)
             count += 1
             print("\n\nExperiment {} in {}".format(count, len(self.experimentor)))
-            temp_res, success = single_experimentor(forward_inference = list_of_forward_inference[i], batched_inference = batched_inference)
+            # Before the run, since the pseudo queries of the domain bias move on with the run.
+            config = single_experimentor.get_prompt_config() if return_outputs else None
+            results = single_experimentor.auto_run(
+                forward_inference = list_of_forward_inference[i], 
+                preentered_prediction = list_of_preentered_prediction[i] if list_of_preentered_prediction is not None else None, 
+                batched_inference = batched_inference, 
+                chunk_size = chunk_size, 
+                max_concurrency = max_concurrency, 
+                executor = executor, 
+                checkpoint_directory = checkpoint_directory, 
+                return_outputs = return_outputs
+            )
+            temp_res, success = results[0], results[1]
+            if return_outputs:
+                outputs.append({
+                    "dataset": single_experimentor.triplet_dataset.get_dataset_name(),
+                    "config": config,
+                    "fingerprint": experimentor.config_fingerprint(config),
+                    "prediction": results[2]["prob."] if success else None,
+                })
             ret_divided[single_experimentor.triplet_dataset.dataset_name] = temp_res
             if not success:
                 warnings.warn("The experimentor on the dataset " + single_experimentor.triplet_dataset.get_dataset_name() + " failed.")
@@ -152,6 +219,32 @@ class Normal():
             ret_sum[name] /= len(self.experimentor)
         
         if return_divided_results:
-            return {"Divided results": ret_divided, "Averaged results": ret_sum}
+            ret = {"Divided results": ret_divided, "Averaged results": ret_sum}
         else:
-            return {"Averaged results": ret_sum}
\ No newline at end of file
+            ret = {"Averaged results": ret_sum}
+        if return_outputs:
+            ret["Outputs"] = outputs
+        return ret
+
+    def evaluate_from_outputs(self, outputs, return_divided_results = True):
+        # Compute the metrics of this benchmark from the outputs of a previous `auto_run(return_outputs = True)` (of this or another Normal-like benchmark), without inference.
+        #   E.g. Post_bias().evaluate_from_outputs(Normal().auto_run(..., return_outputs = True)), or a Normal with other metrics.
+        # outputs: the returned dictionary, or its "Outputs" list. Each experimentor should have the same configuration fingerprint (the same prompts), else ValueError.
+        if isinstance(outputs, dict):
+            if "Outputs" not in outputs:
+                raise ValueError("The outputs should be returned by auto_run(return_outputs = True).")
+            outputs = outputs["Outputs"]
+        if len(outputs) != len(self.experimentor):
+            raise ValueError("The outputs have {} datasets, but the benchmark has {}.".format(len(outputs), len(self.experimentor)))
+        for i in range(len(self.experimentor)):
+            config = self._get_experimentor(i).get_prompt_config()
+            if outputs[i]["fingerprint"] != experimentor.config_fingerprint(config):
+                stored = outputs[i].get("config") or {}
+                different_keys = sorted([key for key in set(config) | set(stored) if config.get(key) != stored.get(key)])
+                raise ValueError("The outputs of the dataset {} (position {}) were built with another configuration; different: {}.".format(outputs[i].get("dataset"), i, different_keys if len(stored) > 0 else "unknown"))
+            if outputs[i]["prediction"] is None:
+                raise ValueError("The outputs of the dataset {} (position {}) are from a failed experiment.".format(outputs[i].get("dataset"), i))
+        return self.auto_run(
+            return_divided_results = return_divided_results, 
+            list_of_preentered_prediction = [output["prediction"] for output in outputs]
+        )
\ No newline at end of file
@@ -0,0 +1,13 @@
+# The submodules are imported lazily at the first access (e.g. `StaICC.prefabricate_inference.model_kernel`),
+#   so importing StaICC doesn't import torch or numpy.
+import importlib
+
+_SUBMODULES = ["model_kernel", "prompt_template_edit", "standard_calibration"]
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module("." + name, __name__)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+def __dir__():
+    return sorted(set(globals().keys()) | set(_SUBMODULES))
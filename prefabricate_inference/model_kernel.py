@@ -1,5 +1,33 @@
 from ..util import functional
-import torch
+from ..util import configs
+import inspect
+import warnings
+import weakref
+
+# tokenizer -> {tuple(label_space): the token ids of the labels}. Weak, so a cached tokenizer can still be released.
+_label_token_ids_cache = weakref.WeakKeyDictionary()
+
+def _default_cache_empty():
+    # Empty the CUDA cache if CUDA is used. torch is imported here at the first call, not at the import of this module.
+    import torch
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+def get_label_token_ids(tokenizer, label_space: list[str]) -> list[int]:
+    # The token id of each label (the last token only), resolved once for each (tokenizer, label_space) and reused by all the calls.
+    # Warn if some labels share the same last token, since their probabilities can't be distinguished.
+    key = tuple(label_space)
+    try:
+        tokenizer_cache = _label_token_ids_cache.setdefault(tokenizer, {})
+    except TypeError:
+        tokenizer_cache = {} # Not weak-referenceable: no cache.
+    if key not in tokenizer_cache:
+        label_token_ids = [tokenizer(label).input_ids[-1] for label in label_space] # The last token only
+        if len(set(label_token_ids)) != len(label_token_ids):
+            collisions = [label for label, token in zip(label_space, label_token_ids) if label_token_ids.count(token) > 1]
+            warnings.warn(configs.WARNING_SETTINGS["label_token_collision"] + " Labels: " + str(collisions))
+        tokenizer_cache[key] = label_token_ids
+    return list(tokenizer_cache[key])
 
 def inference_standard_template(
     prompt, # Fixed parameter sign
@@ -7,28 +35,92 @@ def inference_standard_template(
 ):
     return [1/len(label_space)] * len(label_space)
 
+def _label_restricted_logits(model, last_hidden_states, label_token_ids: list[int]):
+    # The logits of the label tokens from the last hidden states (batch, hidden), by only the label rows of the output embeddings.
+    # The same as the full output head followed by the indexing: logits[:, label_token_ids].
+    import torch
+    output_embeddings = model.get_output_embeddings()
+    label_token_ids = torch.tensor(label_token_ids, dtype = torch.long, device = output_embeddings.weight.device)
+    logits = last_hidden_states.to(output_embeddings.weight.dtype) @ output_embeddings.weight[label_token_ids].T
+    if getattr(output_embeddings, "bias", None) is not None:
+        logits = logits + output_embeddings.bias[label_token_ids]
+    logits = logits.to(torch.float)
+    # The post-processing of the logits in some models (e.g. Cohere, Gemma 2).
+    if getattr(model.config, "logit_scale", None) is not None:
+        logits = logits * model.config.logit_scale
+    if getattr(model.config, "final_logit_softcapping", None) is not None:
+        logits = torch.tanh(logits / model.config.final_logit_softcapping) * model.config.final_logit_softcapping
+    return logits.cpu()
+
+def _last_logits_only_kwargs(model):
+    # Ask the model to compute the logits only for the last position if it supports (transformers >= 4.45), to save the (batch, length, vocabulary) logits.
+    parameters = inspect.signature(model.forward).parameters
+    if "logits_to_keep" in parameters:
+        return {"logits_to_keep": 1}
+    if "num_logits_to_keep" in parameters:
+        return {"num_logits_to_keep": 1}
+    return {}
+
+def _last_position_forward(model, input_ids, capture_hidden_state: bool, **kwargs):
+    # Run the model and return the logits (batch, vocabulary) and the final hidden states (batch, hidden) of the last position; the hidden states are None if not captured.
+    # Instead of output_hidden_states = True, which keeps the hidden states of every layer for the whole sequence,
+    #   the final hidden state is captured by a forward hook as the input of the output head (the same as hidden_states[-1]).
+    output_embeddings = model.get_output_embeddings()
+    if capture_hidden_state and output_embeddings is None:
+        result = model(input_ids, output_hidden_states = True, **kwargs)
+        return result.logits[:, -1], result.hidden_states[-1][:, -1]
+    captured = []
+    handle = None
+    if capture_hidden_state:
+        handle = output_embeddings.register_forward_hook(lambda module, inputs, output: captured.append(inputs[0][:, -1]))
+    try:
+        result = model(input_ids, **_last_logits_only_kwargs(model), **kwargs)
+    finally:
+        if handle is not None:
+            handle.remove()
+    return result.logits[:, -1], (captured[-1] if capture_hidden_state else None)
+
 def standard_ICL_inference_with_torch_Causal_LM(
     prompt: str,
     model: callable,
     tokenizer: callable,
     label_space: list[str],
-    cache_empty: callable = torch.cuda.empty_cache(), # GPU cache empty function. Can be torch.cuda.empty_cache.
+    cache_empty: callable = _default_cache_empty, # GPU cache empty function. Can be torch.cuda.empty_cache, or None to skip.
     calibration_function: callable = None, # standard calibration receives label_space_prob, full_vocab_prob, hidden_state, returns probabilities distribution aligned to the label_space
     return_hidden_state: bool = False,
-    return_full_vocab_prob: bool = False
+    return_full_vocab_prob: bool = False,
+    label_restricted_head: bool = False, # If True, run the output head only on the last position and only for the label tokens. Can't be used with calibration_function or return_full_vocab_prob, which need the full vocabulary.
+    capture_hidden_state: bool = None # If the last hidden state is captured. If False, the calibration_function receives None as the hidden_state. Default: only when return_hidden_state or calibration_function is given.
 ):
+    import torch
+    if capture_hidden_state is None:
+        capture_hidden_state = return_hidden_state or calibration_function is not None
+    elif return_hidden_state and not capture_hidden_state:
+        raise ValueError("return_hidden_state needs capture_hidden_state.")
+    if label_restricted_head and (calibration_function is not None or return_full_vocab_prob):
+        raise ValueError("label_restricted_head can't be used with calibration_function or return_full_vocab_prob, which need the full vocabulary probabilities.")
     with torch.no_grad():
         if cache_empty is not None:
             cache_empty()
-        tknzd_data = tokenizer(prompt, return_tensors="pt").input_ids.to(model.device) # flexable??
-        result = model(tknzd_data, output_hidden_states = True)
-        full_vocab_prob = result['logits'][0][-1].detach().to(torch.float).cpu().numpy()
-        last_hidden_state = result.hidden_states[-1][-1][-1].detach().to(torch.float).cpu().numpy()
-        tokenized_label_space = [tokenizer(label).input_ids[-1] for label in label_space] # The last token only
-        label_space_logits = [full_vocab_prob[token] for token in tokenized_label_space]
+        if getattr(prompt, "input_ids", None) is not None:
+            # A tokenized_prompt from prompt_writter.set_tokenizer: the token ids are already assembled.
+            tknzd_data = torch.tensor([prompt.input_ids], dtype = torch.long).to(model.device)
+        else:
+            tknzd_data = tokenizer(prompt, return_tensors="pt").input_ids.to(model.device) # flexable??
+        tokenized_label_space = get_label_token_ids(tokenizer, label_space)
+        if label_restricted_head:
+            last_hidden_state = model.base_model(tknzd_data).last_hidden_state[:, -1]
+            label_space_logits = _label_restricted_logits(model, last_hidden_state, tokenized_label_space)[0].tolist()
+            last_hidden_state = last_hidden_state[0].detach().to(torch.float).cpu().numpy() if capture_hidden_state else None
+            full_vocab_prob = None
+        else:
+            logits, last_hidden_state = _last_position_forward(model, tknzd_data, capture_hidden_state)
+            full_vocab_prob = logits[0].detach().to(torch.float).cpu().numpy()
+            last_hidden_state = last_hidden_state[0].detach().to(torch.float).cpu().numpy() if capture_hidden_state else None
+            label_space_logits = [full_vocab_prob[token] for token in tokenized_label_space]
+            del logits
         label_space_prob = functional.softmax(label_space_logits)
         del tknzd_data
-        del result
         if calibration_function is not None:
             ret = calibration_function(label_space_prob, full_vocab_prob, last_hidden_state)
         else:
@@ -42,34 +134,79 @@ def standard_ICL_inference_with_torch_Causal_LM(
                 ret = (ret, full_vocab_prob)
         return ret
     
+def _tokenize_prompt(prompt, tokenizer):
+    # The token ids of one prompt, as a list. Use the assembled ids of a tokenized_prompt (prompt_writter.set_tokenizer) if given.
+    if getattr(prompt, "input_ids", None) is not None:
+        return list(prompt.input_ids)
+    return tokenizer(prompt).input_ids
+
+def _left_padded_batch(tknzd_prompts: list[list[int]], pad_token_id: int, device):
+    # Left-pad the token ids into one batch, so that the last position of every row is the last token of its prompt.
+    # The position ids count only the real tokens, so each row sees the same positions as when it is inferred alone.
+    import torch
+    max_length = max([len(tknzd) for tknzd in tknzd_prompts])
+    input_ids = torch.full((len(tknzd_prompts), max_length), pad_token_id, dtype = torch.long)
+    attention_mask = torch.zeros((len(tknzd_prompts), max_length), dtype = torch.long)
+    for i, tknzd in enumerate(tknzd_prompts):
+        input_ids[i, max_length - len(tknzd):] = torch.tensor(tknzd, dtype = torch.long)
+        attention_mask[i, max_length - len(tknzd):] = 1
+    position_ids = (attention_mask.cumsum(-1) - 1).clamp(min = 0)
+    return input_ids.to(device), attention_mask.to(device), position_ids.to(device)
+
 def batched_ICL_inference_with_torch_Causal_LM(
     prompt: list[str],
     model: callable,
     tokenizer: callable,
     label_space: list[str],
-    cache_empty: callable = torch.cuda.empty_cache(), # GPU cache empty function. Can be torch.cuda.empty_cache.
+    cache_empty: callable = _default_cache_empty, # GPU cache empty function. Can be torch.cuda.empty_cache, or None to skip.
     batch_calibration_function: callable = None, # standard calibration receives list[label_space_prob, full_vocab_prob, hidden_state], returns probabilities distribution aligned to the label_space
     inside_calibration_function: callable = None, # standard calibration receives label_space_prob, full_vocab_prob, hidden_state, returns probabilities distribution aligned to the label_space
+    batch_size: int = 8, # The number of prompts in one forward pass. The prompts are left-padded with attention masks. 1 for the same behavior as standard_ICL_inference_with_torch_Causal_LM.
+    label_restricted_head: bool = False, # If True, run the output head only on the last position and only for the label tokens. Can't be used with inside_calibration_function, which needs the full vocabulary.
+    capture_hidden_state: bool = None # If the last hidden states are captured. If False, the inside_calibration_function receives None as the hidden_state. Default: only when inside_calibration_function is given.
 ):
+    import torch
+    if capture_hidden_state is None:
+        capture_hidden_state = inside_calibration_function is not None
+    if batch_size < 1:
+        raise ValueError("batch_size should be a positive integer.")
+    if label_restricted_head and inside_calibration_function is not None:
+        raise ValueError("label_restricted_head can't be used with inside_calibration_function, which needs the full vocabulary probabilities.")
     with torch.no_grad():
         ori_results = []
-        count = 0
-        for single_prompt in prompt:
-            ori_results.append(standard_ICL_inference_with_torch_Causal_LM(
-                prompt = single_prompt, 
-                model = model, 
-                tokenizer = tokenizer, 
-                label_space = label_space, 
-                cache_empty = cache_empty, 
-                calibration_function = inside_calibration_function
-            ))
+        tokenized_label_space = get_label_token_ids(tokenizer, label_space)
+        pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else (tokenizer.eos_token_id if tokenizer.eos_token_id is not None else 0) # Masked out; any id works.
+        for start in range(0, len(prompt), batch_size):
+            if cache_empty is not None:
+                cache_empty()
+            tknzd_prompts = [_tokenize_prompt(single_prompt, tokenizer) for single_prompt in prompt[start : start + batch_size]]
+            input_ids, attention_mask, position_ids = _left_padded_batch(tknzd_prompts, pad_token_id, model.device)
+            if label_restricted_head:
+                last_hidden_states = model.base_model(input_ids, attention_mask = attention_mask, position_ids = position_ids).last_hidden_state[:, -1]
+                label_space_logits = _label_restricted_logits(model, last_hidden_states, tokenized_label_space).tolist()
+                full_vocab_probs = [None] * len(tknzd_prompts)
+            else:
+                logits, last_hidden_states = _last_position_forward(model, input_ids, capture_hidden_state, attention_mask = attention_mask, position_ids = position_ids)
+                full_vocab_probs = logits.detach().to(torch.float).cpu().numpy()
+                label_space_logits = [[full_vocab_prob[token] for token in tokenized_label_space] for full_vocab_prob in full_vocab_probs]
+                del logits
+            if capture_hidden_state:
+                last_hidden_states = last_hidden_states.detach().to(torch.float).cpu().numpy()
+            else:
+                last_hidden_states = [None] * len(tknzd_prompts)
+            del input_ids, attention_mask, position_ids
+            for logits, full_vocab_prob, last_hidden_state in zip(label_space_logits, full_vocab_probs, last_hidden_states):
+                label_space_prob = functional.softmax(logits)
+                if inside_calibration_function is not None:
+                    ori_results.append(inside_calibration_function(label_space_prob, full_vocab_prob, last_hidden_state))
+                else:
+                    ori_results.append(label_space_prob)
             print("\r", end="")
             print("Process: {}%, {} in {}".format(
-                int((count + 1) / len(prompt) * 100), 
-                (count + 1), 
+                int(len(ori_results) / len(prompt) * 100), 
+                len(ori_results), 
                 len(prompt)
-            ), ">>" * int((count) / len(prompt) * 32), end="")
-            count += 1
+            ), ">>" * int((len(ori_results) - 1) / len(prompt) * 32), end="")
         if batch_calibration_function is not None:
             return batch_calibration_function(ori_results)
         else:
@@ -80,8 +217,9 @@ def noisy_channel_ICL_inference_with_torch_Causal_LM(
     model: callable,
     tokenizer: callable,
     label_space: list[str],
-    cache_empty: callable = torch.cuda.empty_cache(), # GPU cache empty function. Can be torch.cuda.empty_cache.
+    cache_empty: callable = _default_cache_empty, # GPU cache empty function. Can be torch.cuda.empty_cache, or None to skip.
 ):
+    import torch
     with torch.no_grad():
         loss_with_labels = []
         if cache_empty is not None:
@@ -92,7 +230,166 @@ def noisy_channel_ICL_inference_with_torch_Causal_LM(
             del tknzd_data
         loss_with_labels = [loss_with_labels[0] - loss_with_labels[i] for i in range(0, len(loss_with_labels))]
         return functional.softmax(loss_with_labels)
-    
+
+def _common_prefix_length(tknzd_prompts):
+    # The length of the longest common prefix of the 1-D token id tensors.
+    length = min([len(tknzd) for tknzd in tknzd_prompts])
+    for tknzd in tknzd_prompts[1:]:
+        mismatch = (tknzd[:length] != tknzd_prompts[0][:length]).nonzero()
+        if len(mismatch) > 0:
+            length = mismatch[0].item()
+    return length
+
+def _structured_noisy_channel_ids(prompt, tokenizer, boundary_window: int):
+    # The token ids of a `noisy_channel_prompts` (see prompt_writter.set_shared_prefix_output) without tokenizing the full prompt of each label:
+    #   the shared prefix is tokenized once, and each label suffix only with the last `boundary_window` characters of the prefix before it.
+    # Returns (prefix_ids, [suffix_ids for each label]), the same as the tokenization of the full prompts; 
+    #   or None if a token spans the join of the prefix and a suffix (the tail tokens change when the suffix is appended), or the tokenizer appends special tokens.
+    prefix_ids = tokenizer(prompt.shared_prefix).input_ids
+    tail = prompt.shared_prefix[-boundary_window:]
+    tail_ids = tokenizer(tail, add_special_tokens = False).input_ids
+    if len(tail_ids) == 0 or len(prefix_ids) == 0 or prefix_ids[-1] != tail_ids[-1]:
+        return None
+    suffix_ids = []
+    for suffix in prompt.label_suffixes:
+        joined_ids = tokenizer(tail + suffix, add_special_tokens = False).input_ids
+        if joined_ids[:len(tail_ids)] != tail_ids or len(joined_ids) == len(tail_ids):
+            return None
+        suffix_ids.append(joined_ids[len(tail_ids):])
+    return prefix_ids, suffix_ids
+
+def shared_prefix_noisy_channel_ICL_inference_with_torch_Causal_LM(
+    prompt: list[str], # The noisy channel prompts for each label. Best with prompt_writter.set_shared_prefix_output(), but a plain list also works.
+    model: callable,
+    tokenizer: callable,
+    label_space: list[str],
+    cache_empty: callable = _default_cache_empty, # GPU cache empty function. Can be torch.cuda.empty_cache, or None to skip.
+    boundary_window: int = 64, # The number of the characters of the shared prefix tokenized again with each label suffix, to check the token boundary at the join.
+):
+    # The same results as noisy_channel_ICL_inference_with_torch_Causal_LM, but the shared prefix of the prompts (the demonstrations) is encoded only once,
+    #   and the KV cache of it is reused by the suffix of each label.
+    # With a `noisy_channel_prompts`, the shared prefix is tokenized once and each label suffix is tokenized alone (with a short window before the join);
+    #   with a plain list, or if a token spans the join, the prompts are tokenized in full and the shared prefix is their common token prefix. Either way, the token boundaries are the same as the plain kernel.
+    # The loss of each prompt is rebuilt as the HuggingFace mean loss: (NLL of the prefix + NLL of the suffix) / (number of tokens - 1).
+    import torch
+    with torch.no_grad():
+        if cache_empty is not None:
+            cache_empty()
+        structured_ids = None
+        if getattr(prompt, "shared_prefix", None) is not None:
+            structured_ids = _structured_noisy_channel_ids(prompt, tokenizer, boundary_window)
+        if structured_ids is not None:
+            prefix = torch.tensor(structured_ids[0], device = model.device)
+            suffixes = [torch.tensor(suffix_ids, device = model.device) for suffix_ids in structured_ids[1]]
+        else:
+            tknzd_prompts = [tokenizer(prom, return_tensors="pt").input_ids[0].to(model.device) for prom in prompt]
+            # Keep at least 1 token in each suffix.
+            prefix_length = min(_common_prefix_length(tknzd_prompts), min([len(tknzd) for tknzd in tknzd_prompts]) - 1)
+            prefix = tknzd_prompts[0][:prefix_length]
+            suffixes = [tknzd[prefix_length:] for tknzd in tknzd_prompts]
+        prefix_length = len(prefix)
+        if prefix_length < 1:
+            return noisy_channel_ICL_inference_with_torch_Causal_LM(list(prompt), model, tokenizer, label_space, cache_empty = None)
+        prefix_result = model(prefix.unsqueeze(0), use_cache = True)
+        prefix_logits = prefix_result.logits[0].to(torch.float)
+        prefix_cache = prefix_result.past_key_values
+        prefix_nll = torch.nn.functional.cross_entropy(prefix_logits[:-1], prefix[1:], reduction = "sum")
+        loss_with_labels = []
+        for suffix in suffixes:
+            suffix_logits = model(suffix.unsqueeze(0), past_key_values = prefix_cache, use_cache = True).logits[0].to(torch.float)
+            if hasattr(prefix_cache, "crop"):
+                # A DynamicCache is extended in place by the suffix: crop it back to the prefix for the next label.
+                # (The legacy tuple caches are not modified by the model.)
+                prefix_cache.crop(-len(suffix)) # A negative length removes the last tokens.
+            # The first suffix token is predicted by the last prefix position.
+            suffix_nll = torch.nn.functional.cross_entropy(torch.cat([prefix_logits[-1:], suffix_logits[:-1]]), suffix, reduction = "sum")
+            loss_with_labels.append(((prefix_nll + suffix_nll) / (prefix_length + len(suffix) - 1)).cpu().item())
+            del suffix_logits
+        del prefix_result
+        del prefix_cache
+        loss_with_labels = [loss_with_labels[0] - loss_with_labels[i] for i in range(0, len(loss_with_labels))]
+        return functional.softmax(loss_with_labels)
+
+def _common_suffix_length(tknzd_prompts, max_length):
+    # The length of the longest common suffix of the 1-D token id tensors, at most max_length.
+    length = max_length
+    for tknzd in tknzd_prompts[1:]:
+        if length == 0:
+            break
+        mismatch = (tknzd[len(tknzd) - length:].flip(0) != tknzd_prompts[0][len(tknzd_prompts[0]) - length:].flip(0)).nonzero()
+        if len(mismatch) > 0:
+            length = mismatch[0].item()
+    return length
+
+def _expand_cache(cache, batch_size: int):
+    # Repeat the KV cache of one sequence for each row of a batch.
+    if hasattr(cache, "batch_repeat_interleave"):
+        cache.batch_repeat_interleave(batch_size)
+        return cache
+    return tuple(tuple(tensor.repeat_interleave(batch_size, dim = 0) for tensor in layer) for layer in cache) # The legacy tuple cache.
+
+def batched_noisy_channel_ICL_inference_with_torch_Causal_LM(
+    prompt: list[str], # The noisy channel prompts for each label.
+    model: callable,
+    tokenizer: callable,
+    label_space: list[str],
+    cache_empty: callable = _default_cache_empty, # GPU cache empty function. Can be torch.cuda.empty_cache, or None to skip.
+):
+    # The noisy channel prompts of all the labels are scored in one forward pass:
+    #   the shared prefix of the prompts (the demonstrations) is encoded once, and the rest of the prompts are right-padded into one batch above the KV cache of the prefix.
+    # The score of each label is the sum of the log-probabilities of the query tokens (the common token suffix of the prompts) given the demonstrations and the label,
+    #   instead of the mean loss over the whole prompt in noisy_channel_ICL_inference_with_torch_Causal_LM, which is skewed by the shared demonstrations and the length.
+    #   (If the prompts have no common suffix, all the tokens after the shared prefix are scored.)
+    # Returns the softmax of the scores, aligned to the label_space.
+    import torch
+    with torch.no_grad():
+        if cache_empty is not None:
+            cache_empty()
+        tknzd_prompts = [torch.tensor(_tokenize_prompt(prom, tokenizer), dtype = torch.long) for prom in prompt]
+        min_length = min([len(tknzd) for tknzd in tknzd_prompts])
+        # Keep at least 1 token in each suffix.
+        prefix_length = min(_common_prefix_length(tknzd_prompts), min_length - 1)
+        query_length = _common_suffix_length(tknzd_prompts, min_length - max(prefix_length, 1))
+        suffixes = [tknzd[prefix_length:] for tknzd in tknzd_prompts]
+        suffix_length = max([len(suffix) for suffix in suffixes])
+        pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else (tokenizer.eos_token_id if tokenizer.eos_token_id is not None else 0) # Masked out; any id works.
+        input_ids = torch.full((len(suffixes), suffix_length), pad_token_id, dtype = torch.long)
+        attention_mask = torch.zeros((len(suffixes), prefix_length + suffix_length), dtype = torch.long)
+        attention_mask[:, :prefix_length] = 1
+        for i, suffix in enumerate(suffixes):
+            input_ids[i, :len(suffix)] = suffix
+            attention_mask[i, prefix_length : prefix_length + len(suffix)] = 1
+        position_ids = torch.arange(prefix_length, prefix_length + suffix_length, dtype = torch.long).unsqueeze(0).expand(len(suffixes), -1)
+        if prefix_length > 0:
+            prefix_result = model(tknzd_prompts[0][:prefix_length].unsqueeze(0).to(model.device), use_cache = True)
+            prefix_last_logits = prefix_result.logits[0, -1].to(torch.float)
+            prefix_cache = _expand_cache(prefix_result.past_key_values, len(suffixes))
+            del prefix_result
+            suffix_logits = model(
+                input_ids.to(model.device), 
+                attention_mask = attention_mask.to(model.device), 
+                position_ids = position_ids.to(model.device), 
+                past_key_values = prefix_cache, 
+                use_cache = True
+            ).logits.to(torch.float)
+            del prefix_cache
+        else:
+            suffix_logits = model(input_ids.to(model.device), attention_mask = attention_mask.to(model.device), position_ids = position_ids.to(model.device)).logits.to(torch.float)
+        scores = []
+        for i, suffix in enumerate(suffixes):
+            # The scored tokens are suffix[start:], and the token at suffix[j] is predicted by the logits at suffix position j - 1 (or the last prefix position for j = 0).
+            start = len(suffix) - query_length if query_length > 0 else 0
+            if prefix_length == 0:
+                start = max(start, 1) # The first token of the prompt is not predicted.
+            if start == 0:
+                predicting_logits = torch.cat([prefix_last_logits.unsqueeze(0), suffix_logits[i, :len(suffix) - 1]])
+            else:
+                predicting_logits = suffix_logits[i, start - 1 : len(suffix) - 1]
+            log_probs = torch.log_softmax(predicting_logits, dim = -1)
+            scores.append(log_probs.gather(1, suffix[start:].to(log_probs.device).unsqueeze(1)).sum().cpu().item())
+        del suffix_logits
+        return functional.softmax(scores)
+
 def standard_ICL_inference_with_API_call(
     API_call: callable, # The API call function, input: string for prompt, output: string for 1 token
     prompt: str,
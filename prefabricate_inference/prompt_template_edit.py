@@ -1,20 +1,19 @@
-import torch
 from ..util import experimentor
 from ..util import functional
 from ..util import configs
 from ..util import stable_random
 from . import model_kernel
 import itertools
-import numpy as np
 
 def PPL_ICL(
     model: callable,
     tokenizer: callable,
     instruction_set = None,
     experimentor: experimentor.single_experimentor = None,
-    cache_empty: callable = torch.cuda.empty_cache, # GPU cache empty function. Can be torch.cuda.empty_cache.
+    cache_empty: callable = model_kernel._default_cache_empty, # GPU cache empty function. Can be torch.cuda.empty_cache.
 ):
     # https://aclanthology.org/2023.findings-emnlp.679
+    import torch
     if instruction_set is None:
         instruction_set = configs.PPL_ICL_INSTRUCTION_SETTINGS[experimentor.triplet_dataset.get_dataset_name()]
     with torch.no_grad():
@@ -37,7 +36,7 @@ class SA_ICL():
         model: callable,
         tokenizer: callable,
         experimentor: experimentor.single_experimentor = None,
-        cache_empty: callable = torch.cuda.empty_cache, # GPU cache empty function. Can be torch.cuda.empty_cache.
+        cache_empty: callable = model_kernel._default_cache_empty, # GPU cache empty function. Can be torch.cuda.empty_cache.
         calibrate_function: callable = None,
         demonstration_set_cut = 512,
     ):
@@ -87,9 +86,11 @@ class SA_ICL():
                 )
             except:
                 continue
+        import numpy as np
         self.TopK_anchors = np.array(self.TopK_anchors)
     
     def _get_top_k_indexes(self, input, k):
+        import numpy as np
         distance = []
         input_encoded = model_kernel.standard_ICL_inference_with_torch_Causal_LM(
             prompt = input, 
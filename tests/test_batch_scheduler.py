@@ -0,0 +1,58 @@
+# The length-bucketed scheduler must return the results in the order of the prompts, the same as the serial path.
+import contextlib
+import hashlib
+import io
+import unittest
+import warnings
+from ..util import batch_scheduler, experimentor, hgf_dataset_loader, stable_random
+
+
+def _fake_inference(prompt, label_space):
+    digest = hashlib.sha256(str(prompt).encode("utf-8")).digest()
+    return [digest[i] / 255 for i in range(len(label_space))]
+
+
+class _recording_batched_inference():
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, prompt, label_space):
+        self.batches.append(list(prompt))
+        return [_fake_inference(single_prompt, label_space) for single_prompt in prompt]
+
+
+class test_length_bucketed_scheduler(unittest.TestCase):
+    def test_order_restored(self):
+        my_random = stable_random.stable_random()
+        prompts = ["x" * my_random.get_int_from_range(1, 300) + str(i) for i in range(500)]
+        label_space = ["a", "b", "c"]
+        for token_budget, max_batch_size in [(1, None), (100, None), (1000, 8), (10 ** 9, None)]:
+            inference = _recording_batched_inference()
+            scheduler = batch_scheduler.length_bucketed_scheduler(inference, token_budget = token_budget, max_batch_size = max_batch_size, verbose = False)
+            self.assertEqual(scheduler(prompt = prompts, label_space = label_space), [_fake_inference(prompt, label_space) for prompt in prompts])
+            self.assertEqual(sorted([prompt for batch in inference.batches for prompt in batch]), sorted(prompts))
+            for batch in inference.batches:
+                # A prompt longer than the budget is inputted alone.
+                self.assertTrue(len(batch) == 1 or max([len(prompt) for prompt in batch]) * len(batch) <= token_budget)
+                self.assertTrue(max_batch_size is None or len(batch) <= max_batch_size)
+            self.assertEqual(scheduler.get_statistics()["batches"], len(inference.batches))
+
+    def test_batch_calibration_in_original_order(self):
+        prompts = ["x" * length for length in [5, 50, 1, 20, 20, 3]]
+        seen = []
+        def calibration(results):
+            seen.extend(results)
+            return [[value * 2 for value in result] for result in results]
+        scheduler = batch_scheduler.length_bucketed_scheduler(_recording_batched_inference(), token_budget = 40, batch_calibration_function = calibration, verbose = False)
+        results = scheduler(prompt = prompts, label_space = ["a", "b"])
+        expected = [_fake_inference(prompt, ["a", "b"]) for prompt in prompts]
+        self.assertEqual(seen, expected)
+        self.assertEqual(results, [[value * 2 for value in result] for result in expected])
+
+    def test_same_as_serial_auto_run(self):
+        with warnings.catch_warnings(), contextlib.redirect_stdout(io.StringIO()):
+            warnings.simplefilter("ignore")
+            serial = experimentor.single_experimentor(original_dataset = hgf_dataset_loader.subjective()).auto_run(_fake_inference, return_outputs = True)
+            scheduler = batch_scheduler.length_bucketed_scheduler(_recording_batched_inference(), token_budget = 4096, verbose = False)
+            scheduled = experimentor.single_experimentor(original_dataset = hgf_dataset_loader.subjective()).auto_run(scheduler, batched_inference = True, chunk_size = 100, return_outputs = True)
+        self.assertEqual(scheduled, serial)
@@ -0,0 +1,110 @@
+# A run resumed from a checkpoint must give the same results as an uninterrupted serial run.
+import contextlib
+import hashlib
+import io
+import os
+import tempfile
+import unittest
+import warnings
+from ..util import checkpoint, experimentor, hgf_dataset_loader
+
+
+def _fake_inference(prompt, label_space):
+    digest = hashlib.sha256(str(prompt).encode("utf-8")).digest()
+    return [digest[i] / 255 for i in range(len(label_space))]
+
+
+class _crashing_inference():
+    # Raise after `limit` calls, as a crash in the middle of a run.
+    def __init__(self, limit = None, batched = False):
+        self.limit = limit
+        self.batched = batched
+        self.calls = 0
+
+    def __call__(self, prompt, label_space):
+        if self.limit is not None and self.calls >= self.limit:
+            raise RuntimeError("crash")
+        self.calls += 1
+        if self.batched:
+            return [_fake_inference(single_prompt, label_space) for single_prompt in prompt]
+        return _fake_inference(prompt, label_space)
+
+
+def _build_experimentor():
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        return experimentor.single_experimentor(original_dataset = hgf_dataset_loader.subjective())
+
+
+def _quiet(function, *args, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return function(*args, **kwargs)
+
+
+class test_checkpoint_file(unittest.TestCase):
+    def test_truncated_last_line_is_dropped(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "run.jsonl")
+            with checkpoint.checkpoint_file(path, {"run": 1}) as checkpoint_file:
+                checkpoint_file.append([(0, [0.1, 0.9]), (1, 1)])
+            with open(path, "a", encoding = "utf-8") as file:
+                file.write('{"index": 2, "predic') # A crash in the middle of a write.
+            with checkpoint.checkpoint_file(path, {"run": 1}) as checkpoint_file:
+                self.assertEqual(checkpoint_file.completed, {0: [0.1, 0.9], 1: 1})
+                checkpoint_file.append([(2, [0.5, 0.5])])
+            with checkpoint.checkpoint_file(path, {"run": 1}) as checkpoint_file:
+                self.assertEqual(checkpoint_file.completed, {0: [0.1, 0.9], 1: 1, 2: [0.5, 0.5]})
+
+    def test_header_mismatch(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "run.jsonl")
+            checkpoint.checkpoint_file(path, {"run": 1, "k": 4}).close()
+            with self.assertRaises(ValueError):
+                checkpoint.checkpoint_file(path, {"run": 1, "k": 8})
+
+    def test_empty_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "run.jsonl")
+            open(path, "w").close()
+            with checkpoint.checkpoint_file(path, {"run": 1}) as checkpoint_file:
+                checkpoint_file.append([(0, 1)])
+            with checkpoint.checkpoint_file(path, {"run": 1}) as checkpoint_file:
+                self.assertEqual(checkpoint_file.completed, {0: 1})
+
+
+class test_resume(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.expected = _quiet(_build_experimentor().auto_run, _fake_inference, return_outputs = True)
+
+    def _assert_resumed(self, batched_inference, chunk_size, limit):
+        with tempfile.TemporaryDirectory() as directory:
+            with self.assertRaises(RuntimeError):
+                _quiet(_build_experimentor().auto_run, _crashing_inference(limit, batched_inference), batched_inference = batched_inference, chunk_size = chunk_size, checkpoint_directory = directory)
+            # Also cut the last record in half.
+            path = os.path.join(directory, os.listdir(directory)[0])
+            with open(path, "rb") as file:
+                data = file.read()
+            with open(path, "wb") as file:
+                file.write(data[:-5])
+            inference = _crashing_inference(batched = batched_inference)
+            resumed = _quiet(_build_experimentor().auto_run, inference, batched_inference = batched_inference, chunk_size = chunk_size, checkpoint_directory = directory, return_outputs = True)
+            self.assertEqual(resumed, self.expected)
+            return inference.calls
+
+    def test_resume(self):
+        # 300 recorded, the last one cut: 299 are kept.
+        self.assertEqual(self._assert_resumed(False, None, 300), len(_build_experimentor()) - 299)
+
+    def test_resume_batched(self):
+        # 3 chunks recorded, the last record cut: the third chunk is inferred again (only its missing prompt), then the rest.
+        chunks = (len(_build_experimentor()) + 99) // 100
+        self.assertEqual(self._assert_resumed(True, 100, 3), chunks - 2)
+
+    def test_other_configuration(self):
+        with tempfile.TemporaryDirectory() as directory:
+            _quiet(_build_experimentor().auto_run, _fake_inference, checkpoint_directory = directory)
+            other = _build_experimentor()
+            other.prompt_former.set_label_wrong_rate(0.5)
+            with self.assertRaises(ValueError):
+                _quiet(other.auto_run, _fake_inference, checkpoint_directory = directory)
@@ -0,0 +1,94 @@
+# A columnar table must read back the same rows as the pickled table it was converted from, and a stale file must be ignored.
+import array
+import os
+import pickle
+import struct
+import sys
+import tempfile
+import unittest
+from unittest import mock
+from ..util import columnar_dataset, hgf_dataset_loader
+
+_ROWS = [(["plain text"], 0), (["ünïcödé 文本 🙂"], 3), ([""], 1), (["a\nb\tc"], -2)]
+_MULTI_INPUT_ROWS = [(["premise " + str(i), "hypothesis " + str(i)], i % 3) for i in range(50)]
+
+
+def _swap_byte_order(path):
+    # Rewrite the columnar file `path` as if it was written on a host with the other byte order.
+    with open(path, "rb") as file:
+        data = file.read()
+    header = struct.Struct("=8sIIQQq")
+    magic, version, input_element_numbers, row_numbers, source_size, source_mtime = header.unpack_from(data, 0)
+    other_order = ">" if sys.byteorder == "little" else "<"
+    other_magic = b"STAICCcb" if sys.byteorder == "little" else b"STAICCcl"
+    integers = array.array("q", data[header.size : header.size + 8 * (row_numbers + row_numbers * input_element_numbers + 1)])
+    integers.byteswap()
+    with open(path, "wb") as file:
+        file.write(struct.pack(other_order + "8sIIQQq", other_magic, version, input_element_numbers, row_numbers, source_size, source_mtime))
+        file.write(integers.tobytes())
+        file.write(data[header.size + 8 * len(integers):])
+
+
+class test_columnar_table(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.directory = self._directory.name
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def test_round_trip(self):
+        for rows in [_ROWS, _MULTI_INPUT_ROWS]:
+            path = os.path.join(self.directory, "table.columnar")
+            columnar_dataset.write_columnar_table(rows, path, (123, 456))
+            table = columnar_dataset.columnar_table(path)
+            self.assertEqual(len(table), len(rows))
+            self.assertEqual(list(table), rows)
+            self.assertEqual(table[-1], rows[-1])
+            self.assertEqual(table[1:3], rows[1:3])
+            self.assertEqual(list(pickle.loads(pickle.dumps(table))), rows)
+            self.assertEqual(columnar_dataset.read_source_stamp(path), (123, 456))
+
+    def test_other_byte_order(self):
+        path = os.path.join(self.directory, "table.columnar")
+        columnar_dataset.write_columnar_table(_ROWS, path, (2 ** 40 + 5, -7))
+        _swap_byte_order(path)
+        self.assertEqual(list(columnar_dataset.columnar_table(path)), _ROWS)
+        self.assertEqual(columnar_dataset.read_source_stamp(path), (2 ** 40 + 5, -7))
+
+    def test_stale_file_ignored(self):
+        source_path = os.path.join(self.directory, "table.dataset")
+        with open(source_path, "wb") as file:
+            pickle.dump(_ROWS, file)
+        with mock.patch.dict(os.environ, {"STAICC_CACHE": os.path.join(self.directory, "cache")}):
+            self.assertIsNone(columnar_dataset.find_columnar_file(source_path))
+            self.assertEqual(columnar_dataset.convert_cached_datasets(self.directory), [os.path.join(self.directory, "table.columnar")])
+            self.assertEqual(columnar_dataset.find_columnar_file(source_path), os.path.join(self.directory, "table.columnar"))
+            # The pickle is regenerated: the converted file is stale.
+            with open(source_path, "wb") as file:
+                pickle.dump(_ROWS[:2], file)
+            self.assertIsNone(columnar_dataset.find_columnar_file(source_path))
+            # The same size, another modification time.
+            columnar_dataset.convert_cached_datasets(self.directory)
+            status = os.stat(source_path)
+            os.utime(source_path, ns = (status.st_atime_ns, status.st_mtime_ns + 10 ** 9))
+            self.assertIsNone(columnar_dataset.find_columnar_file(source_path))
+            # Rebuilt in the user cache folder, not beside the pickle.
+            path = columnar_dataset.cache_columnar_table(_ROWS[:2], source_path)
+            self.assertEqual(os.path.dirname(path), os.path.join(self.directory, "cache"))
+            self.assertEqual(columnar_dataset.find_columnar_file(source_path), path)
+            self.assertEqual(list(columnar_dataset.columnar_table(path)), _ROWS[:2])
+
+
+class test_cached_dataset_loading(unittest.TestCase):
+    def test_same_rows_as_the_pickle(self):
+        with tempfile.TemporaryDirectory() as directory, mock.patch.dict(os.environ, {"STAICC_CACHE": directory}):
+            source_path = columnar_dataset.get_source_path(hgf_dataset_loader.__package__[0:-5], "trec.dataset")
+            with open(source_path, "rb") as file:
+                expected = [(list(inputs), label) for inputs, label in pickle.load(file)]
+            first = hgf_dataset_loader.trec() # From the pickle, and converted into the user cache.
+            self.assertEqual(len(os.listdir(directory)), 1)
+            second = hgf_dataset_loader.trec() # From the columnar file.
+            self.assertIsInstance(second.table, columnar_dataset.columnar_table)
+            self.assertEqual([(list(inputs), label) for inputs, label in first.table], expected)
+            self.assertEqual(list(second.table), expected)
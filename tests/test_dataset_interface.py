@@ -0,0 +1,112 @@
+# The prompt writter must return the same prompts and token ids as the plain (full) path.
+import unittest
+import warnings
+from ..util import dataset_interface, experimentor, hgf_dataset_loader
+
+
+class _tokenizer_output():
+    def __init__(self, input_ids):
+        self.input_ids = input_ids
+
+
+class _bar_merging_tokenizer():
+    # A character-level tokenizer with a BOS token, which merges "|" with the next character into one token when `merge` is True.
+    # With "|" as the label affix, the merges only happen at the joins of the prompt pieces.
+    def __init__(self):
+        self.merge = False
+
+    def __call__(self, text, add_special_tokens = True):
+        input_ids = [1] if add_special_tokens else []
+        index = 0
+        while index < len(text):
+            if self.merge and text[index] == "|" and index + 1 < len(text):
+                input_ids.append(1000000 + ord(text[index + 1]))
+                index += 2
+            else:
+                input_ids.append(ord(text[index]))
+                index += 1
+        return _tokenizer_output(input_ids)
+
+
+def _build_experimentor():
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        ret = experimentor.single_experimentor(original_dataset = hgf_dataset_loader.subjective())
+        ret.prompt_former.change_label_affix("|")
+    return ret
+
+
+class test_token_assembly(unittest.TestCase):
+    def test_mismatch_after_the_probe_falls_back_per_prompt(self):
+        test_experimentor = _build_experimentor()
+        tokenizer = _bar_merging_tokenizer()
+        test_experimentor.prompt_former.set_tokenizer(tokenizer)
+        lines = [line for chunk in test_experimentor.iter_prompts(16, start = 0, end = 16) for line in chunk]
+        for line in lines:
+            self.assertEqual(line[3].input_ids, tokenizer(line[3]).input_ids)
+        self.assertEqual(test_experimentor.prompt_former.tokenizer_mismatch, 0)
+        tokenizer.merge = True # Now every join is inconsistent, but the probe is over.
+        lines = [line for chunk in test_experimentor.iter_prompts(16, start = 16, end = 64) for line in chunk]
+        for line in lines:
+            self.assertEqual(line[3].input_ids, tokenizer(line[3]).input_ids)
+        self.assertEqual(test_experimentor.prompt_former.tokenizer_mismatch, len(lines))
+
+    def test_mismatch_count_kept_when_disabled(self):
+        test_experimentor = _build_experimentor()
+        tokenizer = _bar_merging_tokenizer()
+        tokenizer.merge = True
+        test_experimentor.prompt_former.set_tokenizer(tokenizer)
+        with warnings.catch_warnings(record = True) as caught:
+            warnings.simplefilter("always")
+            lines = [line for chunk in test_experimentor.iter_prompts(8, start = 0, end = 8) for line in chunk]
+        self.assertEqual(len(caught), 1)
+        self.assertEqual(lines[0][3].input_ids, tokenizer(lines[0][3]).input_ids)
+        self.assertFalse(hasattr(lines[1][3], "input_ids")) # The assembly is disabled after the first mismatch.
+        self.assertEqual(test_experimentor.prompt_former.tokenizer_mismatch, 1)
+
+
+class test_demonstration_sampler_view(unittest.TestCase):
+    def setUp(self):
+        self.sampler = dataset_interface.demonstration_sampler(4, 100, 50)
+        self.rows = [self.sampler[i] for i in range(len(self.sampler))] # The list model of the sampler.
+
+    def _assert_rows(self):
+        self.assertEqual(len(self.sampler), len(self.rows))
+        self.assertEqual([self.sampler[i] for i in range(len(self.sampler))], self.rows)
+
+    def test_view_is_read_only(self):
+        view = self.sampler.get_sampled_indexes_view(3)
+        self.assertEqual(list(view), self.rows[3])
+        with self.assertRaises(TypeError):
+            view[0] = 0
+
+    def test_in_place_changes_seen_through_the_view(self):
+        view = self.sampler.get_sampled_indexes_view(3)
+        self.sampler._resample([3, 7], lambda index, sample: sample != self.rows[index])
+        self.rows[3] = self.sampler[3]
+        self.rows[7] = self.sampler[7]
+        self.assertEqual(list(view), self.rows[3])
+        matrix = self.sampler.export_matrix()
+        matrix[12:16] = matrix[0:4]
+        self.sampler.import_matrix(matrix)
+        self.rows[3] = self.rows[0]
+        self.assertEqual(list(view), self.rows[0])
+        self._assert_rows()
+
+    def test_resize_with_a_held_view(self):
+        view = self.sampler.get_sampled_indexes_view(3)
+        former = list(view)
+        self.assertEqual(self.sampler._pop(1), self.rows.pop(1))
+        self.sampler._insert(2, [1, 2, 3, 4])
+        self.rows.insert(2, [1, 2, 3, 4])
+        self.assertEqual(self.sampler._pop(5), self.rows.pop(5))
+        self.sampler._append([5, 6, 7, 8])
+        self.rows.append([5, 6, 7, 8])
+        self.assertEqual(list(view), former) # Detached: the former row.
+        self._assert_rows()
+        del view
+        # Without a held view, resized in place.
+        self.assertEqual(self.sampler._pop(0), self.rows.pop(0))
+        self.sampler._insert(10, [9, 9, 9, 9])
+        self.rows.insert(10, [9, 9, 9, 9])
+        self._assert_rows()
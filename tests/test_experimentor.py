@@ -0,0 +1,47 @@
+# The run options of single_experimentor must give the same results as the plain serial `auto_run`.
+import contextlib
+import hashlib
+import io
+import tempfile
+import unittest
+import warnings
+from ..util import experimentor, hgf_dataset_loader
+
+
+def _fake_inference(prompt, label_space):
+    # A deterministic stand-in for a model: the logits are derived from the hash of the prompt.
+    digest = hashlib.sha256(str(prompt).encode("utf-8")).digest()
+    return [digest[i] / 255 for i in range(len(label_space))]
+
+
+def _build_experimentor():
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        return experimentor.single_experimentor(original_dataset = hgf_dataset_loader.subjective())
+
+
+def _quiet(function, *args, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return function(*args, **kwargs)
+
+
+class test_call_options(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.expected = _quiet(_build_experimentor().auto_run, _fake_inference, return_outputs = True)
+
+    def test_checkpoint_directory_through_call(self):
+        calls = []
+        def counted_inference(prompt, label_space):
+            calls.append(prompt)
+            return _fake_inference(prompt, label_space)
+        with tempfile.TemporaryDirectory() as directory:
+            first = _quiet(_build_experimentor(), counted_inference, return_outputs = True, checkpoint_directory = directory)
+            self.assertEqual(first, self.expected)
+            number = len(calls)
+            resumed = _quiet(_build_experimentor(), counted_inference, return_outputs = True, checkpoint_directory = directory)
+            self.assertEqual(resumed, self.expected)
+            self.assertEqual(len(calls), number) # All the predictions are read back from the checkpoint.
+
+    def test_executor_through_call(self):
+        self.assertEqual(_quiet(_build_experimentor(), _fake_inference, return_outputs = True, executor = 4, max_concurrency = 8), self.expected)
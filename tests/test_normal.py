@@ -0,0 +1,58 @@
+# Evaluating the stored outputs of a Normal run must give the same results as running the benchmark, and only with the same prompts.
+import contextlib
+import hashlib
+import io
+import json
+import unittest
+import warnings
+from .. import diagnosis, normal
+from ..util import hgf_dataset_loader
+
+_DATASETS = [hgf_dataset_loader.subjective, hgf_dataset_loader.trec]
+
+
+def _fake_inference(prompt, label_space):
+    digest = hashlib.sha256(str(prompt).encode("utf-8")).digest()
+    return [digest[i] / 255 for i in range(len(label_space))]
+
+
+def _quiet(function, *args, **kwargs):
+    with warnings.catch_warnings(), contextlib.redirect_stdout(io.StringIO()):
+        warnings.simplefilter("ignore")
+        return function(*args, **kwargs)
+
+
+class test_evaluate_from_outputs(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.result = _quiet(_quiet(normal.Normal, datasets = _DATASETS, lazy_load = True).auto_run, _fake_inference, return_outputs = True)
+        cls.outputs = json.loads(json.dumps(cls.result["Outputs"])) # As stored and read back.
+
+    def test_round_trip(self):
+        expected = {key: value for key, value in self.result.items() if key != "Outputs"}
+        evaluated = _quiet(_quiet(normal.Normal, datasets = _DATASETS, lazy_load = True).evaluate_from_outputs, self.outputs)
+        self.assertEqual(evaluated, expected)
+
+    def test_post_bias_from_normal_outputs(self):
+        expected = _quiet(_quiet(diagnosis.Post_bias, datasets = _DATASETS, lazy_load = True).auto_run, _fake_inference)
+        evaluated = _quiet(_quiet(diagnosis.Post_bias, datasets = _DATASETS, lazy_load = True).evaluate_from_outputs, {"Outputs": self.outputs})
+        self.assertEqual(evaluated, expected)
+
+    def test_other_configuration_lists_the_different_keys(self):
+        with self.assertRaises(ValueError) as context:
+            _quiet(_quiet(normal.Normal, k = 8, datasets = _DATASETS, lazy_load = True).evaluate_from_outputs, self.outputs)
+        self.assertIn("'k'", str(context.exception))
+        self.assertIn("'demonstration_sampler'", str(context.exception))
+        self.assertNotIn("'dataset'", str(context.exception))
+        benchmark = _quiet(normal.Normal, datasets = _DATASETS, lazy_load = True)
+        _quiet(benchmark[1].prompt_former.change_instruction, "Classify the question. ")
+        with self.assertRaises(ValueError) as context:
+            _quiet(benchmark.evaluate_from_outputs, self.outputs)
+        self.assertIn("position 1", str(context.exception))
+        self.assertIn("['template']", str(context.exception))
+
+    def test_other_datasets(self):
+        with self.assertRaises(ValueError):
+            _quiet(_quiet(normal.Normal, datasets = _DATASETS[:1], lazy_load = True).evaluate_from_outputs, self.outputs)
+        with self.assertRaises(ValueError):
+            _quiet(_quiet(normal.Normal, datasets = _DATASETS, lazy_load = True).evaluate_from_outputs, {"accuracy": 1.0})
@@ -0,0 +1,113 @@
+# A cached forward_inference must return the same results as the wrapped one, and only call it on the misses.
+import contextlib
+import hashlib
+import io
+import json
+import os
+import pickle
+import tempfile
+import unittest
+import warnings
+from ..util import experimentor, hgf_dataset_loader, prediction_cache
+
+
+def _fake_inference(prompt, label_space):
+    digest = hashlib.sha256(str(prompt).encode("utf-8")).digest()
+    return [digest[i] / 255 for i in range(len(label_space))]
+
+
+class _counted_inference():
+    def __init__(self, batched = False):
+        self.batched = batched
+        self.prompts = []
+
+    def __call__(self, prompt, label_space):
+        if self.batched:
+            self.prompts.extend(prompt)
+            return [_fake_inference(single_prompt, label_space) for single_prompt in prompt]
+        self.prompts.append(prompt)
+        return _fake_inference(prompt, label_space)
+
+
+class test_prediction_cache(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self._directory.name, "predictions.sqlite")
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def test_hits_skip_the_wrapped_function(self):
+        inference = _counted_inference()
+        cache = prediction_cache.prediction_cache(inference, self.path, "model-a")
+        label_space = ["a", "b"]
+        first = [cache(prompt = str(i), label_space = label_space) for i in range(20)]
+        second = [cache(prompt = str(i), label_space = label_space) for i in range(20)]
+        self.assertEqual(first, [_fake_inference(str(i), label_space) for i in range(20)])
+        self.assertEqual(second, first)
+        self.assertEqual(len(inference.prompts), 20)
+        self.assertEqual(cache.get_statistics()["hits"], 20)
+        # Another label space, or another model fingerprint in the same file, is a miss.
+        cache(prompt = "0", label_space = ["b", "a"])
+        prediction_cache.prediction_cache(inference, self.path, "model-b")(prompt = "0", label_space = label_space)
+        self.assertEqual(len(inference.prompts), 22)
+        cache.close()
+
+    def test_batched_misses_inferred_once(self):
+        inference = _counted_inference(batched = True)
+        cache = prediction_cache.prediction_cache(inference, self.path, "model-a", batched = True, verbose = False)
+        prompts = ["x", "y", "x", "z"]
+        self.assertEqual(cache(prompt = prompts, label_space = ["a", "b"]), [_fake_inference(prompt, ["a", "b"]) for prompt in prompts])
+        self.assertEqual(inference.prompts, ["x", "y", "z"])
+        prompts = ["w", "x", "w"]
+        self.assertEqual(cache(prompt = prompts, label_space = ["a", "b"]), [_fake_inference(prompt, ["a", "b"]) for prompt in prompts])
+        self.assertEqual(inference.prompts, ["x", "y", "z", "w"])
+        cache.close()
+
+    def test_least_recently_used_evicted(self):
+        label_space = ["a", "b"]
+        entry_size = len(json.dumps(_fake_inference("0", label_space)))
+        inference = _counted_inference()
+        cache = prediction_cache.prediction_cache(inference, self.path, "model-a", max_bytes = entry_size * 3 + entry_size // 2)
+        for prompt in ["0", "1", "2"]:
+            cache(prompt = prompt, label_space = label_space)
+        cache(prompt = "0", label_space = label_space) # "1" is now the least recently used.
+        cache(prompt = "3", label_space = label_space)
+        statistics = cache.get_statistics()
+        self.assertEqual(statistics["evictions"], 1)
+        self.assertEqual(statistics["entries"], 3)
+        self.assertLessEqual(statistics["stored_bytes"], cache.max_bytes)
+        del inference.prompts[:]
+        for prompt in ["0", "2", "3"]:
+            cache(prompt = prompt, label_space = label_space)
+        self.assertEqual(inference.prompts, [])
+        cache(prompt = "1", label_space = label_space)
+        self.assertEqual(inference.prompts, ["1"])
+        cache.close()
+
+    def test_pickled_cache_shares_the_file(self):
+        inference = _counted_inference()
+        cache = prediction_cache.prediction_cache(inference, self.path, "model-a")
+        cache(prompt = "0", label_space = ["a", "b"])
+        copied = pickle.loads(pickle.dumps(cache))
+        self.assertEqual(copied(prompt = "0", label_space = ["a", "b"]), _fake_inference("0", ["a", "b"]))
+        self.assertEqual(copied.get_statistics()["hits"], 1)
+        cache.close()
+        copied.close()
+
+    def test_same_as_serial_auto_run(self):
+        def build():
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                return experimentor.single_experimentor(original_dataset = hgf_dataset_loader.subjective())
+        with contextlib.redirect_stdout(io.StringIO()):
+            serial = build().auto_run(_fake_inference, return_outputs = True)
+            inference = _counted_inference()
+            cache = prediction_cache.prediction_cache(inference, self.path, "model-a")
+            first = build().auto_run(cache, return_outputs = True)
+            number = len(inference.prompts)
+            second = build().auto_run(cache, return_outputs = True)
+        cache.close()
+        self.assertEqual(first, serial)
+        self.assertEqual(second, serial)
+        self.assertEqual(len(inference.prompts), number)
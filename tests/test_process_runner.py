@@ -0,0 +1,77 @@
+# The sharded multi-process run must give the same results as the serial auto_run, and a seeked prompt range the same prompts as a full iteration.
+import contextlib
+import functools
+import hashlib
+import io
+import unittest
+import warnings
+from .. import diagnosis, normal
+from ..util import experimentor, hgf_dataset_loader, process_runner
+
+_DATASETS = [hgf_dataset_loader.subjective, hgf_dataset_loader.trec]
+
+
+def _fake_inference(prompt, label_space):
+    digest = hashlib.sha256(str(prompt).encode("utf-8")).digest()
+    return [digest[i] / 255 for i in range(len(label_space))]
+
+
+def _build_inference():
+    return _fake_inference
+
+
+def _quiet(function, *args, **kwargs):
+    with warnings.catch_warnings(), contextlib.redirect_stdout(io.StringIO()):
+        warnings.simplefilter("ignore")
+        return function(*args, **kwargs)
+
+
+class test_split_shards(unittest.TestCase):
+    def test_split_shards(self):
+        for length in [0, 1, 5, 100, 1024]:
+            for shards in [1, 2, 3, 7, 2000]:
+                ranges = process_runner.split_shards(length, shards)
+                self.assertEqual([index for start, end in ranges for index in range(start, end)], list(range(length)))
+                sizes = [end - start for start, end in ranges]
+                self.assertTrue(len(sizes) == 0 or max(sizes) - min(sizes) <= 1)
+                self.assertLessEqual(len(ranges), shards)
+        with self.assertRaises(ValueError):
+            process_runner.split_shards(10, 0)
+
+
+class test_seeked_prompts(unittest.TestCase):
+    def _assert_seek_equivalent(self, build):
+        full = [line for chunk in build().iter_prompts(64) for line in chunk]
+        seeked = build()
+        length = len(full)
+        for start, end in [(length // 3, 2 * length // 3), (0, length), (length - 1, length), (5, 9), (2 * length // 3, length), (7, 7)]:
+            # The same experimentor is seeked again for each range, as a worker running several shards.
+            self.assertEqual([line for chunk in seeked.iter_prompts(4, start = start, end = end) for line in chunk], full[start:end], (start, end))
+        with self.assertRaises(ValueError):
+            list(seeked.iter_prompts(4, start = 0, end = length + 1))
+
+    def test_normal(self):
+        self._assert_seek_equivalent(lambda: _quiet(experimentor.single_experimentor, original_dataset = hgf_dataset_loader.subjective()))
+
+    def test_domain_pseudo_queries(self):
+        self._assert_seek_equivalent(lambda: _quiet(experimentor.prior_bias_experimentor, original_dataset = hgf_dataset_loader.trec(), bias_type = "domain"))
+
+    def test_label_errors(self):
+        def build():
+            ret = _quiet(experimentor.single_experimentor, original_dataset = hgf_dataset_loader.subjective())
+            ret.prompt_former.set_label_wrong_rate(0.5)
+            return ret
+        self._assert_seek_equivalent(build)
+
+
+class test_run_in_processes(unittest.TestCase):
+    def _assert_same_as_serial(self, benchmark_factory):
+        serial = _quiet(benchmark_factory().auto_run, _fake_inference)
+        parallel = _quiet(process_runner.run_in_processes, benchmark_factory, _build_inference, processes = 2, shards = 3)
+        self.assertEqual(parallel, serial)
+
+    def test_normal(self):
+        self._assert_same_as_serial(functools.partial(normal.Normal, datasets = _DATASETS, lazy_load = True))
+
+    def test_domain_bias(self):
+        self._assert_same_as_serial(functools.partial(diagnosis.Domain_bias, datasets = _DATASETS, lazy_load = True))
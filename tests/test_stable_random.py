@@ -0,0 +1,62 @@
+# The samplers of stable_random must return exactly the same sequences as the reference `list.pop` sampling, for every size.
+import unittest
+from ..util import stable_random
+
+
+def _reference_sample_positions(length, floats):
+    remaining = list(range(length))
+    return [remaining.pop(int(random_float * (length - j))) for j, random_float in enumerate(floats)]
+
+
+class test_sample_positions(unittest.TestCase):
+    def test_equivalent_to_pop_sampling(self):
+        # Both the dense (n * 32 > length) and the sparse storages, including n == length (shuffle).
+        my_random = stable_random.stable_random()
+        for length in [1, 2, 3, 7, 31, 32, 33, 64, 100, 1000, 4097]:
+            for n in sorted({1, 2, length // 32, length // 31 + 1, length // 2, length - 1, length}):
+                if n < 1 or n > length:
+                    continue
+                floats = my_random.get_floats(n)
+                self.assertEqual(my_random._sample_positions(length, floats), _reference_sample_positions(length, floats), (length, n))
+
+    def test_extreme_floats(self):
+        my_random = stable_random.stable_random()
+        for length in [1, 5, 64, 1000]:
+            for value in [0.0, 0.5, 1 - 2 ** -53]:
+                floats = [value] * length
+                self.assertEqual(my_random._sample_positions(length, floats), _reference_sample_positions(length, floats))
+
+    def test_public_samplers(self):
+        items = list(range(5000))
+        floats = stable_random.stable_random().get_floats(len(items))
+        self.assertEqual(stable_random.stable_random().shuffle_list(items), _reference_sample_positions(len(items), floats))
+        floats = stable_random.stable_random().get_floats(2000)
+        self.assertEqual(stable_random.stable_random().sample_index_set(2000, 5000), _reference_sample_positions(5000, floats))
+
+
+class test_sampled_elements(unittest.TestCase):
+    def test_elements_are_copies(self):
+        # As the baseline (which sampled from a deep copy of the list): changing the sampled elements doesn't change the input list.
+        rows = [[i, [str(i)]] for i in range(100)]
+        expected = [[i, [str(i)]] for i in range(100)]
+        for sample in [
+            stable_random.stable_random().shuffle_list(rows),
+            stable_random.stable_random().sample_n_elements_from_list(rows, 10),
+            stable_random.stable_random().sample_n_elements_from_list(rows, 200, allow_repetition = True),
+        ]:
+            for row in sample:
+                self.assertIn(row, expected)
+            for row in sample:
+                row[0] = -1
+                row[1].append("changed")
+        self.assertEqual(rows, expected)
+
+    def test_repeated_elements_share_one_copy(self):
+        rows = [[0], [1]]
+        sample = stable_random.stable_random().sample_n_elements_from_list(rows, 50, allow_repetition = True)
+        for row in sample:
+            self.assertIs(row, sample[[other[0] for other in sample].index(row[0])])
+
+
+if __name__ == "__main__":
+    unittest.main()
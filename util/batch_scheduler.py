@@ -0,0 +1,109 @@
+class length_bucketed_scheduler():
+    """
+        A wrapper of a batched inference function, to be used as the forward_inference of `auto_run(batched_inference = True)`.
+        The prompts are sorted by length (longest first) and split into batches with at most `token_budget` padded tokens (the longest length in the batch * the batch size),
+        so that the prompts in one batch have similar lengths and less padding is wasted. Each batch is inputted into the batched inference function, and the results are scattered back into the original order of the prompts.
+        Main members:
+            batched_inference: (prompt: list[str], label_space: list[str]) -> list[list[float]] <logits> or list[int] <label>; the wrapped function. E.g. a functools.partial of model_kernel.batched_ICL_inference_with_torch_Causal_LM.
+            token_budget: int; the max number of the padded tokens in one batch. A prompt longer than the budget is inputted alone.
+            max_batch_size: int; the max number of the prompts in one batch. None for no limit.
+            length_function: (prompt: str) -> int; the length of a prompt.
+                Default: the length of the `input_ids` of a tokenized_prompt (prompt_writter.set_tokenizer); else the number of the tokens by the `tokenizer` if given; else the number of the characters.
+                For a list of prompts (the noisy channel), the sum of the lengths.
+            batch_calibration_function: list[list[float]] -> list[list[float]]; applied on all the results in the original order.
+                Use it instead of the batch_calibration_function of the wrapped function, which would only see one batch.
+            verbose: bool; if True, print the padding efficiency after each call.
+        Main methods:
+            __call__: (prompt: list[str], label_space: list[str]) -> list; the results aligned with the inputted prompts.
+            get_padding_efficiency: the number of the real tokens / the number of the padded tokens, over all the calls since the last reset_statistics.
+            get_statistics: dict of the numbers of the calls, prompts, batches, real tokens and padded tokens.
+            reset_statistics: reset the statistics.
+    """
+    def __init__(
+        self,
+        batched_inference: callable,
+        token_budget: int = 16384,
+        max_batch_size: int = None,
+        length_function: callable = None,
+        tokenizer: callable = None,
+        batch_calibration_function: callable = None,
+        verbose: bool = True
+    ):
+        if token_budget < 1:
+            raise ValueError("token_budget should be a positive integer.")
+        if max_batch_size is not None and max_batch_size < 1:
+            raise ValueError("max_batch_size should be a positive integer or None.")
+        self.batched_inference = batched_inference
+        self.token_budget = token_budget
+        self.max_batch_size = max_batch_size
+        self.tokenizer = tokenizer
+        self.length_function = length_function if length_function is not None else self._default_length
+        self.batch_calibration_function = batch_calibration_function
+        self.verbose = verbose
+        self.reset_statistics()
+
+    def __str__(self):
+        return "length_bucketed_scheduler(" + str(self.batched_inference) + ", token_budget = " + str(self.token_budget) + ")"
+
+    def _default_length(self, prompt):
+        if isinstance(prompt, list):
+            return sum([self._default_length(single_prompt) for single_prompt in prompt])
+        if getattr(prompt, "input_ids", None) is not None:
+            return len(prompt.input_ids)
+        if self.tokenizer is not None:
+            return len(self.tokenizer(prompt).input_ids)
+        return len(prompt)
+
+    def reset_statistics(self):
+        self._statistics = {"calls": 0, "prompts": 0, "batches": 0, "real_tokens": 0, "padded_tokens": 0}
+
+    def get_statistics(self):
+        return dict(self._statistics)
+
+    def get_padding_efficiency(self):
+        if self._statistics["padded_tokens"] == 0:
+            return 1.0
+        return self._statistics["real_tokens"] / self._statistics["padded_tokens"]
+
+    def schedule(self, lengths: list[int]) -> list[list[int]]:
+        # Return the batches as the lists of the indexes of the prompts.
+        order = sorted(range(len(lengths)), key = lambda index: -lengths[index]) # Stable: the prompts with the same length keep their order.
+        batches = []
+        for index in order:
+            if len(batches) > 0:
+                batch = batches[-1]
+                # Sorted descending: the first prompt of the batch is the longest.
+                if lengths[batch[0]] * (len(batch) + 1) <= self.token_budget and (self.max_batch_size is None or len(batch) < self.max_batch_size):
+                    batch.append(index)
+                    continue
+            batches.append([index])
+        return batches
+
+    def __call__(self, prompt: list[str], label_space: list[str]):
+        lengths = [self.length_function(single_prompt) for single_prompt in prompt]
+        results = [None] * len(prompt)
+        real_tokens = 0
+        padded_tokens = 0
+        batches = self.schedule(lengths)
+        for batch in batches:
+            batch_results = self.batched_inference(prompt = [prompt[index] for index in batch], label_space = label_space)
+            if len(batch_results) != len(batch):
+                raise ValueError("The batched inference function should return one result for each prompt.")
+            for index, result in zip(batch, batch_results):
+                results[index] = result
+            real_tokens += sum([lengths[index] for index in batch])
+            padded_tokens += lengths[batch[0]] * len(batch)
+        self._statistics["calls"] += 1
+        self._statistics["prompts"] += len(prompt)
+        self._statistics["batches"] += len(batches)
+        self._statistics["real_tokens"] += real_tokens
+        self._statistics["padded_tokens"] += padded_tokens
+        if self.verbose:
+            print("\nPadding efficiency: {:.2f}% in {} batches ({:.2f}% in total).".format(
+                real_tokens / padded_tokens * 100 if padded_tokens > 0 else 100.0,
+                len(batches),
+                self.get_padding_efficiency() * 100
+            ))
+        if self.batch_calibration_function is not None:
+            return self.batch_calibration_function(results)
+        return results
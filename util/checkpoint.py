@@ -0,0 +1,125 @@
+# Checkpoint directory for long benchmark runs.
+# Each experimentor (and each pass of a multi-pass sensitivity experimentor) has one JSON-lines file in the directory:
+#   line 1: {"header": <the configuration of the run>}
+#   then: {"index": <the global prompt index, see single_experimentor.iter_prompts>, "prediction": <list[float] or int>}, appended and fsync-ed as the predictions complete.
+# A restarted run reads the file back and only infers the prompts that are not recorded yet.
+import json
+import os
+import re
+
+CHECKPOINT_SUFFIX = ".jsonl"
+
+
+def _to_json_value(prediction):
+    # Convert the array-like results (e.g. NumPy arrays / scalars, torch tensors) into plain Python values.
+    if hasattr(prediction, "tolist"):
+        return prediction.tolist()
+    if isinstance(prediction, (list, tuple)):
+        return [_to_json_value(value) for value in prediction]
+    return prediction
+
+
+class checkpoint_file():
+    """
+        The durable record of the predictions of one experimentor pass.
+        Main members:
+            path: str; the path of the JSON-lines file.
+            header: dict; the configuration of the run. A file with another header can't be resumed (ValueError).
+            completed: dict; global prompt index -> prediction, the predictions recorded so far.
+        Main methods:
+            append: record the predictions [(global_index, prediction), ...], and flush them to the disk (os.fsync) before returning.
+            close: close the file.
+    """
+    def __init__(self, path: str, header: dict):
+        self.path = path
+        self.header = json.loads(json.dumps(header)) # As it will be read back.
+        self.completed = {}
+        if os.path.exists(path):
+            self._load()
+            self._file = open(path, "a", encoding = "utf-8")
+        else:
+            self._file = open(path, "w", encoding = "utf-8")
+            self._write_lines([{"header": self.header}])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self.completed)
+
+    def _load(self):
+        path = self.path
+        with open(path, "rb") as file:
+            data = file.read()
+        # A crash can leave a partially written last line: it is dropped (and cut from the file), and the prediction is inferred again.
+        valid_length = data.rfind(b"\n") + 1
+        if valid_length < len(data):
+            with open(path, "r+b") as file:
+                file.truncate(valid_length)
+        lines = data[:valid_length].decode("utf-8").splitlines()
+        if len(lines) == 0:
+            with open(path, "w", encoding = "utf-8") as file:
+                file.write(json.dumps({"header": self.header}) + "\n")
+            return
+        header = json.loads(lines[0]).get("header")
+        if header != self.header:
+            raise ValueError("The checkpoint {} was written by another configuration: {}, but the current one is {}. Use another checkpoint directory.".format(path, header, self.header))
+        for line in lines[1:]:
+            record = json.loads(line)
+            self.completed[record["index"]] = record["prediction"]
+
+    def _write_lines(self, records):
+        self._file.write("".join([json.dumps(record) + "\n" for record in records]))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def append(self, lines):
+        records = []
+        for index, prediction in lines:
+            prediction = _to_json_value(prediction)
+            self.completed[index] = prediction
+            records.append({"index": index, "prediction": prediction})
+        if len(records) > 0:
+            self._write_lines(records)
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+
+class checkpoint_directory():
+    """
+        A directory of checkpoint_files, one for each experimentor pass, named after the experimentor type, the bias type, the dataset and the pass.
+        Main methods:
+            __init__:
+                - path: str; the directory. Created if it doesn't exist.
+            open: (name: str, header: dict) -> checkpoint_file; open (or resume) the checkpoint file with the name.
+            clear: delete all the checkpoint files in the directory.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(path, exist_ok = True)
+
+    def __str__(self):
+        return "checkpoint_directory(" + self.path + ")"
+
+    def _file_path(self, name: str):
+        return os.path.join(self.path, re.sub(r"[^\w.\-]", "_", name) + CHECKPOINT_SUFFIX)
+
+    def open(self, name: str, header: dict) -> checkpoint_file:
+        return checkpoint_file(self._file_path(name), header)
+
+    def clear(self):
+        for file_name in os.listdir(self.path):
+            if file_name.endswith(CHECKPOINT_SUFFIX):
+                os.remove(os.path.join(self.path, file_name))
+
+
+def as_checkpoint_directory(directory):
+    # Accept a path or a checkpoint_directory. None stays None.
+    if directory is None or isinstance(directory, checkpoint_directory):
+        return directory
+    return checkpoint_directory(directory)
@@ -0,0 +1,232 @@
+# Memory-mapped columnar format for the cached datasets.
+# File layout (all the integers are 8-byte, in the byte order recorded by the magic):
+#   header: magic (8 bytes), version (uint32), input_element_numbers (uint32), row_numbers (uint64),
+#           source_size (uint64), source_mtime (int64); the size and the modification time (ns) of the pickled table (`*.dataset`) it was converted from (0 and 0 if none)
+#   labels: int64 * row_numbers
+#   offsets: uint64 * (row_numbers * input_element_numbers + 1); byte offsets of each input text in the text buffer
+#   texts: the UTF-8 encoded input texts, concatenated
+# The table is decoded row by row on access, so loading a dataset neither parses nor allocates the full table.
+# The columnar files are not shipped. They are looked up in the `cached_dataset` folder (written by `convert_cached_datasets`) and in the user cache folder
+#   (see `get_user_cache_directory`; written on the first load of a dataset). A file whose recorded source size and modification time don't match the pickled table
+#   (e.g. the pickle was regenerated) is stale and ignored, so checking a file only costs a `stat` of the pickle.
+import array
+import hashlib
+import importlib.util
+import mmap
+import os
+import pickle
+import struct
+import sys
+
+_MAGIC = {"little": b"STAICCcl", "big": b"STAICCcb"}
+_VERSION = 3
+_HEADER = struct.Struct("=8sIIQQq")
+_HEADERS = {"little": struct.Struct("<8sIIQQq"), "big": struct.Struct(">8sIIQQq")}
+COLUMNAR_SUFFIX = ".columnar"
+PICKLED_SUFFIX = ".dataset"
+
+
+class columnar_table():
+    """
+        A read-only, list-like table of (list[str], int) rows backed by a memory-mapped columnar file.
+        It can be used in place of the `basic_datasets_loader.table` list.
+        Main methods:
+            __init__:
+                - path: str; the path of the columnar file, written by `write_columnar_table`.
+            __len__, __getitem__ (int or slice), __iter__: as a list of (list[str], int).
+        Pickling a columnar_table only stores the path, and the receiver maps the file again.
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        with open(path, "rb") as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ)
+        header = _unpack_header(self._mmap)
+        if header is None:
+            raise ValueError("The file {} is not a StaICC columnar dataset.".format(path))
+        magic, _, self._input_element_numbers, self._row_numbers, _, _ = header
+        label_start = _HEADER.size
+        offset_start = label_start + 8 * self._row_numbers
+        text_start = offset_start + 8 * (self._row_numbers * self._input_element_numbers + 1)
+        buffer = memoryview(self._mmap)
+        if magic == _MAGIC[sys.byteorder]:
+            self._labels = buffer[label_start:offset_start].cast("q")
+            self._offsets = buffer[offset_start:text_start].cast("Q")
+        else:
+            # Written on a host with another byte order: swap a copy of the integer columns.
+            self._labels = array.array("q")
+            self._labels.frombytes(buffer[label_start:offset_start])
+            self._labels.byteswap()
+            self._offsets = array.array("Q")
+            self._offsets.frombytes(buffer[offset_start:text_start])
+            self._offsets.byteswap()
+        self._texts = buffer[text_start:]
+
+    def __len__(self) -> int:
+        return self._row_numbers
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._get_row(i) for i in range(*index.indices(self._row_numbers))]
+        if index < 0:
+            index += self._row_numbers
+        if index < 0 or index >= self._row_numbers:
+            raise IndexError("Index out of range.")
+        return self._get_row(index)
+
+    def __iter__(self):
+        for i in range(self._row_numbers):
+            yield self._get_row(i)
+
+    def __reduce__(self):
+        return (columnar_table, (self._path,))
+
+    def __deepcopy__(self, memo):
+        # Read-only: copies can share the mapping.
+        return self
+
+    def _get_row(self, index: int) -> tuple[list[str], int]:
+        start = index * self._input_element_numbers
+        texts = [
+            str(self._texts[self._offsets[i]:self._offsets[i + 1]], "utf-8")
+            for i in range(start, start + self._input_element_numbers)
+        ]
+        return (texts, self._labels[index])
+
+
+def _unpack_header(buffer):
+    # Return the header fields of a columnar file in the byte order recorded by its magic, or None if it is not a columnar file of the current version.
+    if len(buffer) < _HEADER.size:
+        return None
+    for byteorder, magic in _MAGIC.items():
+        if bytes(buffer[:len(magic)]) == magic:
+            header = _HEADERS[byteorder].unpack_from(buffer, 0)
+            return header if header[1] == _VERSION else None
+    return None
+
+
+def get_source_stamp(source_path: str) -> tuple[int, int]:
+    # The (size, modification time in ns) of the pickled table `source_path`, recorded in the header of its columnar file.
+    status = os.stat(source_path)
+    return status.st_size, status.st_mtime_ns
+
+
+def read_source_stamp(path: str):
+    # Return the (size, modification time) recorded in the columnar file `path`, or None if it is not a readable columnar file of the current version.
+    try:
+        with open(path, "rb") as file:
+            header = _unpack_header(file.read(_HEADER.size))
+    except OSError:
+        return None
+    if header is None:
+        return None
+    return header[4], header[5]
+
+
+def write_columnar_table(table, path: str, source_stamp: tuple[int, int] = (0, 0)) -> None:
+    # Write a table of (list[str], int) rows into the columnar file `path`, recording the `source_stamp` (see `get_source_stamp`) of the pickled table.
+    # Written into a temporary file and renamed, so a concurrent reader never maps a partial file.
+    if len(table) == 0:
+        raise ValueError("Can't write an empty table.")
+    input_element_numbers = len(table[0][0])
+    labels = array.array("q")
+    offsets = array.array("Q", [0])
+    texts = bytearray()
+    for inputs, label in table:
+        if len(inputs) != input_element_numbers:
+            raise ValueError("All the rows should have the same number of input elements.")
+        labels.append(label)
+        for text in inputs:
+            texts += text.encode("utf-8")
+            offsets.append(len(texts))
+    temporary_path = "{}.{}.tmp".format(path, os.getpid())
+    try:
+        with open(temporary_path, "wb") as file:
+            file.write(_HEADER.pack(_MAGIC[sys.byteorder], _VERSION, input_element_numbers, len(table), source_stamp[0], source_stamp[1]))
+            file.write(labels.tobytes())
+            file.write(offsets.tobytes())
+            file.write(texts)
+        os.replace(temporary_path, path)
+    finally:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+
+
+def get_cache_directory(package: str):
+    # Return the path of the `cached_dataset` folder of the `package`, or None if it is not a folder on the disk (e.g. in a zip).
+    spec = importlib.util.find_spec(package + ".cached_dataset")
+    if spec is None or not spec.submodule_search_locations:
+        return None
+    directory = list(spec.submodule_search_locations)[0]
+    if not os.path.isdir(directory):
+        return None
+    return directory
+
+
+def get_source_path(package: str, dataset_file: str):
+    # Return the path of the pickled `dataset_file` (e.g. 'sst5.dataset') in the `cached_dataset` folder, or None if the folder is not on the disk.
+    directory = get_cache_directory(package)
+    if directory is None or not os.path.isfile(os.path.join(directory, dataset_file)):
+        return None
+    return os.path.join(directory, dataset_file)
+
+
+def get_user_cache_directory() -> str:
+    # The folder for the columnar files built on load: $STAICC_CACHE, or StaICC/ in the user cache folder ($XDG_CACHE_HOME or ~/.cache).
+    if os.environ.get("STAICC_CACHE"):
+        return os.environ["STAICC_CACHE"]
+    return os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"), "StaICC")
+
+
+def get_user_columnar_path(source_path: str) -> str:
+    # The path of the columnar version of the pickled table `source_path` in the user cache folder.
+    # Named after the absolute path of the pickle, so several installations don't share (and rebuild) one file.
+    source_path = os.path.abspath(source_path)
+    name = os.path.basename(source_path)[:-len(PICKLED_SUFFIX)]
+    return os.path.join(get_user_cache_directory(), name + "." + hashlib.sha256(source_path.encode("utf-8")).hexdigest()[:16] + COLUMNAR_SUFFIX)
+
+
+def find_columnar_file(source_path: str):
+    # Return the path of an up-to-date columnar version of the pickled table `source_path`: beside it (see `convert_cached_datasets`) or in the user cache folder.
+    # None if there is none: missing, or stale (converted from another version of the pickle).
+    source_stamp = get_source_stamp(source_path)
+    for path in [source_path[:-len(PICKLED_SUFFIX)] + COLUMNAR_SUFFIX, get_user_columnar_path(source_path)]:
+        if os.path.isfile(path) and read_source_stamp(path) == source_stamp:
+            return path
+    return None
+
+
+def cache_columnar_table(table, source_path: str):
+    # Write the columnar version of `table`, loaded from the pickle `source_path`, into the user cache folder for the next loads.
+    # Return the written path, or None if the folder is not writable.
+    path = get_user_columnar_path(source_path)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        write_columnar_table(table, path, get_source_stamp(source_path))
+    except OSError:
+        return None
+    return path
+
+
+def convert_cached_datasets(directory: str = None) -> list[str]:
+    # Convert every pickled `*.dataset` table in `directory` (default: the `cached_dataset` folder of this package) into the columnar format.
+    # Return the paths of the written files.
+    if directory is None:
+        directory = get_cache_directory(__package__[0:-5])
+    ret = []
+    for file_name in sorted(os.listdir(directory)):
+        if not file_name.endswith(PICKLED_SUFFIX):
+            continue
+        source_path = os.path.join(directory, file_name)
+        with open(source_path, "rb") as pickle_file:
+            table = pickle.load(pickle_file)
+        path = source_path[:-len(PICKLED_SUFFIX)] + COLUMNAR_SUFFIX
+        write_columnar_table(table, path, get_source_stamp(source_path))
+        print("Converted:", file_name, "->", os.path.basename(path))
+        ret.append(path)
+    return ret
+
+
+if __name__ == "__main__":
+    # python -m StaICC.util.columnar_dataset [directory]
+    convert_cached_datasets(sys.argv[1] if len(sys.argv) > 1 else None)
@@ -39,7 +39,9 @@ WARNING_SETTINGS = {
     "tampering": "You are editing the standard settings of StaICC. You should not use the result after editing as any baselines. Be careful.",
     "FP_length_warning": "We are spliting the financial_phrasebank with a shorter dataset length. The default spliting can't be remained. Be careful.",
     "basic_dataset_template_protect": "You are editing the basic dataset template in the strict mode. Canceled.\n If you want to edit the prompt template, please edit the dataset_interface.prompt_writter.",
-    "strict_mode_protect": "The setting can't be changed in the strict mode. Return to default."
+    "strict_mode_protect": "The setting can't be changed in the strict mode. Return to default.",
+    "token_assembly_mismatch": "The token ids assembled from the pre-tokenized prompt pieces don't match the full tokenization of the prompt with this tokenizer (e.g. a tokenizer adding a prefix space to each piece). The token-level prompt assembly is disabled, and the prompts are tokenized in full.",
+    "label_token_collision": "Some labels are tokenized into the same last token, so the model can't distinguish them by the label token probabilities. Consider editing the label space of the prompt_writter."
 }
 
 PPL_ICL_INSTRUCTION_SETTINGS = {
@@ -4,6 +4,10 @@ from . import hgf_dataset_loader
 from . import configs
 import warnings
 import copy
+import array
+
+# The number of the first prompts checked against the full tokenization after `prompt_writter.set_tokenizer`.
+_TOKENIZER_PROBE_NUMBER = 16
 
 class triplet_dataset():
     """
@@ -26,6 +30,8 @@ class triplet_dataset():
                 triplet_dataset.get_label_space(): list[str]; get the label space of the demonstration set.
                 triplet_dataset.get_default_ground_truth_label(index: int): str; get the default ground truth label word of the `index`-th examples defined by the `hgf_dataset_loader.basic_datasets_loader` of the test set.
                 triplet_dataset.get_default_ground_truth_label_index(index: int): int; get the index of the default ground truth label index of the `index`-th examples defined by the `hgf_dataset_loader.basic_datasets_loader` of the test set.
+                triplet_dataset.get_default_ground_truth_label_indexes(): list[int]; the `get_default_ground_truth_label_index` of all the test samples.
+                triplet_dataset.get_demonstration_label_indexes(): list[int]; the label index of each demonstration sample (cached, read-only).
             - change: We don't recommend to use these methods. Use the same methods in the `prompt_writter` class instead.
                 triplet_dataset.change_label_space_triple(label_space: list[str]): None; change the label space of the calibration, demonstration, and test set into the `label_space`.
                 triplet_dataset.change_instruction_triple(instruction: str): None; change the instruction of the calibration, demonstration, and test set into the `instruction`.
@@ -58,6 +64,8 @@ class triplet_dataset():
         self.demonstration.rename_dataset(original_dataset_loader.get_dataset_name()+"-demonstration")
         self.test.rename_dataset(original_dataset_loader.get_dataset_name()+"-test")
         self.alternate_template = original_dataset_loader.get_alternate_template()
+        self._demonstration_label_indexes = None
+        self._demonstration_label_indexes_key = None
     
     def __str__(self) -> str:
         return ("Calibration set: \n" + self.calibration.__str__() + "\nDemonstration set: \n" + self.demonstration.__str__() + "\nTest set: \n" + self.test.__str__())
@@ -99,6 +107,19 @@ class triplet_dataset():
             raise ValueError("Index out of range.")
         return self.test.find_index_from_label(self.get_default_ground_truth_label(index))
 
+    def get_default_ground_truth_label_indexes(self) -> list[int]:
+        # get_default_ground_truth_label_index for all the test samples.
+        return [self.test.find_index_from_label(self.test.get_label(i)) for i in range(len(self.test))]
+
+    def get_demonstration_label_indexes(self) -> list[int]:
+        # The label index of each demonstration sample, as find_index_from_label(demonstration[i][1]).
+        # Cached, and recomputed only when the label space or the size of the demonstration set changes.
+        key = (tuple(self.demonstration.get_label_space()), len(self.demonstration))
+        if self._demonstration_label_indexes_key != key:
+            self._demonstration_label_indexes = [self.demonstration.find_index_from_label(self.demonstration.get_label(i)) for i in range(len(self.demonstration))]
+            self._demonstration_label_indexes_key = key
+        return self._demonstration_label_indexes
+
     def change_label_space_triple(self, label_space: list[str]):
         warnings.warn("We don't recommend to use these methods. Use the same methods in the prompt_writter class instead.")
         self.calibration.change_label_space(label_space)
@@ -153,6 +174,7 @@ class demonstration_sampler():
         Help the `experimentor` to sample the demonstration indexes for each query.
         Notice: if you want to define the demonstration indexes for each query, you should change the `demonstration_sampler` in the `experimentor` class into a list[list[int]] shaped variable.
         `demonstration_sampler` acts as a list[list[int]] shaped class.
+        The samples are stored in a contiguous int32 array of shape (query_numbers, k), in the row-major order.
         Main members:
             You shouldn't directly access all the members in this class. Use the methods in the `experimentor` class instead.
         Main methods:
@@ -161,6 +183,12 @@ class demonstration_sampler():
                 - demonstration_set_size: int; the size of the demonstration set. The width of the sampled list (len(self[0])).
                 - query_numbers: int; the number of queries. The length of the sampled list (len(self)).
                 - seed: int; the random seed for sampling.
+            get_sampled_indexes: a list copy of one row. == __getitem__.
+            get_sampled_indexes_view: a read-only memoryview of one row, without copy. For reading the row right away (e.g. to write a prompt); use get_sampled_indexes to keep a row.
+                - The view is live: the later in-place changes of the row (`_set_sample`, `_resample`, `import_matrix`) are seen through it.
+                - A resize (`_pop`, `_insert`, `_append`) while a view is held moves the samples into a new array, so the held views keep the former rows.
+            export_matrix / import_matrix: get / set all the samples as a flat array.array('i') in the row-major order.
+            copy: a cheap copy (the array and the random state) of the sampler. Also used by `copy.deepcopy`.
     """
 
     def __init__(self, k: int, demonstration_set_size: int, query_numbers: int, seed = configs.STANDARD_SETTINGS["random_seed"]):
@@ -169,7 +197,8 @@ class demonstration_sampler():
         self._query_numbers = query_numbers
         self._random = stable_random.stable_random(seed=seed)
         
-        self._sampled_indexes = []
+        self._sampled_indexes = array.array('i')
+        self._row_numbers = 0
         self._complie()
     
     def _get_next_sample(self):
@@ -179,11 +208,18 @@ class demonstration_sampler():
             return self._random.sample_index_set(self._k, self._demonstration_set_size, False)
     
     def _complie(self):
-        for i in range(self._query_numbers):
-            self._sampled_indexes.append(self._get_next_sample())
+        # Draw the randomness of all the queries in bulk; the same samples as calling `_get_next_sample` for each query.
+        for sample in self._random.sample_index_sets(
+            self._k, 
+            self._demonstration_set_size, 
+            self._query_numbers, 
+            allow_repetition = self._k > self._demonstration_set_size
+        ):
+            self._sampled_indexes.extend(sample)
+        self._row_numbers += self._query_numbers
 
     def __len__(self) -> int:
-        return len(self._sampled_indexes)
+        return self._row_numbers
     
     def __getitem__(self, index: int) -> list[int]:
         return self.get_sampled_indexes(index)
@@ -198,37 +234,133 @@ class demonstration_sampler():
 
     def __repr__(self):
         return self.__str__()
+
+    def __deepcopy__(self, memo):
+        return self.copy()
+
+    def copy(self):
+        ret = demonstration_sampler.__new__(demonstration_sampler)
+        ret.__dict__.update(self.__dict__)
+        ret._sampled_indexes = array.array('i', self._sampled_indexes)
+        ret._random = copy.copy(self._random)
+        return ret
+
+    def _check_value(self, value) -> None:
+        if len(value) != self._k:
+            raise ValueError("The length of the value should be equal to k.")
     
+    def _replace_range(self, start: int, end: int, values: array.array) -> None:
+        # Replace the flat range [start, end) of the samples with `values` (of any length).
+        # An array can't be resized while a memoryview of it is held (see get_sampled_indexes_view): then the result is built as a new array instead.
+        try:
+            self._sampled_indexes[start:end] = values
+        except BufferError:
+            self._sampled_indexes = self._sampled_indexes[:start] + values + self._sampled_indexes[end:]
+
     def _pop(self, index: int) -> list[int]:
         if index < 0 or index >= self._query_numbers:
             raise ValueError("Index out of range.")
-        ret = self._sampled_indexes[index]
-        self._sampled_indexes.pop(index)
+        ret = self._sampled_indexes[index * self._k : (index + 1) * self._k].tolist()
+        self._replace_range(index * self._k, (index + 1) * self._k, array.array('i'))
+        self._row_numbers -= 1
         return ret
     
     def _insert(self, index: int, value: list[int]) -> None:
         if index < 0 or index > self._query_numbers:
             raise ValueError("Index out of range.")
-        if len(value) != self._k:
-            raise ValueError("The length of the value should be equal to k.")
-        self._sampled_indexes.insert(index, value)
+        self._check_value(value)
+        self._replace_range(index * self._k, index * self._k, array.array('i', value))
+        self._row_numbers += 1
     
     def _append(self, value: list[int]) -> None:
-        if len(value) != self._k:
-            raise ValueError("The length of the value should be equal to k.")
-        self._sampled_indexes.append(value)
+        self._check_value(value)
+        self._replace_range(len(self._sampled_indexes), len(self._sampled_indexes), array.array('i', value))
+        self._row_numbers += 1
 
     def _set_sample(self, index, value: list[int]) -> None:
         if index < 0 or index >= self._query_numbers:
             raise ValueError("Index out of range.")
-        if len(value) != self._k:
-            raise ValueError("The length of the value should be equal to k.")
-        self._sampled_indexes[index] = value
+        self._check_value(value)
+        self._sampled_indexes[index * self._k : (index + 1) * self._k] = array.array('i', value)
+
+    def _resample(self, indexes: list[int], is_accepted: callable) -> None:
+        # For each row in `indexes` (in order), replace it with the first next sample that is_accepted(row_index, sample).
+        # The same results and random state as calling `_get_next_sample` until accepted row by row, 
+        #   but the candidates are drawn in batches, and the random state is rewound to the end of the last accepted candidate.
+        allow_repetition = self._k > self._demonstration_set_size
+        position = self._random.get_position()
+        accepted_position = position
+        done = 0
+        while done < len(indexes):
+            batch_size = min(max(4 * (len(indexes) - done), 16), 4096)
+            candidates = self._random.sample_index_sets(self._k, self._demonstration_set_size, batch_size, allow_repetition = allow_repetition)
+            for used, candidate in enumerate(candidates):
+                if is_accepted(indexes[done], candidate):
+                    self._set_sample(indexes[done], candidate)
+                    accepted_position = position + (used + 1) * self._k
+                    done += 1
+                    if done == len(indexes):
+                        break
+            position += batch_size * self._k
+        self._random.seek(accepted_position)
+
+    def _set_samples(self, indexes: list[int], values: list[list[int]]) -> None:
+        # Bulk version of `_set_sample`: set the row indexes[i] to values[i].
+        if len(indexes) != len(values):
+            raise ValueError("The length of the indexes should be equal to the length of the values.")
+        for index, value in zip(indexes, values):
+            self._set_sample(index, value)
     
     def get_sampled_indexes(self, index) -> list[int]:
         if index < 0 or index >= self._query_numbers:
             raise ValueError("Index out of range.")
-        return copy.deepcopy(self._sampled_indexes[index])
+        return self._sampled_indexes[index * self._k : (index + 1) * self._k].tolist()
+
+    def get_sampled_indexes_view(self, index) -> memoryview:
+        if index < 0 or index >= self._query_numbers:
+            raise ValueError("Index out of range.")
+        return memoryview(self._sampled_indexes)[index * self._k : (index + 1) * self._k].toreadonly()
+
+    def export_matrix(self) -> array.array:
+        # A flat copy of all the samples, in the shape of (len(self), k), row-major.
+        return array.array('i', self._sampled_indexes)
+
+    def import_matrix(self, matrix) -> None:
+        # Set all the samples from a flat sequence of integers in the shape of (len(self), k), row-major (e.g. the return of `export_matrix`).
+        # Written in place, so the held views (see get_sampled_indexes_view) see the new samples.
+        matrix = array.array('i', matrix)
+        if len(matrix) != self._row_numbers * self._k:
+            raise ValueError("The size of the matrix should be equal to len(self) * k.")
+        self._sampled_indexes[:] = matrix
+
+
+class noisy_channel_prompts(list):
+    """
+        The structured return of a noisy channel prompt (see `prompt_writter.set_shared_prefix_output`).
+        It is the same list of the full prompts w.r.t. each label as the plain return, so it can be used anywhere the plain return is used.
+        Main members:
+            shared_prefix: str; the common prefix of all the prompts (the instruction and the demonstrations).
+            label_suffixes: list[str]; the rest of each prompt: self[i] == shared_prefix + label_suffixes[i].
+    """
+
+    def __init__(self, shared_prefix: str, label_suffixes: list[str]):
+        super().__init__([shared_prefix + suffix for suffix in label_suffixes])
+        self.shared_prefix = shared_prefix
+        self.label_suffixes = label_suffixes
+
+
+class tokenized_prompt(str):
+    """
+        A prompt string with its token ids, returned by `prompt_writter.write_prompt` when a tokenizer is set by `prompt_writter.set_tokenizer`.
+        It is a `str`, so it can be used anywhere the plain prompt is used; the inference kernels can use the `input_ids` instead of tokenizing the prompt again.
+        Main members:
+            input_ids: list[int]; the token ids of the prompt, the same as tokenizer(prompt).input_ids.
+    """
+
+    def __new__(cls, prompt: str, input_ids: list[int] = None):
+        ret = super().__new__(cls, prompt)
+        ret.input_ids = input_ids
+        return ret
 
 
 class prompt_writter():
@@ -241,9 +373,13 @@ class prompt_writter():
             __init__:
                 - triplet_dataset: triplet_dataset; the triplet dataset.
                 - use_noisy_channel: bool; whether to use the noisy channel mode (with a prompt like <label><text><label><text>...).
-                - pseudo_query_generater: None or callable; the pseudo query generater (with next() available) for some special usage (such as Contextual Calibration). If None, the pseudo query will not be used.
+                - pseudo_query_generater: None or iterator; the pseudo query generater (with next() available) for some special usage (such as Contextual Calibration). If None, the pseudo query will not be used.
+                  Use a picklable iterator object (e.g. `experimentor.domain_query_iterator`) instead of a generator if the prompt writter should be pickled or deep-copied.
             prompt_writter.reset(): None; set the prompt writter to the default template defined by the original dataset (`triplet_dataset`).
             prompt_writter.use_noisy_channel(new_label_affix = " ", new_last_input_affix = "\n"): None; set the prompt writter to the noisy channel mode. The label affix and the last_input_affix can be changed.
+            prompt_writter.set_shared_prefix_output(enable = True): None; in the noisy channel mode, return the prompts as a `noisy_channel_prompts` with the shared prefix and the per-label suffixes.
+            prompt_writter.set_tokenizer(tokenizer, verify = False, boundary_window = 4): None; in the direct mode, return the prompts as a `tokenized_prompt` with the token ids assembled from the cached pre-tokenized pieces.
+            prompt_writter.seek_prompts(prompt_number: int, demonstration_numbers): None; set the random stream of the label errors and the pseudo query generator as if `prompt_number` prompts were written after the initialization.
             prompt_writter.get_label_of_test_samples(query_index: int): str; get the label word of the `index`-th examples defined by the `hgf_dataset_loader.basic_datasets_loader` of the test set.
             change: 
                 prompt_writter.change_instruction(instruction: str): None; change the instruction of the prompt writter into the `instruction`.
@@ -300,11 +436,21 @@ class prompt_writter():
             pseudo_query_generater = None,
         ):
         self._triplet_dataset = triplet_dataset
+        self.shared_prefix_output = False # Not a part of the template: kept over `reset`.
+        self.set_tokenizer(None)
         self.reset()
         if use_noisy_channel:
             self.use_noisy_channel()
         self.pseudo_prompt = pseudo_query_generater
     
+    def __getstate__(self):
+        # The rendering caches are rebuilt on demand, so they are not pickled.
+        state = self.__dict__.copy()
+        state["_compiled_template"] = None
+        state["_fragment_cache"] = {}
+        state["_token_cache"] = {}
+        return state
+
     def reset(self):
         self._instruction = copy.deepcopy(self._triplet_dataset.demonstration.get_instruction())
         self._input_text_prefixes = copy.deepcopy(self._triplet_dataset.demonstration.get_input_text_prefixes())
@@ -318,21 +464,122 @@ class prompt_writter():
         self._random_for_label_error = stable_random.stable_random()
         self.label_wrong_rate = 0
         self.cut_by_length = 0
+        self._invalidate_template()
     
     def set_label_wrong_rate(self, label_wrong_rate: float):
         self.label_wrong_rate = label_wrong_rate
 
+    def seek_prompts(self, prompt_number: int, demonstration_numbers):
+        # Go to the state after `prompt_number` calls of `write_prompt` from the initialization, without writing the prompts.
+        # demonstration_numbers: iterable of int; the numbers of the demonstrations of the prompts before, only read when the label wrong rate is not 0.
+        if prompt_number < 0:
+            raise ValueError("prompt_number should be non-negative.")
+        if self.label_wrong_rate == 0:
+            self._random_for_label_error.seek(0)
+        else:
+            self._random_for_label_error.seek(sum([int(number * self.label_wrong_rate) for _, number in zip(range(prompt_number), demonstration_numbers)]))
+        if self.pseudo_prompt:
+            if not hasattr(self.pseudo_prompt, "seek"):
+                raise ValueError("The pseudo query generater can't be seeked. Use an iterator object with a `seek(query_index)` method.")
+            self.pseudo_prompt.seek(prompt_number)
+
     def use_noisy_channel(self, new_label_affix = " ", new_last_input_affix = "\n"):
         if not self._noisy_channel:
             self._noisy_channel = True
             self._label_affix = new_label_affix
             self._input_text_affixes[-1] = new_last_input_affix
+            self._invalidate_template()
+
+    def set_shared_prefix_output(self, enable = True):
+        # Only for the noisy channel mode. If enabled, the prompts are returned as a `noisy_channel_prompts`: 
+        #   the same list of the full prompts, with the shared prefix and the per-label suffixes, so that an inference kernel can encode the shared prefix only once.
+        self.shared_prefix_output = enable
+
+    def set_tokenizer(self, tokenizer, verify = False, boundary_window = 4):
+        # Only for the direct mode without `cut_by_length`. If a (HuggingFace) tokenizer is given, `write_prompt` returns a `tokenized_prompt`, 
+        #   whose token ids are the concatenation of the cached token ids of the instruction, each demonstration and the query part, so every piece is tokenized only once.
+        # For each prompt, the text around each join of the pieces (see `_is_consistent_join`) is tokenized together, to check that no token spans the join;
+        #   if one does, the prompt is tokenized in full (counted in `self.tokenizer_mismatch`).
+        # The first `_TOKENIZER_PROBE_NUMBER` prompts are also checked against the full tokenization: if any of them mismatches, the assembly is disabled with a warning.
+        # - verify: bool; if True, check every prompt against the full tokenization, and use the full tokenization for the mismatched ones (also counted).
+        # Set None to disable.
+        if boundary_window < 1:
+            raise ValueError("boundary_window should be a positive integer.")
+        self._tokenizer = tokenizer
+        self._tokenizer_verify = verify
+        self._tokenizer_boundary_window = boundary_window
+        self._tokenizer_probe_left = _TOKENIZER_PROBE_NUMBER
+        self._token_cache = {}
+        self._join_cache = {}
+        self._special_tokens = None
+        self.tokenizer_mismatch = 0
+
+    def _get_special_tokens(self):
+        # The special token ids added by the tokenizer before and after the text (e.g. BOS), found by tokenizing a probe text with and without them.
+        if self._special_tokens is None:
+            with_special = self._tokenizer("a").input_ids
+            without_special = self._tokenizer("a", add_special_tokens = False).input_ids
+            for start in range(len(with_special) - len(without_special) + 1):
+                if with_special[start : start + len(without_special)] == without_special:
+                    self._special_tokens = (with_special[:start], with_special[start + len(without_special):])
+                    break
+            else:
+                self._special_tokens = ([], [])
+        return self._special_tokens
+
+    def _tokenize_piece(self, piece: str) -> list[int]:
+        input_ids = self._token_cache.get(piece)
+        if input_ids is None:
+            input_ids = self._tokenizer(piece, add_special_tokens = False).input_ids
+            self._token_cache[piece] = input_ids
+        return input_ids
+
+    def _is_consistent_join(self, left: str, right: str) -> bool:
+        # Whether the tokens of the pieces `left` + `right` are the concatenation of their own tokens, checked on the text around the join:
+        #   at least `boundary_window` characters on each side, extended to a space (where the tokenizers split the words), so a window doesn't cut a word.
+        # The results are cached by the windows, which mostly recur (e.g. the label words and the input prefix).
+        if len(left) == 0 or len(right) == 0:
+            return True
+        tail = left[max(left.rfind(" ", 0, len(left) - self._tokenizer_boundary_window), 0):]
+        head_end = right.find(" ", self._tokenizer_boundary_window)
+        head = right if head_end == -1 else right[:head_end]
+        ret = self._join_cache.get((tail, head))
+        if ret is None:
+            ret = self._tokenizer(tail + head, add_special_tokens = False).input_ids == self._tokenize_piece(tail) + self._tokenize_piece(head)
+            self._join_cache[(tail, head)] = ret
+        return ret
+
+    def _attach_input_ids(self, prompt: str, demonstration_fragments: list[str]) -> tokenized_prompt:
+        # The pieces: instruction, demonstrations, and the query part (<query_prefix><query><label_prefix>).
+        special_prefix, special_suffix = self._get_special_tokens()
+        pieces = [self._instruction] + demonstration_fragments + [prompt[len(self._instruction) + sum([len(fragment) for fragment in demonstration_fragments]):]]
+        input_ids = list(special_prefix)
+        for piece in pieces:
+            input_ids += self._tokenize_piece(piece)
+        input_ids += special_suffix
+        if self._tokenizer_verify or self._tokenizer_probe_left > 0:
+            self._tokenizer_probe_left = max(self._tokenizer_probe_left - 1, 0)
+            full_input_ids = self._tokenizer(prompt).input_ids
+            if full_input_ids != input_ids:
+                self.tokenizer_mismatch += 1
+                if not self._tokenizer_verify:
+                    warnings.warn(configs.WARNING_SETTINGS["token_assembly_mismatch"])
+                    # Disable the assembly, but keep the mismatch count (unlike set_tokenizer(None)).
+                    self._tokenizer = None
+                    self._token_cache = {}
+            return tokenized_prompt(prompt, full_input_ids)
+        for left, right in zip(pieces[:-1], pieces[1:]):
+            if not self._is_consistent_join(left, right):
+                self.tokenizer_mismatch += 1
+                return tokenized_prompt(prompt, self._tokenizer(prompt).input_ids)
+        return tokenized_prompt(prompt, input_ids)
 
     def cancel_noisy_channel(self):
         if self._noisy_channel:
             self._noisy_channel = False
             self._label_affix = self._triplet_dataset.demonstration.get_label_affix()
             self._input_text_affixes[-1] = self._triplet_dataset.demonstration.get_input_text_affixes()[-1]
+            self._invalidate_template()
 
     def __str__(self) -> str:
         return (
@@ -404,6 +651,7 @@ class prompt_writter():
         if type(instruction) is not str:
             raise ValueError("Instruction should be a string.")
         self._instruction = copy.deepcopy(instruction)
+        self._invalidate_template()
 
     def change_input_text_prefixes(self, input_text_prefixes: list[str]):
         warnings.warn(configs.WARNING_SETTINGS["tampering"])
@@ -413,6 +661,7 @@ class prompt_writter():
             if type(prefix) is not str:
                 raise ValueError("Input text prefixes should be a list of strings.")
         self._input_text_prefixes = copy.deepcopy(input_text_prefixes)
+        self._invalidate_template()
     
     def change_input_text_affixes(self, input_text_affixes: list[str]):
         warnings.warn(configs.WARNING_SETTINGS["tampering"])
@@ -424,24 +673,28 @@ class prompt_writter():
         if len(input_text_affixes) != self.input_element_numbers:
             raise ValueError("The number of input text affixes should be equal to the number of input elements.")
         self._input_text_affixes = copy.deepcopy(input_text_affixes)
+        self._invalidate_template()
     
     def change_label_prefix(self, label_prefix: str):
         warnings.warn(configs.WARNING_SETTINGS["tampering"])
         if type(label_prefix) is not str:
             raise ValueError("Label prefix should be a string.")
         self._label_prefix = copy.deepcopy(label_prefix)
+        self._invalidate_template()
     
     def change_label_affix(self, label_affix: str):
         warnings.warn(configs.WARNING_SETTINGS["tampering"])
         if type(label_affix) is not str:
             raise ValueError("Label affix should be a string.")
         self._label_affix = copy.deepcopy(label_affix)
+        self._invalidate_template()
     
     def change_query_prefix(self, query_prefix: str):
         warnings.warn(configs.WARNING_SETTINGS["tampering"])
         if type(query_prefix) is not str:
             raise ValueError("Query prefix should be a string.")
         self._query_prefix = copy.deepcopy(query_prefix)
+        self._invalidate_template()
 
     def change_label_space(self, label_space: list[str]):
         warnings.warn(configs.WARNING_SETTINGS["tampering"])
@@ -451,6 +704,7 @@ class prompt_writter():
             if type(label) is not str:
                 raise ValueError("Label space should be a list of strings.")
         self._label_space = copy.deepcopy(label_space)
+        self._invalidate_template()
 
     def get_label_space(self):
         # Return a deep copy of the label space.
@@ -465,6 +719,57 @@ class prompt_writter():
         self.change_label_prefix(self._label_prefix[:-1])
         self.change_label_space(new_label_space)
     
+    def _invalidate_template(self):
+        # Drop the compiled template and the rendered demonstration fragments. Called whenever the template is changed.
+        self._compiled_template = None
+        self._fragment_cache = {}
+
+    def _get_compiled_template(self):
+        # The compiled template: {label word in the dataset: the rendered <label_prefix><label><label_affix>}.
+        # Also recompiled when the label space of the demonstration set is changed (e.g. by `triplet_dataset.change_label_space_triple`).
+        demonstration_label_space = self._triplet_dataset.demonstration.get_label_space()
+        if self._compiled_template is None or self._compiled_template[0] != tuple(demonstration_label_space):
+            rendered_labels = {}
+            for i, label in enumerate(demonstration_label_space):
+                # The same as the first match of `find_index_from_label`. None for the labels out of the prompt label space.
+                if label not in rendered_labels:
+                    rendered_labels[label] = self._label_prefix + self._label_space[i] + self._label_affix if i < len(self._label_space) else None
+            self._compiled_template = (tuple(demonstration_label_space), rendered_labels)
+            self._fragment_cache = {}
+        return self._compiled_template[1]
+
+    def _render_demonstration(self, demonstration_line):
+        # Render one (inputs, label word) demonstration into the prompt fragment.
+        rendered_label = self._get_compiled_template().get(demonstration_line[1])
+        if rendered_label is None:
+            # Raise the same error as the uncompiled template.
+            rendered_label = self._label_prefix + self._label_space[self._triplet_dataset.demonstration.find_index_from_label(demonstration_line[1])] + self._label_affix
+        rendered_inputs = ''.join([
+            self._input_text_prefixes[i] + demonstration_line[0][i] + self._input_text_affixes[i]
+            for i in range(self._triplet_dataset.demonstration.get_input_element_numbers())
+        ])
+        if self._noisy_channel:
+            return rendered_label + rendered_inputs
+        return rendered_inputs + rendered_label
+
+    def _assemble_prompt(self, demonstration_fragments: list[str], query_line: list[str], cut_by_length = 0):
+        rendered_query = ''.join([
+            self._input_text_prefixes[i] + query_line[i] + self._input_text_affixes[i]
+            for i in range(self._triplet_dataset.test.get_input_element_numbers())
+        ])
+        if self._noisy_channel:
+            demonstrations = self._instruction + ''.join(demonstration_fragments)
+            ret = []
+            for label in self._label_space:
+                prompt = ''.join([demonstrations, self._label_prefix, label, self._label_affix, self._query_prefix, rendered_query])
+                ret.append(prompt[:len(prompt) - cut_by_length])
+            if self.shared_prefix_output:
+                shared_prefix = demonstrations[:min([len(demonstrations)] + [len(prompt) for prompt in ret])]
+                return noisy_channel_prompts(shared_prefix, [prompt[len(shared_prefix):] for prompt in ret])
+            return ret
+        prompt = ''.join([self._instruction] + demonstration_fragments + [self._query_prefix, rendered_query, self._label_prefix])
+        return prompt[:len(prompt) - cut_by_length]
+
     def write_prompt(self, demos_indexes: list[int], query_index: int = None):
         # Use the indexes of the demonstrations and the query to write a prompt.
         # demos_indexes: [demo1, demo2, ..., demok]
@@ -476,26 +781,36 @@ class prompt_writter():
         wrong_label_number = int(len(demos_indexes) * self.label_wrong_rate)
         if wrong_label_number != 0 and wrong_label_number / len(demos_indexes) != self.label_wrong_rate:
             warnings.warn("The number of wrong labels is not an integer.")
-        demo_lines = []
+        demonstration_fragments = []
         query_line = []
         
         wrong_labels = self._random_for_label_error.sample_n_elements_from_list(demos_indexes, wrong_label_number, allow_repetition = False)
+        self._get_compiled_template()
         for demosindex in demos_indexes:
             if demosindex < 0 or demosindex >= len(self._triplet_dataset.demonstration):
                 raise ValueError("Index out of range.")
-            label_token = self._triplet_dataset.demonstration.get_label(demosindex)
-            if demosindex in wrong_labels:
-                label_token = self._triplet_dataset.demonstration.get_label_space()[
-                    (self._triplet_dataset.demonstration.find_index_from_label(label_token) + 1) % len(self._triplet_dataset.demonstration.get_label_space())
-                ]
-            demo_lines.append((self._triplet_dataset.demonstration.get_input_text(demosindex), label_token))
+            # The rendered demonstration only depends on the index and whether its label is corrupted.
+            fragment_key = (demosindex, demosindex in wrong_labels)
+            fragment = self._fragment_cache.get(fragment_key)
+            if fragment is None:
+                label_token = self._triplet_dataset.demonstration.get_label(demosindex)
+                if fragment_key[1]:
+                    label_token = self._triplet_dataset.demonstration.get_label_space()[
+                        (self._triplet_dataset.demonstration.find_index_from_label(label_token) + 1) % len(self._triplet_dataset.demonstration.get_label_space())
+                    ]
+                fragment = self._render_demonstration((self._triplet_dataset.demonstration.get_input_text(demosindex), label_token))
+                self._fragment_cache[fragment_key] = fragment
+            demonstration_fragments.append(fragment)
         if self.pseudo_prompt:
             query_line = next(self.pseudo_prompt)
         else:
             if query_index < 0 or query_index >= len(self._triplet_dataset.test):
                 raise ValueError("Index out of range.")
             query_line = self._triplet_dataset.test.get_input_text(query_index)
-        return self.write_prompt_from_dataline(demo_lines, query_line, self.cut_by_length)
+        prompt = self._assemble_prompt(demonstration_fragments, query_line, self.cut_by_length)
+        if self._tokenizer is not None and not self._noisy_channel and self.cut_by_length == 0:
+            return self._attach_input_ids(prompt, demonstration_fragments)
+        return prompt
     
     def write_prompt_from_dataline(self, demos_lines: list[(list[str], str)], query_line: list[str], cut_by_length = 0):
         """
@@ -514,33 +829,7 @@ class prompt_writter():
             Return: List[str]: prompts for every label token.
         """
 
-        if self._noisy_channel:
-            ret = []
-            for label in self._label_space:
-                prompt = self._instruction
-                for demos in demos_lines:
-                    prompt += self._label_prefix + self._label_space[self._triplet_dataset.demonstration.find_index_from_label(demos[1])] + self._label_affix
-                    for i in range(self._triplet_dataset.demonstration.get_input_element_numbers()):
-                        prompt += self._input_text_prefixes[i] + demos[0][i] + self._input_text_affixes[i]
-                prompt += self._label_prefix + label + self._label_affix + self._query_prefix
-                for i in range(self._triplet_dataset.test.get_input_element_numbers()):
-                    prompt += self._input_text_prefixes[i] + query_line[i] + self._input_text_affixes[i]
-                ret.append(prompt[:len(prompt) - cut_by_length])
-            return ret
-            
-        # DIRECT
-        # Return: str
-        else:
-            prompt = self._instruction
-            for demos in demos_lines:
-                for i in range(self._triplet_dataset.demonstration.get_input_element_numbers()):
-                    prompt += self._input_text_prefixes[i] + demos[0][i] + self._input_text_affixes[i]
-                prompt += self._label_prefix + self._label_space[self._triplet_dataset.demonstration.find_index_from_label(demos[1])] + self._label_affix
-            prompt += self._query_prefix
-            for i in range(self._triplet_dataset.test.get_input_element_numbers()):
-                prompt += self._input_text_prefixes[i] + query_line[i] + self._input_text_affixes[i]
-            prompt += self._label_prefix
-            return prompt[:len(prompt) - cut_by_length]
+        return self._assemble_prompt([self._render_demonstration(demos) for demos in demos_lines], query_line, cut_by_length)
     
     def example(self, k = 8):
         if k < 0 or k > len(self._triplet_dataset.demonstration):
@@ -1,8 +1,34 @@
-from . import configs, functional, stable_random, dataset_interface
+from . import configs, functional, stable_random, dataset_interface, checkpoint, prediction_cache
+import asyncio
+import concurrent.futures
 import copy
+import hashlib
+import inspect
+import json
 import warnings
 import functools
 
+# The default number of the forward_inference calls in flight in the asynchronous mode of auto_run.
+DEFAULT_MAX_CONCURRENCY = 16
+
+def _is_coroutine_function(function):
+    # True for an `async def` function, a functools.partial of it, or an object with an `async def __call__`.
+    return inspect.iscoroutinefunction(function) or inspect.iscoroutinefunction(getattr(function, "__call__", None))
+
+def config_fingerprint(prompt_config: dict) -> str:
+    # The sha256 of a single_experimentor.get_prompt_config().
+    return hashlib.sha256(json.dumps(prompt_config, sort_keys = True).encode("utf-8")).hexdigest()
+
+def _run_coroutine(coroutine):
+    # Run the coroutine to the end and return its result.
+    # If an event loop is already running in this thread (e.g. in Jupyter), run it in a new thread with its own loop.
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    with concurrent.futures.ThreadPoolExecutor(max_workers = 1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
+
 class single_experimentor():
     """
         The main experimentor for this toolkit.
@@ -36,6 +62,11 @@ class single_experimentor():
             __call__: The callable method for the experiment.
                 - forward_inference: callable; The forward inference function.
                 - batched_inference: bool; If True, the forward_inference function should be a function that takes a list of prompts and returns a list of logits for each label.
+                - chunk_size: int or None; With batched_inference, input the prompts into the forward_inference chunk by chunk instead of all at once.
+                - max_concurrency, executor, checkpoint_directory: See auto_run.
+            iter_prompts: Lazily yield the prompts in chunks of (global_index, test_index, repeat, prompt, ground_truth).
+                - chunk_size: int; The maximum number of prompts in one chunk.
+                - start, end: int or None; Only yield the prompts with global_index in [start, end). With `start`, the prompts are the same as those of the first run of a newly built experimentor.
             reset_demonstration_sampler: Reset the demonstration sampler to the default state. The anti-operation of set_demonstration_sampler.
             get_prompt_writter_from_dataline: Get the function prompt_former.write_prompt_from_dataline.
             get_label_space: Get the label space of the dataset.
@@ -45,6 +76,12 @@ class single_experimentor():
                 - forward_inference: callable; The forward inference function defined by user. See the prefabricate_inference library as examples. 
                     (prompt: str, label_space: list[str]) -> list[float] <logits> or int <label>. OR (prompts: list[str], label_space: list[str]) -> list[list[float]] <logits> or list[int] <label>.
                 - batched_inference: bool; If True, the forward_inference function should be a function that takes a list of prompts and returns a list of logits for each label.
+                - max_concurrency: int or None; For an `async def` forward_inference, the max number of the calls awaited at the same time. The results are still collected in the order of the prompts.
+                - executor: int, concurrent.futures.Executor or None; Run the (non-batched) forward_inference calls in a thread pool of this size, or in the given executor, with at most max_concurrency calls in flight.
+                - checkpoint_directory: str, checkpoint.checkpoint_directory or None; Record each prediction durably in this directory as it completes. A restarted run skips the recorded prompts.
+            get_run_config: The configuration (dataset, k, sampler, templates, ...) that determines the prompts. A checkpoint is only resumed with the same configuration.
+            get_prompt_config / get_config_fingerprint: get_run_config without the experimentor type and bias type (which don't change the prompts by themselves) / its sha256.
+                - Two experimentors with the same fingerprint build the same prompts with the same ground truth, so their outputs are interchangeable (e.g. Normal and Post_bias).
             calibration_set: Get the calibration set of the dataset.
             demonstration_set: Get the demonstration set of the dataset.
             test_set: Get the test set of the dataset.
@@ -84,7 +121,7 @@ class single_experimentor():
         
         self.prompt_former = dataset_interface.prompt_writter(self.triplet_dataset, noisy_channel)
         self.demonstration_sampler = dataset_interface.demonstration_sampler(self._k, len(self.triplet_dataset.demonstration), repeat_times * len(self.triplet_dataset.test))
-        self._default_demonstration_sampler = copy.deepcopy(self.demonstration_sampler)
+        self._default_demonstration_sampler = self.demonstration_sampler.copy()
         self._default_repeat_times = repeat_times
         self._repeat_times = repeat_times
         self.metrics = metrics
@@ -95,8 +132,17 @@ class single_experimentor():
     def __len__(self):
         return len(self.triplet_dataset.test) * self._repeat_times
 
-    def __call__(self, forward_inference: callable = None, input_prediction = None, batched_inference = False, return_outputs = False):
-        return self.auto_run(forward_inference, preentered_prediction = input_prediction, batched_inference = batched_inference, return_outputs = return_outputs)
+    def __call__(self, forward_inference: callable = None, input_prediction = None, batched_inference = False, return_outputs = False, chunk_size = None, max_concurrency = None, executor = None, checkpoint_directory = None):
+        return self.auto_run(
+            forward_inference, 
+            preentered_prediction = input_prediction, 
+            batched_inference = batched_inference, 
+            return_outputs = return_outputs, 
+            chunk_size = chunk_size, 
+            max_concurrency = max_concurrency, 
+            executor = executor, 
+            checkpoint_directory = checkpoint_directory
+        )
     
     def __str__(self) -> str:
         ret = ("--- single experimentor ---\n" +
@@ -111,10 +157,17 @@ class single_experimentor():
     def __repr__(self) -> str:
         return self.__str__()
 
+    def _get_demonstration_indexes(self, index: int):
+        # The demonstration indexes of the `index`-th prompt.
+        if isinstance(self.demonstration_sampler, dataset_interface.demonstration_sampler):
+            # Read the row in place, without copying it.
+            return self.demonstration_sampler.get_sampled_indexes_view(index)
+        return self.demonstration_sampler[index]
+
     def _get_prompts_for_test_sample(self, test_sample_index: int, repeat_time: int):
         # repeat_time_from_0
         index = test_sample_index + repeat_time * len(self.triplet_dataset.test)
-        demos_indexes = self.demonstration_sampler[index]
+        demos_indexes = self._get_demonstration_indexes(index)
         if len(demos_indexes) != self._k:
             warnings.warn("The length of the demonstration indexes should be equal to k, in test index: " + str(index))
         return self.prompt_former.write_prompt(demos_indexes, test_sample_index)
@@ -128,7 +181,7 @@ class single_experimentor():
         self.reset_demonstration_sampler()
         self._k = k
         self.demonstration_sampler = dataset_interface.demonstration_sampler(self._k, len(self.triplet_dataset.demonstration), self._repeat_times * len(self.triplet_dataset.test))
-        self._default_demonstration_sampler = copy.deepcopy(self.demonstration_sampler)
+        self._default_demonstration_sampler = self.demonstration_sampler.copy()
 
     def get_k(self):
         return self._k
@@ -136,63 +189,40 @@ class single_experimentor():
     def get_repeat_times(self):
         return self._repeat_times
     
+    def _get_label_presence(self):
+        # For each row of the (default) demonstration sampler: whether the ground truth label of its query appears in its demonstrations.
+        # Returns (presence, query_labels, demonstration_labels).
+        demonstration_labels = self.triplet_dataset.get_demonstration_label_indexes()
+        query_labels = self.triplet_dataset.get_default_ground_truth_label_indexes()
+        matrix_labels = [demonstration_labels[index] for index in self.demonstration_sampler.export_matrix()]
+        presence = [
+            query_labels[i % len(query_labels)] in matrix_labels[i * self._k : (i + 1) * self._k]
+            for i in range(len(self.triplet_dataset.test) * self._repeat_times)
+        ]
+        return presence, query_labels, demonstration_labels
+
     def set_out_of_domain_mode(self):
         self.reset_demonstration_sampler()
-        # wash the demonstration sampler
-        wash_list = []
-        for i in range(len(self.triplet_dataset.test) * self._repeat_times):
-            label = self.triplet_dataset.get_default_ground_truth_label_index(i % len(self.triplet_dataset.test))
-            demonstration_indexes = self.demonstration_sampler[i]
-            for index in demonstration_indexes:
-                if self.triplet_dataset.demonstration.find_index_from_label(self.triplet_dataset.demonstration[index][1]) == label:
-                    wash_list.append(i)
-                    break
-
-        for i in wash_list:
-            label = self.triplet_dataset.get_default_ground_truth_label_index(i % len(self.triplet_dataset.test))
-            success = False
-            while True:
-                success = True
-                new_sample = self.demonstration_sampler._get_next_sample()
-                for index in new_sample:
-                    if self.triplet_dataset.demonstration.find_index_from_label(self.triplet_dataset.demonstration[index][1]) == label:
-                        success = False
-                        break
-                if success:
-                    break
-            self.demonstration_sampler._set_sample(i, new_sample)
+        # wash the demonstration sampler: resample the rows with the query label in the demonstrations.
+        presence, query_labels, demonstration_labels = self._get_label_presence()
+        wash_list = [i for i, label_exist in enumerate(presence) if label_exist]
+        self.demonstration_sampler._resample(
+            wash_list, 
+            lambda i, sample: all(demonstration_labels[index] != query_labels[i % len(query_labels)] for index in sample)
+        )
 
     def set_in_domain_mode(self):
         self.reset_demonstration_sampler()
-        # wash the demonstration sampler
-        wash_list = []
-        for i in range(len(self.triplet_dataset.test) * self._repeat_times):
-            label = self.triplet_dataset.get_default_ground_truth_label_index(i % len(self.triplet_dataset.test))
-            demonstration_indexes = self.demonstration_sampler[i]
-            label_exist = False
-            for index in demonstration_indexes:
-                if self.triplet_dataset.demonstration.find_index_from_label(self.triplet_dataset.demonstration[index][1]) == label:
-                    label_exist = True
-                    break
-            if not label_exist:
-                wash_list.append(i)
-
-        for i in wash_list:
-            label = self.triplet_dataset.get_default_ground_truth_label_index(i % len(self.triplet_dataset.test))
-            success = False
-            while True:
-                success = False
-                new_sample = self.demonstration_sampler._get_next_sample()
-                for index in new_sample:
-                    if self.triplet_dataset.demonstration.find_index_from_label(self.triplet_dataset.demonstration[index][1]) == label:
-                        success = True
-                        break
-                if success:
-                    break
-            self.demonstration_sampler._set_sample(i, new_sample)
+        # wash the demonstration sampler: resample the rows without the query label in the demonstrations.
+        presence, query_labels, demonstration_labels = self._get_label_presence()
+        wash_list = [i for i, label_exist in enumerate(presence) if not label_exist]
+        self.demonstration_sampler._resample(
+            wash_list, 
+            lambda i, sample: any(demonstration_labels[index] == query_labels[i % len(query_labels)] for index in sample)
+        )
 
     def reset_demonstration_sampler(self):
-        self.demonstration_sampler = copy.deepcopy(self._default_demonstration_sampler)
+        self.demonstration_sampler = self._default_demonstration_sampler.copy()
         self._repeat_times = self._default_repeat_times
 
     def get_prompt_writter_from_dataline(self):
@@ -222,6 +252,183 @@ class single_experimentor():
                 ret.append(prompt)
         return ret
 
+    def iter_prompts(self, chunk_size: int = 64, start: int = None, end: int = None):
+        # Lazily build the prompts in the order of `prompt_set`, and yield them in chunks (lists) of at most `chunk_size` items:
+        #   (global_index, test_index, repeat, prompt, ground_truth), where global_index = test_index + repeat * len(test set).
+        # Only one chunk of prompts is held in memory at a time.
+        # If `start` is given, the prompt writter is seeked to the `start`-th prompt (see prompt_writter.seek_prompts), so the prompts before are not built;
+        #   otherwise the prompts are built from the first one, continuing the pseudo queries of the former runs.
+        if chunk_size <= 0:
+            raise ValueError("chunk_size should be a positive integer.")
+        total = self._repeat_times * len(self.triplet_dataset.test)
+        if end is None:
+            end = total
+        if start is not None:
+            if start < 0 or start > end or end > total:
+                raise ValueError("The prompt range [start, end) should be in [0, " + str(total) + "].")
+            self.prompt_former.seek_prompts(start, (len(self._get_demonstration_indexes(index)) for index in range(start)))
+        else:
+            start = 0
+        chunk = []
+        for global_index in range(start, end):
+            time, index = divmod(global_index, len(self.triplet_dataset.test))
+            chunk.append((
+                global_index, 
+                index, 
+                time, 
+                self._get_prompts_for_test_sample(index, time), 
+                self.triplet_dataset.get_default_ground_truth_label_index(index)
+            ))
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if len(chunk) > 0:
+            yield chunk
+
+    def get_run_config(self):
+        # The JSON-serializable configuration that determines the prompts and their order.
+        if isinstance(self.demonstration_sampler, dataset_interface.demonstration_sampler):
+            sampler_bytes = self.demonstration_sampler.export_matrix().tobytes()
+        else:
+            sampler_bytes = str([list(row) for row in self.demonstration_sampler]).encode("utf-8")
+        return {
+            "experimentor": type(self).__name__,
+            "bias_type": self.bias_type,
+            "dataset": self.triplet_dataset.test.get_dataset_name(),
+            "k": self._k,
+            "repeat_times": self._repeat_times,
+            "test_number": len(self.triplet_dataset.test),
+            "demonstration_number": len(self.triplet_dataset.demonstration),
+            "calibration_number": len(self.triplet_dataset.calibration),
+            "demonstration_sampler": hashlib.sha256(sampler_bytes).hexdigest(),
+            "template": self.prompt_former.get_config_dict(),
+            "pseudo_query": self._get_pseudo_query_config(),
+        }
+
+    def _get_pseudo_query_config(self):
+        pseudo_prompt = getattr(self.prompt_former, "pseudo_prompt", None)
+        if pseudo_prompt is None:
+            return None
+        if hasattr(pseudo_prompt, "get_config"):
+            return pseudo_prompt.get_config()
+        return type(pseudo_prompt).__name__
+
+    def get_prompt_config(self):
+        ret = self.get_run_config()
+        del ret["experimentor"]
+        del ret["bias_type"]
+        return ret
+
+    def get_config_fingerprint(self):
+        return config_fingerprint(self.get_prompt_config())
+
+    def _checkpoint_inference(self, forward_inference, checkpoint_file, batched_inference: bool, chunk_size):
+        # Infer the prompts not recorded in the checkpoint_file, and record the results as they complete (one call for each chunk with batched_inference).
+        # All the prompts are still built in order, so the stateful prompt formers (e.g. the pseudo queries of the domain bias) give the same prompts as in an uninterrupted run.
+        total_samples = len(self.triplet_dataset.test) * self._repeat_times
+        label_space = self.prompt_former.get_label_space()
+        if len(checkpoint_file) > 0:
+            print("Resuming from the checkpoint {}: {} in {} recorded.\n".format(checkpoint_file.path, len(checkpoint_file), total_samples))
+        if batched_inference:
+            chunk_size = chunk_size if chunk_size is not None else max(total_samples, 1)
+        else:
+            chunk_size = 1
+        for chunk in self.iter_prompts(chunk_size):
+            lines = [line for line in chunk if line[0] not in checkpoint_file.completed]
+            if batched_inference and len(lines) > 0:
+                results = forward_inference(prompt = [line[3] for line in lines], label_space = label_space)
+                if len(results) != len(lines):
+                    raise ValueError("The forward_inference should return one result for each prompt.")
+                checkpoint_file.append(zip([line[0] for line in lines], results))
+            else:
+                for line in lines:
+                    checkpoint_file.append([(line[0], forward_inference(prompt = line[3], label_space = label_space))])
+            print("\r", end="")
+            print("Process: {}%, {} in {}".format(
+                int((chunk[-1][0] + 1) / total_samples * 100), 
+                (chunk[-1][0] + 1), 
+                total_samples
+            ), ">>" * int(chunk[-1][0] / total_samples * 32), end="")
+        return [checkpoint_file.completed[index] for index in range(total_samples)]
+
+    def _collect_ground_truth(self):
+        # The ground-truth label indexes in the order of `prompt_set`, counted into `label_dis`.
+        ground_truth = []
+        for time in range(self._repeat_times):
+            for index in range(len(self.triplet_dataset.test)):
+                ground_truth.append(self.triplet_dataset.get_default_ground_truth_label_index(index))
+                self.label_dis[ground_truth[-1]] += 1
+        return ground_truth
+
+    async def _async_inference(self, forward_inference, max_concurrency: int):
+        # Await forward_inference on each prompt with `max_concurrency` workers, which take the prompts one by one from a shared lazy iterator.
+        # Returns the results in the order of `prompt_set`.
+        total_samples = len(self.triplet_dataset.test) * self._repeat_times
+        label_space = self.prompt_former.get_label_space()
+        prediction = [None] * total_samples
+        lines = (line for chunk in self.iter_prompts(1) for line in chunk)
+        finished = 0
+        async def worker():
+            nonlocal finished
+            for line in lines:
+                prediction[line[0]] = await forward_inference(prompt = line[3], label_space = label_space)
+                finished += 1
+                print("\r", end="")
+                print("Process: {}%, {} in {}".format(
+                    int(finished / total_samples * 100), 
+                    finished, 
+                    total_samples
+                ), ">>" * int((finished - 1) / total_samples * 32), end="")
+        await asyncio.gather(*[worker() for _ in range(min(max_concurrency, total_samples))])
+        return prediction
+
+    def _executor_inference(self, forward_inference, executor, max_concurrency):
+        # Submit forward_inference on each prompt to the executor, with at most `max_concurrency` calls in flight.
+        # Only the calling thread builds the prompts and writes the results, so the bookkeeping needs no lock. Returns the results in the order of `prompt_set`.
+        own_executor = isinstance(executor, int)
+        if own_executor:
+            if executor < 1:
+                raise ValueError("The number of threads should be a positive integer.")
+            if max_concurrency is None:
+                max_concurrency = 2 * executor
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers = executor)
+        elif max_concurrency is None:
+            max_concurrency = DEFAULT_MAX_CONCURRENCY
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency should be a positive integer.")
+        total_samples = len(self.triplet_dataset.test) * self._repeat_times
+        label_space = self.prompt_former.get_label_space()
+        prediction = [None] * total_samples
+        in_flight = {} # future -> global_index
+        finished = 0
+        def collect():
+            # Wait for at least one call in flight, and store the results of the finished ones.
+            nonlocal finished
+            done, _ = concurrent.futures.wait(in_flight, return_when = concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                prediction[in_flight.pop(future)] = future.result()
+                finished += 1
+                print("\r", end="")
+                print("Process: {}%, {} in {}".format(
+                    int(finished / total_samples * 100), 
+                    finished, 
+                    total_samples
+                ), ">>" * int((finished - 1) / total_samples * 32), end="")
+        try:
+            for chunk in self.iter_prompts(max_concurrency):
+                for line in chunk:
+                    while len(in_flight) >= max_concurrency:
+                        collect()
+                    in_flight[executor.submit(forward_inference, prompt = line[3], label_space = label_space)] = line[0]
+            while len(in_flight) > 0:
+                collect()
+        finally:
+            for future in in_flight:
+                future.cancel()
+            if own_executor:
+                executor.shutdown(wait = True)
+        return prediction
+
     def auto_run(
         self, 
         forward_inference: callable = None, 
@@ -234,8 +441,20 @@ class single_experimentor():
             # If enabled, we will input all the prompts into the forward_inference; and if disabled, we will input the prompt into the forward_inference one by one
         return_outputs = False, 
             # If True, the outputs will be returned.
-        _previous_prediction = None 
+        chunk_size = None, 
+            # Only for batched inference. If given, the prompts are built lazily and inputted into the forward_inference chunk by chunk (at most chunk_size prompts for each call), 
+            # so that the whole prompt set is never held in memory.
+        max_concurrency = None, 
+            # Only for an asynchronous forward_inference (async def (prompt: str, label_space: list[str])), which is detected automatically, or with the executor. The max number of the calls in flight. Default: DEFAULT_MAX_CONCURRENCY (2 * the number of threads for an int executor).
+        executor = None, 
+            # Only for the non-batched, non-asynchronous forward_inference. An int for the number of threads in a new thread pool, or a concurrent.futures.Executor, to run the forward_inference calls concurrently. The results are still collected in the order of the prompts.
+        checkpoint_directory = None, 
+            # A directory path or a checkpoint.checkpoint_directory. If given, each prediction is appended durably to a file in it as it completes, and a restarted run (with the same configuration, see get_run_config) only infers the prompts not recorded yet.
+            # Not for the asynchronous forward_inference or the executor. With batched_inference, the results are recorded chunk by chunk (see chunk_size).
+        _previous_prediction = None, 
             # If you need to connect multiple inference results, please set it to the previous prediction.
+        _checkpoint_pass = None 
+            # The index of the pass of a multi-pass experimentor, to use one checkpoint file for each pass.
     ):
         # The forward_inference function should be a callable that takes a prompt and returns a list of label logits or a label index.
         # We encourage the forward_inference function to be a function that takes a prompt and returns a list of logits for each label, so that we can calculate more metrics.
@@ -253,9 +472,33 @@ class single_experimentor():
         total_samples = len(self.triplet_dataset.test) * self._repeat_times
 
         # INFERENCE
+        if executor is not None and (batched_inference or _is_coroutine_function(forward_inference)):
+            raise ValueError("The executor can only be used with a non-batched, non-asynchronous forward_inference.")
+        if checkpoint_directory is not None and (executor is not None or (not batched_inference and _is_coroutine_function(forward_inference))):
+            raise ValueError("The checkpoint_directory can't be used with the executor or an asynchronous forward_inference.")
         if preentered_prediction is None and forward_inference is not None:
             print("\nStart testing the forward inference function " + str(forward_inference) + " on the dataset: " + str(self.triplet_dataset.test.dataset_name) + " with bias type: " + self.bias_type + ".\n")
-            if not batched_inference:
+            if checkpoint_directory is not None:
+                # Checkpointed inference: as the iterative or (chunked) batched inference, but the recorded predictions are not inferred again.
+                checkpoint_name = type(self).__name__ + "_" + self.bias_type + "_" + self.triplet_dataset.test.get_dataset_name()
+                if _checkpoint_pass is not None:
+                    checkpoint_name += "_pass" + str(_checkpoint_pass)
+                with checkpoint.as_checkpoint_directory(checkpoint_directory).open(checkpoint_name, self.get_run_config()) as checkpoint_file:
+                    prediction = self._checkpoint_inference(forward_inference, checkpoint_file, batched_inference, chunk_size)
+                ground_truth = self._collect_ground_truth()
+            elif not batched_inference and _is_coroutine_function(forward_inference):
+                # Asynchronous inference: forward_inference: async (prompt: str, label_space: list[str]) -> list[float] <logits> or int <label>. At most max_concurrency calls in flight.
+                if max_concurrency is None:
+                    max_concurrency = DEFAULT_MAX_CONCURRENCY
+                if max_concurrency < 1:
+                    raise ValueError("max_concurrency should be a positive integer.")
+                prediction = _run_coroutine(self._async_inference(forward_inference, max_concurrency))
+                ground_truth = self._collect_ground_truth()
+            elif not batched_inference and executor is not None:
+                # Concurrent inference: forward_inference: (prompt: str, label_space: list[str]) -> list[float] <logits> or int <label>, called in the executor. At most max_concurrency calls in flight.
+                prediction = self._executor_inference(forward_inference, executor, max_concurrency)
+                ground_truth = self._collect_ground_truth()
+            elif not batched_inference:
                 # Iterative inference: forward_inference: (prompt: str, label_space: list[str]) -> list[float] <logits> or int <label>. Inferring one by one.
                 for time in range(self._repeat_times):
                     for index in range(len(self.triplet_dataset.test)):
@@ -270,6 +513,19 @@ class single_experimentor():
                             (index + time * len(self.triplet_dataset.test) + 1), 
                             total_samples
                         ), ">>" * int((index + time * len(self.triplet_dataset.test)) / total_samples * 32), end="")
+            elif chunk_size is not None:
+                # Chunked batched inference: forward_inference: (prompts: list[str], label_space: list[str]) -> list[list[float]] <logits> or list[int] <label>. Inferring chunk by chunk
+                for chunk in self.iter_prompts(chunk_size):
+                    for line in chunk:
+                        ground_truth.append(line[4])
+                        self.label_dis[ground_truth[-1]] += 1
+                    prediction.extend(forward_inference(prompt = [line[3] for line in chunk], label_space = self.prompt_former.get_label_space()))
+                    print("\r", end="")
+                    print("Process: {}%, {} in {}".format(
+                        int((chunk[-1][0] + 1) / total_samples * 100), 
+                        (chunk[-1][0] + 1), 
+                        total_samples
+                    ), ">>" * int(chunk[-1][0] / total_samples * 32), end="")
             else:
                 # Batched inference: forward_inference: (prompts: list[str], label_space: list[str]) -> list[list[float]] <logits> or list[int] <label>. Inferring all at once
                 prompts = []
@@ -279,11 +535,10 @@ class single_experimentor():
                         ground_truth.append(self.triplet_dataset.get_default_ground_truth_label_index(index))
                         self.label_dis[ground_truth[-1]] += 1
                 prediction = forward_inference(prompt = prompts, label_space = self.prompt_former.get_label_space())
+            if isinstance(forward_inference, prediction_cache.prediction_cache):
+                print("\n" + str(forward_inference))
         elif preentered_prediction is not None:
-            for time in range(self._repeat_times):
-                for index in range(len(self.triplet_dataset.test)):
-                    ground_truth.append(self.triplet_dataset.get_default_ground_truth_label_index(index))
-                    self.label_dis[ground_truth[-1]] += 1
+            ground_truth = self._collect_ground_truth()
             prediction = preentered_prediction
         else:
             raise ValueError("You should provide either the forward_inference function or the input_prediction.")
@@ -349,23 +604,63 @@ class prior_bias_experimentor(single_experimentor):
         )
 
     def _gen_empty_query(self):
-        while True:
-            yield ["" for _ in range(len(self.triplet_dataset.calibration[0][0]))]
+        return empty_query_iterator(len(self.triplet_dataset.calibration[0][0]))
     
     def _gen_domain_query(self, sample_set, sample_length):
-        my_random = stable_random.stable_random()
-        while True:
-            ret = []
-            for i in range(len(sample_set[0][0])):
-                output = []
-                while len(output) < sample_length:
-                    random_sample = sample_set[my_random.get_int_from_range(0, len(sample_set) - 1)][0][i]
-                    random_sample = random_sample.split(' ')
-                    random_index = my_random.get_int_from_range(0, len(random_sample) - 1)
-                    output.append(random_sample[random_index])
-                output = ' '.join(output)
-                ret.append(output)
-            yield ret
+        return domain_query_iterator(sample_set, sample_length)
+
+
+class empty_query_iterator():
+    # The infinite pseudo queries of empty strings for the contextual bias. An iterator object instead of a generator, so that it can be pickled.
+    def __init__(self, input_element_numbers: int):
+        self.input_element_numbers = input_element_numbers
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return ["" for _ in range(self.input_element_numbers)]
+
+    def get_config(self):
+        return {"type": "empty"}
+
+    def seek(self, query_index: int):
+        pass
+
+
+class domain_query_iterator():
+    # The infinite pseudo queries of random words from the `sample_set` for the domain bias. An iterator object instead of a generator, so that it can be pickled:
+    #   the state is the sample set (pickled as a reference to the shared dataset) and the position of the random stream.
+    def __init__(self, sample_set, sample_length: int):
+        self.sample_set = sample_set
+        self.sample_length = sample_length
+        self._random = stable_random.stable_random()
+
+    def __iter__(self):
+        return self
+
+    def get_config(self):
+        # The position in the random stream is included: the next queries depend on how many were drawn before.
+        return {"type": "domain", "sample_length": self.sample_length, "position": self._random.get_position()}
+
+    def seek(self, query_index: int):
+        # Go to the `query_index`-th query from the initialization: each query draws the same number of random numbers.
+        self._random.seek(query_index * len(self.sample_set[0][0]) * 2 * self.sample_length)
+
+    def __next__(self):
+        ret = []
+        for i in range(len(self.sample_set[0][0])):
+            output = []
+            # 2 random numbers for each word: the sample and the word in it. Same as 2 * sample_length times of `get_int_from_range`.
+            random_floats = self._random.get_floats(2 * self.sample_length)
+            for j in range(self.sample_length):
+                random_sample = self.sample_set[int((len(self.sample_set) - 1) * random_floats[2 * j])][0][i]
+                random_sample = random_sample.split(' ')
+                random_index = int((len(random_sample) - 1) * random_floats[2 * j + 1])
+                output.append(random_sample[random_index])
+            output = ' '.join(output)
+            ret.append(output)
+        return ret
 
 
 class post_bias_experimentor(single_experimentor):
@@ -418,14 +713,15 @@ class sensitivity_experimentor(single_experimentor):
     def _sensitivity_step(self):
         pass
 
-    def inference_run(self, forward_inference: callable, batched_inference=False, _previous_prediction = False):
+    def inference_run(self, forward_inference: callable, batched_inference=False, _previous_prediction = False, chunk_size = None, checkpoint_directory = None):
+        # checkpoint_directory: see single_experimentor.auto_run. Each pass has its own checkpoint file, so a restarted run skips the finished passes and resumes the current one.
         result_dicts = []
         self._sensitivity_init()
         for i in range(self.test_times):
             if _previous_prediction:
-                result_dicts.append(super().auto_run(forward_inference = forward_inference, batched_inference = batched_inference, _previous_prediction = copy.deepcopy(self.predictions))[0])
+                result_dicts.append(super().auto_run(forward_inference = forward_inference, batched_inference = batched_inference, chunk_size = chunk_size, checkpoint_directory = checkpoint_directory, _previous_prediction = copy.deepcopy(self.predictions), _checkpoint_pass = i)[0])
             else:
-                result_dicts.append(super().auto_run(forward_inference = forward_inference, batched_inference = batched_inference, _previous_prediction = None)[0])
+                result_dicts.append(super().auto_run(forward_inference = forward_inference, batched_inference = batched_inference, chunk_size = chunk_size, checkpoint_directory = checkpoint_directory, _previous_prediction = None, _checkpoint_pass = i)[0])
             if i != self.test_times - 1:
                 self._sensitivity_step()
         return result_dicts
@@ -479,11 +775,17 @@ class GLER_experimentor(sensitivity_experimentor):
             # If enabled, we will input all the prompts into the forward_inference; and if disabled, we will input the prompt into the forward_inference one by one
         return_outputs = False, # Unused
         preentered_prediction = None, # Unused
+        chunk_size = None, # Only for batched_inference. See single_experimentor.auto_run.
+        checkpoint_directory = None, # See sensitivity_experimentor.inference_run.
+        max_concurrency = None, # Not supported: the prompts are inferred one by one.
+        executor = None, # Not supported: the prompts are inferred one by one.
         _previous_prediction = None # Unused
     ):
+        if max_concurrency is not None or executor is not None:
+            raise ValueError("The sensitivity experimentors don't support max_concurrency or executor.")
         result_dicts = {}
         sensitivity_dict = {}
-        intermidiate_results = self.inference_run(forward_inference = forward_inference, batched_inference = batched_inference)
+        intermidiate_results = self.inference_run(forward_inference = forward_inference, batched_inference = batched_inference, chunk_size = chunk_size, checkpoint_directory = checkpoint_directory)
         arguments = [1]
         for i in range(1, self.test_times):
             arguments.append(arguments[-1] - i / (self.test_times - 1))
@@ -547,10 +849,16 @@ class template_sensitivity_experimentor(sensitivity_experimentor):
             # If enabled, we will input all the prompts into the forward_inference; and if disabled, we will input the prompt into the forward_inference one by one
         return_outputs = False, # Unused
         preentered_prediction = None, # Unused
+        chunk_size = None, # Only for batched_inference. See single_experimentor.auto_run.
+        checkpoint_directory = None, # See sensitivity_experimentor.inference_run.
+        max_concurrency = None, # Not supported: the prompts are inferred one by one.
+        executor = None, # Not supported: the prompts are inferred one by one.
         _previous_prediction = None # Unused
     ):
+        if max_concurrency is not None or executor is not None:
+            raise ValueError("The sensitivity experimentors don't support max_concurrency or executor.")
         result_dicts = {}
-        intermidiate_results = self.inference_run(forward_inference, batched_inference, _previous_prediction=True)
+        intermidiate_results = self.inference_run(forward_inference, batched_inference, _previous_prediction=True, chunk_size = chunk_size, checkpoint_directory = checkpoint_directory)
         result_dicts["sensitivity"] = intermidiate_results[-1]
         return result_dicts, True
     
@@ -587,9 +895,15 @@ class demonstration_sensitivity_experimentor(sensitivity_experimentor):
             # If enabled, we will input all the prompts into the forward_inference; and if disabled, we will input the prompt into the forward_inference one by one
         return_outputs = False, # Unused
         preentered_prediction = None, # Unused
+        chunk_size = None, # Only for batched_inference. See single_experimentor.auto_run.
+        checkpoint_directory = None, # See sensitivity_experimentor.inference_run.
+        max_concurrency = None, # Not supported: the prompts are inferred one by one.
+        executor = None, # Not supported: the prompts are inferred one by one.
         _previous_prediction = None # Unused
     ):
+        if max_concurrency is not None or executor is not None:
+            raise ValueError("The sensitivity experimentors don't support max_concurrency or executor.")
         result_dicts = {}
-        intermidiate_results = self.inference_run(forward_inference, batched_inference, _previous_prediction=False)
+        intermidiate_results = self.inference_run(forward_inference, batched_inference, _previous_prediction=False, chunk_size = chunk_size, checkpoint_directory = checkpoint_directory)
         result_dicts["sensitivity"] = intermidiate_results[-1]
         return result_dicts, True
\ No newline at end of file
@@ -1,11 +1,32 @@
 # Adapt datasets into a list_formed class
 from . import stable_random
 from . import configs
+from . import columnar_dataset
 import warnings
+import array
 import copy
 import pickle
 import pkgutil
 
+_SHARED_DATASETS = {} # DICT. (loader, args, kwargs) to basic_datasets_loader. The process-wide dataset registry used by `load_shared_dataset`.
+
+def load_shared_dataset(loader: callable, *args, **kwargs):
+    # Return the process-wide shared instance of `loader(*args, **kwargs)`, which is loaded on the first call.
+    # All the benchmarks use this registry, so each dataset table is loaded only once in one process.
+    # The returned dataset is shared: it should be treated as read-only. Use `split` to get editable copies.
+    key = (loader, args, tuple(sorted(kwargs.items())))
+    if key not in _SHARED_DATASETS:
+        _SHARED_DATASETS[key] = loader(*args, **kwargs)
+        _SHARED_DATASETS[key]._shared_key = key
+    return _SHARED_DATASETS[key]
+
+def _load_shared_dataset_by_key(key):
+    return load_shared_dataset(key[0], *key[1], **dict(key[2]))
+
+def clear_shared_datasets():
+    # Release the shared datasets. The benchmarks built before still hold their own references.
+    _SHARED_DATASETS.clear()
+
 class basic_datasets_loader():
     # Interface for prompt_writer. 
     # Prompt will be structured as: 
@@ -43,17 +64,64 @@ class basic_datasets_loader():
         self.input_element_numbers = 1 # INT. Number of input elements. According to the dataset.
         self.label_space_numbers = 1 # INT. Number of labels. According to the dataset.
         self.dataset_name = "" # STRING. Name of the dataset. Will be overloaded by the dataset.
+
+        # Where the table comes from, so that a pickled dataset only stores this reference instead of the table (see `__getstate__`):
+        self._shared_key = None # The key in the shared dataset registry, if this dataset is loaded by `load_shared_dataset`.
+        self._source = None # (the key of the shared dataset, array of the row indexes in it), if this dataset is split from a shared dataset.
     
+    def __getstate__(self):
+        # Pickle the reference to the shared dataset instead of the table. The receiver rebuilds the table from its own shared dataset registry (or the memory-mapped cache).
+        state = self.__dict__.copy()
+        if state.get("_shared_key") is not None or state.get("_source") is not None:
+            state["table"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.table is None:
+            if getattr(self, "_shared_key", None) is not None:
+                self.table = _load_shared_dataset_by_key(self._shared_key).table
+            elif getattr(self, "_source", None) is not None:
+                shared_table = _load_shared_dataset_by_key(self._source[0]).table
+                self.table = [shared_table[i] for i in self._source[1]]
+
+    def __deepcopy__(self, memo):
+        # A full copy (with the table), not through `__getstate__`.
+        ret = self.__class__.__new__(self.__class__)
+        memo[id(self)] = ret
+        for key, value in self.__dict__.items():
+            setattr(ret, key, copy.deepcopy(value, memo))
+        return ret
+
+    def _detach_source(self):
+        # Called when the table is edited: it no longer matches the shared dataset, so it is pickled in full.
+        self._shared_key = None
+        self._source = None
+
     def _complie_dataset(self):
         # This function is used to transform the huggingface dataset to a table. And shuffle, cut the overlength data.
         # And also calculate the label_space_numbers and input_element_numbers.
         # Finally, delete the _hgf_dataset.
         pass
 
+    def _load_cached_table(self, dataset_file: str):
+        # Load the cached table `cached_dataset/<dataset_file>`.
+        # The memory-mapped columnar version (see `columnar_dataset`) is preferred if it is up to date with the pickled table; otherwise, the pickled table is loaded,
+        #   and its columnar version is written into the user cache folder (never into the package) for the next loads.
+        source_path = columnar_dataset.get_source_path(self._package_path, dataset_file)
+        if source_path is not None:
+            columnar_path = columnar_dataset.find_columnar_file(source_path)
+            if columnar_path is not None:
+                return columnar_dataset.columnar_table(columnar_path)
+        table = pickle.loads(pkgutil.get_data(self._package_path, 'cached_dataset/' + dataset_file))
+        if source_path is not None:
+            columnar_dataset.cache_columnar_table(table, source_path)
+        return table
+
     def _shuffle(self):
         randomer = stable_random.stable_random()
-        index = randomer.sample_index_set(len(self), len(self))
-        self.table = [self.table[i] for i in index]
+        self.table = randomer.shuffle_list(self.table)
+        self._detach_source()
 
     def __len__(self) -> int:
         # Should return the number of elements in the dataset.
@@ -108,6 +176,7 @@ class basic_datasets_loader():
                 if self.get_total_length_of_one_data(i) < length:
                     exclude_list.append(i)
         self.table = [self.table[i] for i in range(0, len(self)) if i not in exclude_list]
+        self._detach_source()
 
     def full_label_token(self):
         warnings.warn(configs.WARNING_SETTINGS["tampering"])
@@ -133,6 +202,7 @@ class basic_datasets_loader():
         if index < 0 or index > len(self):
             raise ValueError("Index out of range.")
         self.table = self.table[0:index]
+        self._detach_source()
         return self
     
     def get_dataset(self):
@@ -265,11 +335,23 @@ class basic_datasets_loader():
         return ret
 
     def split(self, split_indexes: list[list[int]]):
-        ret = []
-        for indexes in split_indexes:
-            new_dataset = copy.deepcopy(self)
-            new_dataset.table = [new_dataset.table[i] for i in indexes]
-            ret.append(new_dataset)
+        # The splits refer to the rows of this table instead of copying them, so that the splits of a shared dataset (see `load_shared_dataset`) don't duplicate the data.
+        table = self.table
+        self.table = None
+        try:
+            ret = []
+            for indexes in split_indexes:
+                new_dataset = copy.deepcopy(self)
+                new_dataset.table = [table[i] for i in indexes]
+                new_dataset._shared_key = None
+                new_dataset._source = None
+                if getattr(self, "_shared_key", None) is not None:
+                    new_dataset._source = (self._shared_key, array.array('q', indexes))
+                elif getattr(self, "_source", None) is not None:
+                    new_dataset._source = (self._source[0], array.array('q', [self._source[1][i] for i in indexes]))
+                ret.append(new_dataset)
+        finally:
+            self.table = table
         return ret
 
 
@@ -302,8 +384,7 @@ class glue_sst2(basic_datasets_loader):
             self._complie_dataset()
         else:
             # with open("./StaICC/cached_dataset/sst2.dataset", "rb") as pickle_file:
-            pickle_file = pkgutil.get_data(self._package_path, 'cached_dataset/sst2.dataset')
-            self.table = pickle.loads(pickle_file)
+            self.table = self._load_cached_table('sst2.dataset')
     
     def _complie_dataset(self):
         self.table = []
@@ -342,8 +423,7 @@ class rotten_tomatoes(basic_datasets_loader):
             self._complie_dataset()
         else:
             # with open("./StaICC/cached_dataset/rotten_tomatoes.dataset", "rb") as pickle_file:
-            pickle_file = pkgutil.get_data(self._package_path, 'cached_dataset/rotten_tomatoes.dataset')
-            self.table = pickle.loads(pickle_file)
+            self.table = self._load_cached_table('rotten_tomatoes.dataset')
     
     def _complie_dataset(self):
         self.table = []
@@ -382,8 +462,7 @@ class financial_phrasebank(basic_datasets_loader):
             self._complie_dataset()
         else:
             # with open("./StaICC/cached_dataset/financial_phrasebank.dataset", "rb") as pickle_file:
-            pickle_file = pkgutil.get_data(self._package_path, 'cached_dataset/financial_phrasebank.dataset')
-            self.table = pickle.loads(pickle_file)
+            self.table = self._load_cached_table('financial_phrasebank.dataset')
     
     def _complie_dataset(self):
         self.table = []
@@ -425,8 +504,7 @@ class sst5(basic_datasets_loader):
             self._complie_dataset()
         else:
             # with open("./StaICC/cached_dataset/sst5.dataset", "rb") as pickle_file:
-            pickle_file = pkgutil.get_data(self._package_path, 'cached_dataset/sst5.dataset')
-            self.table = pickle.loads(pickle_file)
+            self.table = self._load_cached_table('sst5.dataset')
     
     def _complie_dataset(self):
         self.table = []
@@ -470,8 +548,7 @@ class trec(basic_datasets_loader):
             self._complie_dataset()
         else:
             # with open("./StaICC/cached_dataset/trec.dataset", "rb") as pickle_file:
-            pickle_file = pkgutil.get_data(self._package_path, 'cached_dataset/trec.dataset')
-            self.table = pickle.loads(pickle_file)
+            self.table = self._load_cached_table('trec.dataset')
     
     def _complie_dataset(self):
         self.table = []
@@ -515,8 +592,7 @@ class agnews(basic_datasets_loader):
             self._complie_dataset()
         else:
             # with open("./StaICC/cached_dataset/agnews.dataset", "rb") as pickle_file:
-            pickle_file = pkgutil.get_data(self._package_path, 'cached_dataset/agnews.dataset')
-            self.table = pickle.loads(pickle_file)
+            self.table = self._load_cached_table('agnews.dataset')
             
     def _complie_dataset(self):
         self.table = []
@@ -558,8 +634,7 @@ class subjective(basic_datasets_loader):
             self._complie_dataset()
         else:
             # with open("./StaICC/cached_dataset/subjective.dataset", "rb") as pickle_file:
-            pickle_file = pkgutil.get_data(self._package_path, 'cached_dataset/subjective.dataset')
-            self.table = pickle.loads(pickle_file)
+            self.table = self._load_cached_table('subjective.dataset')
     
     def _complie_dataset(self):
         self.table = []
@@ -603,8 +678,7 @@ class tweet_eval_emotion(basic_datasets_loader):
             self._complie_dataset()
         else:
             # with open("./StaICC/cached_dataset/tweet_eval_emotion.dataset", "rb") as pickle_file:
-            pickle_file = pkgutil.get_data(self._package_path, 'cached_dataset/tweet_eval_emotion.dataset')
-            self.table = pickle.loads(pickle_file)
+            self.table = self._load_cached_table('tweet_eval_emotion.dataset')
 
     def _complie_dataset(self):
         self.table = []
@@ -646,8 +720,7 @@ class tweet_eval_hate(basic_datasets_loader):
             self._complie_dataset()
         else:
             # with open("./StaICC/cached_dataset/tweet_eval_hate.dataset", "rb") as pickle_file:
-            pickle_file = pkgutil.get_data(self._package_path, 'cached_dataset/tweet_eval_hate.dataset')
-            self.table = pickle.loads(pickle_file)
+            self.table = self._load_cached_table('tweet_eval_hate.dataset')
 
     def _complie_dataset(self):
         self.table = []
@@ -690,8 +763,7 @@ class hate_speech_18(basic_datasets_loader):
             self._complie_dataset()
         else:
             # with open("./StaICC/cached_dataset/hate_speech_18.dataset", "rb") as pickle_file:
-            pickle_file = pkgutil.get_data(self._package_path, 'cached_dataset/hate_speech_18.dataset')
-            self.table = pickle.loads(pickle_file)
+            self.table = self._load_cached_table('hate_speech_18.dataset')
 
     def _complie_dataset(self):
         self.table = []
@@ -0,0 +1,191 @@
+import hashlib
+import json
+import sqlite3
+import threading
+from .checkpoint import _to_json_value
+
+_SCHEMA = "CREATE TABLE IF NOT EXISTS predictions (key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, last_used INTEGER NOT NULL)"
+_SQL_VARIABLE_LIMIT = 500 # The max number of the keys in one `IN (...)` query.
+
+
+def prediction_key(model_fingerprint: str, prompt, label_space: list[str]) -> str:
+    # The content address of a prediction: sha256 of the model fingerprint, the prompt text (a list of texts for the noisy channel) and the label space.
+    content = json.dumps([model_fingerprint, prompt, list(label_space)], ensure_ascii = False)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+class prediction_cache():
+    """
+        An on-disk cache (SQLite) of the results of a forward_inference function, to be used as the forward_inference of `auto_run`.
+        A result is keyed by the hash of the prompt, the label space and the `model_fingerprint`, so the same prompt is inferred only once across the benchmarks and the reruns:
+            e.g. `Normal` and `Post_bias` (the same prompts), or a rerun after a metrics-only change.
+        Main members:
+            forward_inference: the wrapped function. (prompt: str, label_space: list[str]) -> list[float] <logits> or int <label>;
+                or with batched = True, (prompt: list[str], label_space: list[str]) -> list[list[float]] or list[int].
+            path: str; the SQLite database file. Several caches (or processes) can share one file, with different model fingerprints.
+            model_fingerprint: str; the identity of the model and the inference settings (e.g. "llama-3-8b/fp16/calibration=None"). Change it whenever the results could change.
+            max_bytes: int or None; the max total size of the stored results. The least recently used results are evicted beyond it. None for no limit.
+            batched: bool; if True, the wrapped function is a batched one, which is called once on all the cache misses of a call.
+                A batch-level calibration inside the wrapped function would only see the misses; don't cache such a function.
+            verbose: bool; if True (and batched), print the hit rate after each call.
+        Main methods:
+            __call__: the same prototype as the wrapped function. The hits skip the wrapped function entirely.
+            get_statistics: dict of the numbers of the hits, misses, evictions, and the stored entries and bytes.
+            get_hit_rate: hits / (hits + misses), since the last reset_statistics.
+            reset_statistics: reset the hit / miss / eviction counters.
+            clear: delete all the stored results (of all the fingerprints) in the file.
+            close: close the database. It is reopened on the next call.
+        The cache is thread-safe (the wrapped function is called outside the lock), and picklable (the connection is reopened in the receiver).
+    """
+    def __init__(
+        self,
+        forward_inference: callable,
+        path: str,
+        model_fingerprint: str,
+        max_bytes: int = None,
+        batched: bool = False,
+        verbose: bool = True
+    ):
+        if not isinstance(model_fingerprint, str) or len(model_fingerprint) == 0:
+            raise ValueError("model_fingerprint should be a non-empty string identifying the model.")
+        if max_bytes is not None and max_bytes < 1:
+            raise ValueError("max_bytes should be a positive integer or None.")
+        self.forward_inference = forward_inference
+        self.path = path
+        self.model_fingerprint = model_fingerprint
+        self.max_bytes = max_bytes
+        self.batched = batched
+        self.verbose = verbose
+        self._lock = threading.Lock()
+        self._connection = None
+        self.reset_statistics()
+
+    def __str__(self):
+        return "prediction_cache(" + str(self.forward_inference) + ", model_fingerprint = " + self.model_fingerprint + ", hits = " + str(self._statistics["hits"]) + ", misses = " + str(self._statistics["misses"]) + ")"
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_lock"] = None
+        state["_connection"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        # Called with the lock held.
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, timeout = 60, check_same_thread = False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(_SCHEMA)
+            self._connection.execute("CREATE INDEX IF NOT EXISTS predictions_last_used ON predictions (last_used)")
+            self._connection.commit()
+        return self._connection
+
+    def _next_clock(self, connection):
+        # The LRU clock: one more than the latest use in the file, so it is consistent across the processes sharing the file.
+        return (connection.execute("SELECT MAX(last_used) FROM predictions").fetchone()[0] or 0) + 1
+
+    def _lookup(self, keys: list[str]) -> dict:
+        # Return {key: result} for the stored keys, and mark them as used.
+        found = {}
+        with self._lock:
+            connection = self._connect()
+            unique_keys = list(dict.fromkeys(keys))
+            for start in range(0, len(unique_keys), _SQL_VARIABLE_LIMIT):
+                part = unique_keys[start : start + _SQL_VARIABLE_LIMIT]
+                rows = connection.execute("SELECT key, value FROM predictions WHERE key IN (" + ",".join(["?"] * len(part)) + ")", part).fetchall()
+                for key, value in rows:
+                    found[key] = json.loads(value)
+            if len(found) > 0:
+                clock = self._next_clock(connection)
+                connection.executemany("UPDATE predictions SET last_used = ? WHERE key = ?", [(clock, key) for key in found])
+                connection.commit()
+        return found
+
+    def _store(self, items: list[tuple]):
+        # Store [(key, result), ...], then evict the least recently used results beyond max_bytes.
+        with self._lock:
+            connection = self._connect()
+            clock = self._next_clock(connection)
+            rows = []
+            for key, result in items:
+                value = json.dumps(result)
+                rows.append((key, value, len(value), clock))
+            connection.executemany("INSERT OR REPLACE INTO predictions (key, value, size, last_used) VALUES (?, ?, ?, ?)", rows)
+            if self.max_bytes is not None:
+                total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM predictions").fetchone()[0]
+                if total > self.max_bytes:
+                    evicted = []
+                    for key, size in connection.execute("SELECT key, size FROM predictions ORDER BY last_used ASC"):
+                        if total <= self.max_bytes:
+                            break
+                        evicted.append((key,))
+                        total -= size
+                    connection.executemany("DELETE FROM predictions WHERE key = ?", evicted)
+                    self._statistics["evictions"] += len(evicted)
+            connection.commit()
+
+    def __call__(self, prompt, label_space: list[str]):
+        if not self.batched:
+            key = prediction_key(self.model_fingerprint, prompt, label_space)
+            found = self._lookup([key])
+            if key in found:
+                self._count(hits = 1)
+                return found[key]
+            result = _to_json_value(self.forward_inference(prompt = prompt, label_space = label_space))
+            self._store([(key, result)])
+            self._count(misses = 1)
+            return result
+        keys = [prediction_key(self.model_fingerprint, single_prompt, label_space) for single_prompt in prompt]
+        found = self._lookup(keys)
+        missing = {} # key -> the position of its first prompt, so the duplicated prompts in one call are inferred once.
+        for index, key in enumerate(keys):
+            if key not in found and key not in missing:
+                missing[key] = index
+        if len(missing) > 0:
+            results = self.forward_inference(prompt = [prompt[index] for index in missing.values()], label_space = label_space)
+            if len(results) != len(missing):
+                raise ValueError("The batched forward_inference should return one result for each prompt.")
+            results = [_to_json_value(result) for result in results]
+            self._store(list(zip(missing.keys(), results)))
+            found.update(zip(missing.keys(), results))
+        self._count(hits = len(keys) - len(missing), misses = len(missing))
+        if self.verbose:
+            print("\nPrediction cache: {} hits, {} misses ({:.2f}% hit rate in total).".format(len(keys) - len(missing), len(missing), self.get_hit_rate() * 100))
+        return [found[key] for key in keys]
+
+    def _count(self, hits = 0, misses = 0):
+        with self._lock:
+            self._statistics["hits"] += hits
+            self._statistics["misses"] += misses
+
+    def reset_statistics(self):
+        self._statistics = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get_hit_rate(self):
+        total = self._statistics["hits"] + self._statistics["misses"]
+        if total == 0:
+            return 0.0
+        return self._statistics["hits"] / total
+
+    def get_statistics(self):
+        with self._lock:
+            ret = dict(self._statistics)
+            entries, stored_bytes = self._connect().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM predictions").fetchone()
+        ret["entries"] = entries
+        ret["stored_bytes"] = stored_bytes
+        return ret
+
+    def clear(self):
+        with self._lock:
+            connection = self._connect()
+            connection.execute("DELETE FROM predictions")
+            connection.commit()
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
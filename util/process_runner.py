@@ -0,0 +1,81 @@
+# Run a Normal-like benchmark (Normal, Contextual_bias, Domain_bias, Post_bias) in a pool of worker processes.
+# The experimentors, and optionally contiguous shards of the prompts of each experimentor, are inferred in the workers;
+#   the partial predictions are merged in the global order and the metrics are computed in the main process by `auto_run(list_of_preentered_prediction = ...)`.
+import concurrent.futures
+import multiprocessing
+
+# The state of a worker process: the benchmark and the forward_inference, built once for the worker.
+_worker_state = {}
+
+
+def _initialize_worker(benchmark_factory, inference_factory):
+    _worker_state["benchmark"] = benchmark_factory()
+    _worker_state["forward_inference"] = inference_factory() # E.g. load a model copy or connect to a local server, once for each worker.
+
+
+def _run_shard(experimentor_index: int, start: int, end: int, batched_inference: bool, chunk_size: int):
+    # Infer the prompts [start, end) (in the order of `prompt_set`) of the `experimentor_index`-th experimentor.
+    # The prompt writter is seeked to `start` (see single_experimentor.iter_prompts), so only the prompts of the shard are built, and they are the same as in a single-process run
+    #   even for the experimentors with a stateful pseudo query generator (e.g. Domain_bias).
+    experimentor = _worker_state["benchmark"][experimentor_index]
+    forward_inference = _worker_state["forward_inference"]
+    if isinstance(forward_inference, list):
+        forward_inference = forward_inference[experimentor_index]
+    label_space = experimentor.prompt_former.get_label_space()
+    prediction = []
+    for chunk in experimentor.iter_prompts(chunk_size, start = start, end = end):
+        if batched_inference:
+            prediction.extend(forward_inference(prompt = [line[3] for line in chunk], label_space = label_space))
+        else:
+            for line in chunk:
+                prediction.append(forward_inference(prompt = line[3], label_space = label_space))
+    if len(prediction) != end - start:
+        raise ValueError("The forward_inference should return one result for each prompt.")
+    return prediction
+
+
+def split_shards(length: int, shards: int) -> list[tuple[int, int]]:
+    # Split range(length) into `shards` contiguous [start, end) ranges with sizes differing at most by 1. Empty ranges are dropped.
+    if shards < 1:
+        raise ValueError("shards should be a positive integer.")
+    ret = []
+    for i in range(shards):
+        start = length * i // shards
+        end = length * (i + 1) // shards
+        if end > start:
+            ret.append((start, end))
+    return ret
+
+
+def run_in_processes(
+    benchmark_factory: callable, # () -> a Normal-like benchmark. Picklable (a module-level function or a functools.partial, e.g. functools.partial(Normal, k = 4, lazy_load = True)). Called in the main process and once in each worker; do the prompt template edits in it.
+    inference_factory: callable, # () -> forward_inference, or a list of forward_inference for each dataset. Picklable. Called once in each worker process.
+    processes: int = None, # The number of the worker processes. Default: os.cpu_count().
+    shards: int = 1, # The number of the contiguous shards of the prompts of each experimentor.
+    batched_inference: bool = False, # If True, forward_inference: (prompts: list[str], label_space: list[str]) -> list[list[float]] <logits> or list[int] <label>, called on at most chunk_size prompts at once.
+    chunk_size: int = 64, # The number of the prompts built (and inputted into the batched forward_inference) at once in the workers.
+    return_divided_results: bool = True,
+    mp_context: str = None # The start method of the worker processes: "spawn", "fork" or "forkserver". Use "spawn" if the workers use CUDA.
+):
+    # Returns the same as `benchmark_factory().auto_run(...)` in a single process.
+    benchmark = benchmark_factory()
+    tasks = []
+    for experimentor_index in range(len(benchmark)):
+        for start, end in split_shards(len(benchmark[experimentor_index]), shards):
+            tasks.append((experimentor_index, start, end))
+    predictions = [[None] * len(benchmark[i]) for i in range(len(benchmark))]
+    context = multiprocessing.get_context(mp_context) if mp_context is not None else None
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers = processes,
+        mp_context = context,
+        initializer = _initialize_worker,
+        initargs = (benchmark_factory, inference_factory)
+    ) as executor:
+        futures = {executor.submit(_run_shard, experimentor_index, start, end, batched_inference, chunk_size): (experimentor_index, start, end) for experimentor_index, start, end in tasks}
+        finished = 0
+        for future in concurrent.futures.as_completed(futures):
+            experimentor_index, start, end = futures[future]
+            predictions[experimentor_index][start:end] = future.result()
+            finished += 1
+            print("Shard {} in {} finished: dataset {}, prompts [{}, {}).".format(finished, len(tasks), experimentor_index, start, end))
+    return benchmark.auto_run(return_divided_results = return_divided_results, list_of_preentered_prediction = predictions)
@@ -1,44 +1,200 @@
-import copy
 from . import configs
+import collections
+import copy
 import warnings
 
+# Optional: only used to accelerate the bulk draws in `get_floats`, and imported at the first bulk draw (not at the import of StaICC).
+#   Without NumPy, the same values are computed in pure Python.
+_numpy = None
+_numpy_checked = False
+
+# Below this size, the pure Python loop is faster than building the NumPy arrays.
+_NUMPY_BULK_THRESHOLD = 256
+
 class stable_random():
+    """
+        A linear congruential generator X <- (A * X + B) % C with the constants in `configs.STANDARD_SETTINGS`.
+        Main methods:
+            get_float: the next float in [0, 1).
+            get_floats: the next n floats at once. The same as n times of `get_float`.
+            jump_ahead: skip the next n values in O(log(n)).
+            seek / get_position: go to / get the position in the stream (the number of the values drawn since the seed).
+                So any slice of the sequence can be computed without replaying it from the seed: `seek(start); get_floats(length)`.
+    """
     def __init__(self, seed=configs.STANDARD_SETTINGS["random_seed"]):
         if seed != configs.STANDARD_SETTINGS["random_seed"]:
             warnings.warn(configs.WARNING_SETTINGS["tampering"])
         self._seed = seed
         self._current_X = seed
+        self._position = 0
 
     def _next(self):
         self._current_X = (self._current_X * configs.STANDARD_SETTINGS["random_A"] + configs.STANDARD_SETTINGS["random_B"]) % configs.STANDARD_SETTINGS["random_C"]
+        self._position += 1
         return self._current_X
-    
+
     def get_float(self):
         return self._next() / configs.STANDARD_SETTINGS["random_C"]
-    
+
+    def get_floats(self, n: int) -> list[float]:
+        # Draw the next `n` floats at once. Returns exactly [self.get_float() for _ in range(n)].
+        if n <= 0:
+            return []
+        A = configs.STANDARD_SETTINGS["random_A"]
+        B = configs.STANDARD_SETTINGS["random_B"]
+        C = configs.STANDARD_SETTINGS["random_C"]
+        if n >= _NUMPY_BULK_THRESHOLD and _is_numpy_exact(A, B, C, self._current_X) and _get_numpy() is not None:
+            ret = _numpy_floats(self._current_X, n, A, B, C)
+            self._current_X = _affine_apply(_affine_power(n, A, B, C), self._current_X, C)
+        else:
+            X = self._current_X
+            ret = [0.0] * n
+            for i in range(n):
+                X = (X * A + B) % C
+                ret[i] = X / C
+            self._current_X = X
+        self._position += n
+        return ret
+
+    def jump_ahead(self, steps: int) -> None:
+        # Skip the next `steps` values in O(log(steps)), as if `get_float` was called `steps` times.
+        if steps < 0:
+            raise ValueError("steps should be non-negative.")
+        C = configs.STANDARD_SETTINGS["random_C"]
+        jump = _affine_power(steps, configs.STANDARD_SETTINGS["random_A"], configs.STANDARD_SETTINGS["random_B"], C)
+        self._current_X = _affine_apply(jump, self._current_X, C)
+        self._position += steps
+
+    def seek(self, position: int) -> None:
+        # Go to the `position`-th value of the stream: the next `get_float` returns the same value as the (position + 1)-th `get_float` from the seed.
+        if position < 0:
+            raise ValueError("position should be non-negative.")
+        self._current_X = self._seed
+        self._position = 0
+        self.jump_ahead(position)
+
+    def get_position(self) -> int:
+        return self._position
+
     def get_int_from_range(self, start, end):
         return int(start + (end - start) * self.get_float())
-    
+
     def sample_one_element_from_list(self, list):
         return list[int(self.get_float() * len(list))]
-    
+
+    def _sample_positions(self, length, floats):
+        # Sample len(`floats`) distinct positions from range(length) without repetition, with the pre-drawn `floats`.
+        # Returns exactly what `list.pop(int(self.get_float() * len(list)))` for each float on a list of `length` elements would pick
+        #   (as the positions in the original list), without copying the list.
+        # A Fenwick tree counts the remaining positions: the rank-th remaining one is found by the binary lifting, and removed, both in O(log(length)).
+        #   The tree of all-ones is implicit (the node i covers i & -i positions), so only the removed counts are stored:
+        #   in a dict for a few samples (no O(length) allocation), else in a flat list. O(n log(length)) in total.
+        n = len(floats)
+        if n == 0:
+            return []
+        removed = [0] * (length + 1) if n * 32 > length else collections.defaultdict(int)
+        top = 1 << (length.bit_length() - 1)
+        positions = [0] * n
+        positions[0] = int(floats[0] * length) # Nothing removed yet: the rank is the position.
+        for j in range(1, n):
+            # Remove the previous position.
+            node = positions[j - 1] + 1
+            while node <= length:
+                removed[node] += 1
+                node += node & -node
+            rank = int(floats[j] * (length - j))
+            # The largest node `position` with (remaining positions in [1, position]) <= rank; the answer is the next one (0-based: `position`).
+            position = 0
+            step = top
+            while step:
+                node = position + step
+                if node <= length:
+                    count = (node & -node) - removed[node]
+                    if count <= rank:
+                        position = node
+                        rank -= count
+                step >>= 1
+            positions[j] = position
+        return positions
+
     def sample_n_elements_from_list(self, list, n, allow_repetition=False):
         if allow_repetition == False and n > len(list):
             raise ValueError("n should be less than the length of the list")
-        list_copy = copy.deepcopy(list)
-        ret = []
-        for _ in range(n):
-            loca = int(self.get_float() * len(list_copy))
-            ret.append(list_copy[loca])
-            if not allow_repetition:
-                list_copy.pop(loca)
-        return ret
-    
+        # The sampled elements are deep copies, so changing them doesn't change the elements of `list`.
+        if allow_repetition:
+            positions = [int(random_float * len(list)) for random_float in self.get_floats(n)]
+        else:
+            positions = self._sample_positions(len(list), self.get_floats(n))
+        return copy.deepcopy([list[position] for position in positions])
+
     def sample_index_set(self, sample_number, max_index, allow_repetition=False):
         if allow_repetition == False and sample_number > max_index:
             raise ValueError("sample_number should be less than max_index")
-        index_list = list(range(max_index))
-        return self.sample_n_elements_from_list(index_list, sample_number, allow_repetition)
-    
+        if allow_repetition:
+            return [int(random_float * max_index) for random_float in self.get_floats(sample_number)]
+        return self._sample_positions(max_index, self.get_floats(sample_number))
+
+    def sample_index_sets(self, sample_number, max_index, set_numbers, allow_repetition=False):
+        # The same as `set_numbers` times of `sample_index_set(sample_number, max_index, allow_repetition)`, with the randomness drawn in bulk.
+        if allow_repetition == False and sample_number > max_index:
+            raise ValueError("sample_number should be less than max_index")
+        floats = self.get_floats(sample_number * set_numbers)
+        ret = []
+        for i in range(set_numbers):
+            row_floats = floats[i * sample_number : (i + 1) * sample_number]
+            if allow_repetition:
+                ret.append([int(random_float * max_index) for random_float in row_floats])
+            else:
+                ret.append(self._sample_positions(max_index, row_floats))
+        return ret
+
     def shuffle_list(self, list):
-        return self.sample_n_elements_from_list(list, len(list), allow_repetition=False)
\ No newline at end of file
+        return self.sample_n_elements_from_list(list, len(list), allow_repetition=False)
+
+
+def _get_numpy():
+    global _numpy, _numpy_checked
+    if not _numpy_checked:
+        _numpy_checked = True
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            _numpy = None
+    return _numpy
+
+
+def _affine_power(steps, A, B, C):
+    # Return (a, b) with X_{t + steps} = (a * X_t + b) % C, by the square-and-multiply of the map X -> (A * X + B) % C.
+    ret_a, ret_b = 1, 0
+    a, b = A % C, B % C
+    while steps:
+        if steps & 1:
+            ret_a, ret_b = (a * ret_a) % C, (a * ret_b + b) % C
+        a, b = (a * a) % C, (a * b + b) % C
+        steps >>= 1
+    return ret_a, ret_b
+
+
+def _affine_apply(affine, X, C):
+    return (affine[0] * X + affine[1]) % C
+
+
+def _is_numpy_exact(A, B, C, X):
+    # The uint64 arithmetic wraps modulo 2^64, which is exact modulo C only when C is a power of 2 dividing 2^64.
+    # And X / C is exact in float64 only for C <= 2^53.
+    return C & (C - 1) == 0 and C <= 2 ** 53 and 0 <= A < C and 0 <= B < C and 0 <= X < C
+
+
+def _numpy_floats(X, n, A, B, C):
+    # X_i = A^i * X + B * (A^0 + ... + A^(i-1)), for i in 1..n; computed with the wrapping uint64 cumulative products and sums.
+    with _numpy.errstate(over = 'ignore'):
+        powers = _numpy.cumprod(_numpy.full(n, A, dtype = _numpy.uint64), dtype = _numpy.uint64) # A^1, ..., A^n
+        geometric = _numpy.empty(n, dtype = _numpy.uint64) # A^0 + ... + A^(i-1)
+        geometric[0] = 1
+        if n > 1:
+            geometric[1:] = powers[:-1]
+        geometric = _numpy.cumsum(geometric, dtype = _numpy.uint64)
+        values = powers * _numpy.uint64(X) + _numpy.uint64(B) * geometric
+    values &= _numpy.uint64(C - 1)
+    return (values.astype(_numpy.float64) / float(C)).tolist()